@@ -204,12 +204,36 @@ def _get_s3connection(ud):
     return s3_conn
 
 
+def _use_cached_cm(ud):
+    """
+    Workers that are kept in a pool of stopped instances (i.e., the cluster
+    has ``worker_pool_size`` set) keep a copy of the downloaded CloudMan
+    archive on the root disk because ``CM_HOME`` does not survive an instance
+    stop. Return ``True`` if such a copy should be used (or created).
+    """
+    return ud.get('role') == 'worker' and int(ud.get('worker_pool_size', 0)) > 0
+
+
 def _get_cm(ud):
     log.debug("Deleting /mnt/cm dir before download")
     _run(log, 'rm -rf /mnt/cm')
-    log.info("<< Downloading CloudMan >>")
     _make_dir(log, CM_HOME)
     local_cm_file = os.path.join(CM_HOME, CM_LOCAL_FILENAME)
+    cached_cm_file = os.path.join(CM_BOOT_PATH, CM_LOCAL_FILENAME)
+    if _use_cached_cm(ud):
+        if os.path.exists(cached_cm_file):
+            log.info("<< Using cached CloudMan from %s >>" % cached_cm_file)
+            shutil.copyfile(cached_cm_file, local_cm_file)
+            return True
+        if _download_cm(ud, local_cm_file):
+            shutil.copyfile(local_cm_file, cached_cm_file)
+            return True
+        return False
+    return _download_cm(ud, local_cm_file)
+
+
+def _download_cm(ud, local_cm_file):
+    log.info("<< Downloading CloudMan >>")
     # See if a custom default bucket was provided and use it then
     if 'bucket_default' in ud:
         default_bucket_name = ud['bucket_default']
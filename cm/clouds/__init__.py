@@ -80,3 +80,47 @@ class CloudInterface(object):
         """
         log.warning("Unimplemented")
         pass
+
+    def terminate_instance(self, instance_id, spot_request_id=None):
+        """ Terminate an instance and/or cancel a spot request.
+        """
+        log.warning("Unimplemented")
+        return False
+
+    def bulk_terminate_instances(self, instance_ids, spot_request_ids=None):
+        """ Terminate a number of instances and cancel the spot requests in
+            ``spot_request_ids``. Return the list of instance IDs that were
+            terminated. Clouds that support terminating a number of instances
+            with a single request override this; by default, the instances are
+            terminated one at a time.
+        """
+        for spot_request_id in spot_request_ids or []:
+            self.terminate_instance(None, spot_request_id)
+        return [instance_id for instance_id in instance_ids
+                if self.terminate_instance(instance_id)]
+
+    def stop_instance(self, instance_id):
+        """ Stop (without terminating) an instance.
+        """
+        log.warning("Unimplemented")
+        return False
+
+    def start_instances(self, instance_ids):
+        """ Start previously stopped instances.
+        """
+        log.warning("Unimplemented")
+        return False
+
+    def get_ephemeral_devices(self):
+        """ Return a list of the device names (e.g., ``sdb``) of the
+            instance's ephemeral (instance store) disks.
+        """
+        log.warning("Unimplemented")
+        return []
+
+    def modify_volume_size(self, volume_id, size):
+        """ Grow an existing (possibly attached) volume to ``size`` GB in
+            place. Return ``False`` if the cloud does not support it.
+        """
+        log.warning("Unimplemented")
+        return False
@@ -1,4 +1,5 @@
 import boto
+import re
 import socket
 import time
 import urllib
@@ -16,6 +17,11 @@ from cm.util.decorators import TestFlag
 import logging
 log = logging.getLogger('cloudman')
 
+# EC2 API version that supports the ModifyVolume action
+MODIFY_VOLUME_API_VERSION = '2016-11-15'
+# Error codes returned when an instance ID does not (or no longer) exist
+INSTANCE_NOT_FOUND_CODES = ['InvalidInstanceID.NotFound', 'InstanceNotFound']
+
 
 class EC2Interface(CloudInterface):
 
@@ -31,6 +37,7 @@ class EC2Interface(CloudInterface):
         self._security_groups = []
         self._mac_address = None
         self._subnet_id = None
+        self._ephemeral_devices = None
         try:
             log.debug("Using boto version {0}".format(boto.__version__))
         except:
@@ -91,6 +98,33 @@ class EC2Interface(CloudInterface):
                     pass
         return self.instance_id
 
+    @TestFlag([])
+    def get_ephemeral_devices(self):
+        """
+        Return a list of the device names (e.g., ``sdb``) of the instance's
+        ephemeral (instance store) disks, in order, as listed in the
+        instance's ``block-device-mapping`` metadata.
+        """
+        if self._ephemeral_devices is None:
+            url = 'http://169.254.169.254/latest/meta-data/block-device-mapping/'
+            try:
+                fp = urllib.urlopen(url)
+                names = fp.read().split() if fp.code == 200 else []
+                fp.close()
+                names = [n for n in names if n.startswith('ephemeral')]
+                devices = []
+                for name in sorted(names, key=lambda n: int(n[len('ephemeral'):] or 0)):
+                    fp = urllib.urlopen(url + name)
+                    if fp.code == 200:
+                        devices.append(fp.read().strip())
+                    fp.close()
+                log.debug("Instance ephemeral devices: {0}".format(devices))
+                self._ephemeral_devices = devices
+            except (IOError, ValueError), e:
+                log.warning("Error retrieving ephemeral devices from {0}: {1}".format(url, e))
+                return []
+        return self._ephemeral_devices
+
     @TestFlag(None)
     def get_instance_object(self):
         log.debug("Getting instance object: %s" % self.instance)
@@ -613,7 +647,7 @@ class EC2Interface(CloudInterface):
                 log.debug("Instance {0} terminated.".format(instance_id))
                 return True
         except EC2ResponseError, e:
-            if e.errors[0][0] == 'InstanceNotFound':
+            if e.errors and e.errors[0][0] in INSTANCE_NOT_FOUND_CODES:
                 return True
             else:
                 log.error(
@@ -623,6 +657,131 @@ class EC2Interface(CloudInterface):
                 "Exception terminating instance %s: %s" % (instance_id, ex))
         return False
 
+    @TestFlag(lambda self, instance_ids, spot_request_ids=None: list(instance_ids))
+    def bulk_terminate_instances(self, instance_ids, spot_request_ids=None):
+        """
+        Terminate all the instances in ``instance_ids`` with a single API
+        request and cancel any spot requests in ``spot_request_ids`` with
+        another. Return a list of instance IDs that have been terminated (or
+        no longer exist). Instances reported as not found are dropped from
+        the request, which is then retried for the remaining ones; if the
+        request fails otherwise, the instances are terminated one at a time.
+        """
+        ec2_conn = self.get_ec2_connection()
+        terminated = []
+        if spot_request_ids:
+            try:
+                log.debug("Canceling spot requests {0}".format(spot_request_ids))
+                ec2_conn.cancel_spot_instance_requests(spot_request_ids)
+            except EC2ResponseError, e:
+                log.error("Trouble canceling spot requests {0}: {1}".format(
+                    spot_request_ids, e.message))
+        remaining = list(instance_ids)
+        while remaining:
+            try:
+                log.info("Terminating instances {0}".format(remaining))
+                ec2_conn.terminate_instances(remaining)
+                break
+            except EC2ResponseError, e:
+                missing = self._missing_instance_ids(e, remaining)
+                if not missing:
+                    log.error("EC2 exception terminating instances %s: %s; terminating "
+                              "them one at a time" % (remaining, e.message))
+                    return terminated + [instance_id for instance_id in remaining
+                                         if self._terminate_instance(instance_id)]
+                log.debug("Instances {0} no longer exist.".format(missing))
+                terminated += missing
+                remaining = [i for i in remaining if i not in missing]
+            except Exception, ex:
+                log.error("Exception terminating instances %s: %s" % (remaining, ex))
+                return terminated
+        if not remaining:
+            return terminated
+        terminated += remaining
+        try:
+            # First give the middleware a chance to register the termination
+            time.sleep(3)
+            for r in ec2_conn.get_all_instances(remaining):
+                for inst in r.instances:
+                    if inst.state not in ['shutting-down', 'terminated']:
+                        terminated.remove(inst.id)
+            log.debug("Instances {0} terminated.".format(terminated))
+        except EC2ResponseError, e:
+            log.error("EC2 exception checking instances %s: %s" % (remaining, e.message))
+        except Exception, ex:
+            log.error("Exception checking instances %s: %s" % (remaining, ex))
+        return terminated
+
+    @staticmethod
+    def _missing_instance_ids(e, instance_ids):
+        """
+        Return the IDs among ``instance_ids`` that the ``EC2ResponseError``
+        ``e`` reports as not existing (an empty list for other errors).
+        """
+        if not e.errors or e.errors[0][0] not in INSTANCE_NOT_FOUND_CODES:
+            return []
+        ids = re.findall(r'i-[0-9a-zA-Z]+', e.errors[0][1] or '')
+        return [instance_id for instance_id in instance_ids if instance_id in ids]
+
+    @TestFlag(True)
+    def stop_instance(self, instance_id):
+        """
+        Stop (but do not terminate) instance with ID ``instance_id`` so it can
+        be started again later. Return ``True`` if the stop was initiated,
+        ``False`` otherwise.
+        """
+        ec2_conn = self.get_ec2_connection()
+        try:
+            log.info("Stopping instance {0}".format(instance_id))
+            ec2_conn.stop_instances([instance_id])
+            return True
+        except EC2ResponseError, e:
+            log.error("EC2 exception stopping instance '%s': %s" % (instance_id, e.message))
+        except Exception, ex:
+            log.error("Exception stopping instance %s: %s" % (instance_id, ex))
+        return False
+
+    @TestFlag(True)
+    def start_instances(self, instance_ids):
+        """
+        Start previously stopped instances with IDs ``instance_ids``. Return
+        ``True`` if the start was initiated, ``False`` otherwise.
+        """
+        ec2_conn = self.get_ec2_connection()
+        try:
+            log.info("Starting stopped instance(s) {0}".format(instance_ids))
+            ec2_conn.start_instances(instance_ids)
+            return True
+        except EC2ResponseError, e:
+            log.error("EC2 exception starting instance(s) %s: %s" % (instance_ids, e.message))
+        except Exception, ex:
+            log.error("Exception starting instance(s) %s: %s" % (instance_ids, ex))
+        return False
+
+    @TestFlag(True)
+    def modify_volume_size(self, volume_id, size):
+        """
+        Grow volume ``volume_id`` to ``size`` GB in place (the volume may stay
+        attached and in use). Return ``True`` if the modification was
+        initiated, ``False`` otherwise.
+
+        The ``ModifyVolume`` action is newer than the EC2 API version boto
+        uses so issue the request over a dedicated connection.
+        """
+        ec2_conn = self.get_ec2_connection()
+        try:
+            log.info("Modifying volume {0} size to {1}GB".format(volume_id, size))
+            conn = EC2Connection(self.aws_access_key, self.aws_secret_key,
+                                 region=ec2_conn.region)
+            conn.APIVersion = MODIFY_VOLUME_API_VERSION
+            return conn.get_status('ModifyVolume', {'VolumeId': volume_id,
+                                                    'Size': str(size)}, verb='POST')
+        except EC2ResponseError, e:
+            log.error("EC2 exception modifying volume '%s': %s" % (volume_id, e.message))
+        except Exception, ex:
+            log.error("Exception modifying volume %s: %s" % (volume_id, ex))
+        return False
+
     def _cancel_spot_request(self, request_id):
         ec2_conn = self.get_ec2_connection()
         try:
@@ -3,6 +3,7 @@ import logging
 import logging.config
 import logging.handlers
 import os
+import re
 import sys
 import traceback
 
@@ -17,6 +18,10 @@ DEFAULT_INSTANCE_COMM_TIMEOUT = 360
 DEFAULT_INSTANCE_STATE_CHANGE_WAIT = 800
 DEFAULT_INSTANCE_REBOOT_ATTEMPTS = 5
 DEFAULT_INSTANCE_TERMINATE_ATTEMPTS = 5
+DEFAULT_AUTOSCALING_MAX_INSTANCES_PER_STEP = 10
+# Workers fall back to mounting without ``nconnect`` if the kernel lacks it
+DEFAULT_NFS_MOUNT_OPTIONS = 'rsize=1048576,wsize=1048576,noatime,nconnect=4'
+DEFAULT_ARCHIVE_CACHE_SIZE = 20  # GB
 DEFAULT_INSTANCE_TYPES = {
     "amazon": [
         ("", "Same as Master"),
@@ -62,6 +67,17 @@ DEFAULT_INSTANCE_TYPES = {
         ("custom_instance_type", "Custom instance type")
     ]
 }
+# Approximate hourly on-demand prices (USD) used to rank instance types when
+# autoscaling picks which types to launch. User data can override these by
+# including a ``price`` field with each ``instance_types`` entry.
+DEFAULT_INSTANCE_TYPE_PRICES = {
+    "c3.large": 0.105,
+    "c3.2xlarge": 0.42,
+    "c3.8xlarge": 1.68,
+    "r3.large": 0.166,
+    "r3.2xlarge": 0.665,
+    "r3.8xlarge": 2.66,
+}
 
 
 class ConfigurationError(Exception):
@@ -247,6 +263,81 @@ class Configuration(dict):
             else:
                 return DEFAULT_INSTANCE_TYPES.get("default")
 
+    @property
+    def instance_type_specs(self):
+        """
+        Return the subset of ``instance_types`` whose size is known, as a list
+        of dicts with ``key``, ``cpus``, ``memory`` (in MB) and ``price`` keys.
+
+        Sizes come from the ``cpus`` and ``memory`` (in GB) fields of user
+        data ``instance_types`` entries or are parsed from the default type
+        names (e.g., ``(8 vCPU/15GB RAM)``). If a price is not known, the
+        number of CPUs is used as a stand-in so types can still be ranked.
+        """
+        specs = []
+        type_defs = self.get("instance_types") or \
+            [{'key': key, 'name': name} for key, name in self.instance_types]
+        for type_def in type_defs:
+            key = type_def.get('key')
+            if not key or key == 'custom_instance_type':
+                continue
+            cpus = type_def.get('cpus')
+            memory = type_def.get('memory')
+            if not (cpus and memory):
+                match = re.search(r'(\d+) vCPU/(\d+)GB RAM', type_def.get('name', ''))
+                if not match:
+                    continue
+                cpus, memory = match.groups()
+            price = type_def.get('price', DEFAULT_INSTANCE_TYPE_PRICES.get(key, cpus))
+            specs.append({'key': key, 'cpus': int(cpus),
+                          'memory': int(float(memory) * 1024),
+                          'price': float(price)})
+        return specs
+
+    @property
+    def autoscaling_by_job_requirements(self):
+        """
+        Pick the instance types to add from the pending jobs' requirements
+        (see ``instance_type_specs``) instead of using the autoscaling
+        instance type chosen by the user. Off unless explicitly enabled.
+        """
+        return self.get("autoscaling_by_job_requirements", False)
+
+    @property
+    def worker_pool_size(self):
+        """
+        Number of stopped worker instances to keep for fast scale-up instead
+        of terminating them on scale-down (``0`` disables the pool).
+        """
+        return int(self.get("worker_pool_size", 0))
+
+    @property
+    def autoscaling_max_instances_per_step(self):
+        return int(self.get("autoscaling_max_instances_per_step",
+                            DEFAULT_AUTOSCALING_MAX_INSTANCES_PER_STEP))
+
+    @property
+    def nfs_mount_options(self):
+        """
+        Options used by workers to mount file systems exported by the master,
+        unless a file system sets its own ``nfs_mount_options``.
+        """
+        return self.get("nfs_mount_options", DEFAULT_NFS_MOUNT_OPTIONS)
+
+    @property
+    def archive_cache_dir(self):
+        """
+        Local directory where file system archives are cached. The cache is
+        only useful across cluster restarts so it is disabled unless this is
+        set, and it should point to a persistent file system.
+        """
+        return self.get("archive_cache_dir", None)
+
+    @property
+    def archive_cache_size(self):
+        """Size cap (in GB) of the archive cache (``0`` disables the cache)."""
+        return float(self.get("archive_cache_size", DEFAULT_ARCHIVE_CACHE_SIZE))
+
     @property
     def cloudman_repo_url(self):
         return self.get("CM_url", "https://bitbucket.org/galaxy/cloudman/commits/all?page=tip&search=")
@@ -973,6 +973,25 @@ class CM(BaseController):
         else:
             return json.dumps(ret_dict)
 
+    @expose
+    def autoscaling_history(self, trans, num_entries=None):
+        """
+        Return the Autoscale service's decision counters and the history of
+        recent autoscaling evaluations, optionally limited to the last
+        ``num_entries`` evaluations.
+        """
+        svc = self.app.manager.service_registry.get('Autoscale')
+        if not svc:
+            return json.dumps({'counters': {}, 'history': []})
+        try:
+            num_entries = int(num_entries) if num_entries else None
+        except ValueError:
+            num_entries = None
+        ret_dict = svc.get_decision_log(num_entries)
+        ret_dict['use_autoscaling'] = \
+            self.app.manager.service_registry.is_active('Autoscale')
+        return json.dumps(ret_dict)
+
     @expose
     def update_users_CM(self, trans):
         pass
@@ -18,6 +18,10 @@ log = logging.getLogger('cloudman')
 
 # Time well in the past to seed reboot and last comm times with.
 TIME_IN_PAST = dt.datetime(2012, 1, 1, 0, 0, 0)
+# Number of seconds to wait for a worker being added to the worker pool to
+# reach the 'stopped' state (checked every STOP_POLL_INTERVAL seconds)
+STOP_TIMEOUT = 600
+STOP_POLL_INTERVAL = 10
 
 
 class Instance(object):
@@ -63,7 +67,12 @@ class Instance(object):
         self.slurmd_running = 0
         # NodeName by which this instance is tracked in Slurm
         self.alias = 'w{0}'.format(self.app.number_generator.next())
-        self.worker_status = 'Pending'  # Pending, Wake, Startup, Ready, Stopping, Error
+        self.worker_status = 'Pending'  # Pending, Wake, Startup, Ready, Stopping, Stopped, Error
+        # Set once the worker has completed its first join; only such workers
+        # are kept in the master's pool of stopped workers
+        self.joined = False
+        # Set while the instance is being stopped to be kept in the worker pool
+        self.pooling = False
         self.load = 0
         self.type = 'Unknown'
         self.reboot_required = reboot_required
@@ -286,6 +295,14 @@ class Instance(object):
         inst_terminated = self.app.cloud_interface.terminate_instance(
             instance_id=self.id,
             spot_request_id=self.spot_request_id if self.is_spot() else None)
+        self.terminated(inst_terminated)
+
+    def terminated(self, inst_terminated):
+        """
+        Handle the outcome of a termination request for this instance:
+        ``inst_terminated`` indicates whether the cloud middleware reported
+        the instance as terminated.
+        """
         self.terminate_attempt_count += 1
         if inst_terminated is False:
             log.error("Terminating instance %s did not go smoothly; instance state: '%s'"
@@ -298,6 +315,82 @@ class Instance(object):
             self.inst = None
             self._remove_instance()
 
+    def stop(self):
+        """
+        Stop (rather than terminate) this instance and, once stopped, move it
+        from the list of worker instances into the master's pool of stopped
+        workers (``manager.worker_pool``). If the instance cannot be stopped,
+        terminate it instead.
+        """
+        self.worker_status = "Stopping"
+        t_thread = threading.Thread(target=self.__stop)
+        t_thread.start()
+        return t_thread
+
+    def __stop(self):
+        if self.app.cloud_interface.stop_instance(self.id) and self._wait_until_stopped():
+            self._reset_boot_state()
+            self.worker_status = "Stopped"
+            # Record the CloudMan archive the instance has cached (see
+            # ``manager.get_worker_instances``)
+            self.app.cloud_interface.add_tag(self.inst, 'cm_archive',
+                                             self.app.manager.cm_archive_version)
+            self._remove_instance()
+            self.app.manager.worker_pool.append(self)
+            log.info("Instance {0} stopped and added to the worker pool".format(
+                self.get_desc()))
+        else:
+            log.warning("Could not stop instance {0}; terminating it instead."
+                        .format(self.get_desc()))
+            self.__terminate()
+
+    def _wait_until_stopped(self):
+        """
+        Wait (up to ``STOP_TIMEOUT`` seconds) for the cloud middleware to
+        report this instance as stopped; an instance that is still stopping
+        cannot be started again. The instance may briefly be reported as
+        running after the stop request. Return ``True`` if the instance
+        stopped.
+        """
+        for _ in range(STOP_TIMEOUT / STOP_POLL_INTERVAL):
+            state = self.get_m_state()
+            if state == instance_states.STOPPED:
+                return True
+            elif state not in [instance_states.RUNNING, instance_states.STOPPING]:
+                log.warning("Instance {0} in state '{1}' while waiting for it to stop"
+                            .format(self.get_desc(), state))
+                return False
+            time.sleep(STOP_POLL_INTERVAL)
+        log.warning("Instance {0} did not stop in {1} seconds".format(
+            self.get_desc(), STOP_TIMEOUT))
+        return False
+
+    def start(self):
+        """
+        Mark a previously stopped (pooled) instance as starting again. The
+        instance keeps its ``alias`` so it rejoins the cluster under the same
+        name. Note that this method does not start the instance via the cloud
+        middleware (see ``manager.add_instances``).
+        """
+        self.worker_status = "Pending"
+        self.m_state = instance_states.PENDING
+        self.last_m_state_change = Time.now()
+        self.last_comm = TIME_IN_PAST
+
+    def _reset_boot_state(self):
+        """
+        Reset the fields a worker reports about itself while booting so a
+        restarted instance goes through the regular join handshake.
+        """
+        self.is_alive = False
+        self.public_ip = None
+        self.load = 0
+        self.nfs_data = self.nfs_tools = self.nfs_indices = 0
+        self.nfs_sge = self.nfs_tfs = 0
+        self.get_cert = self.sge_started = self.slurmd_running = 0
+        self.reboot_count = 0
+        self.terminate_attempt_count = 0
+
     def _remove_instance(self, force=False):
         """ A convenience method to remove the current instance from the list
             of worker instances tracked by the master object.
@@ -487,13 +580,18 @@ class Instance(object):
             else:
                 fs_type = "nfs"
                 server = self.app.cloud_interface.get_private_ip()
-                options = None
+                options = fs.nfs_mount_options or self.app.config.nfs_mount_options
+                if fs.read_only:
+                    options = ','.join(o for o in ['ro', options] if o)
+                if fs.worker_cache == 'peer':
+                    self.app.manager.console_monitor.seed_file_system(fs)
             mount_points.append(
                 {'fs_type': fs_type,
                  'server': server,
                  'mount_options': options,
                  'shared_mount_path': fs.get_details()['mount_point'],
-                 'fs_name': fs.get_details()['name']})
+                 'fs_name': fs.get_details()['name'],
+                 'cache': fs.worker_cache})
         jmp = json.dumps({'mount_points': mount_points})
         self.app.manager.console_monitor.conn.send('MOUNT | %s' % jmp, self.id)
         # log.debug("Sent mount points %s to worker %s" % (mount_points, self.id))
@@ -576,6 +674,9 @@ class Instance(object):
                         self.nfs_tfs = mounted_fs.get('transient_nfs', 0)
                         log.debug("Got transient_nfs state on {0}: {1}".format(
                                   self.alias, self.nfs_tfs))
+                        for path, err in body.get('mount_errors', {}).items():
+                            log.error("Instance {0} failed to mount {1}: {2}".format(
+                                      self.get_desc(), path, err))
                     except ValueError, vexc:
                         log.warning('ValueError trying to decode msg: {0}'
                                     .format(vexc))
@@ -629,6 +730,7 @@ class Instance(object):
                 log.info("Waiting on worker instance %s to configure itself." % self.get_desc())
             elif msg_type == "NODE_READY":
                 self.worker_status = "Ready"
+                self.joined = True
                 log.info("Instance %s ready" % self.get_desc())
                 # Make sure the instace is tagged (this is also necessary to do
                 # here for OpenStack because it does not allow tags to be added
@@ -5,6 +5,7 @@ import logging
 import logging.config
 import os
 import shutil
+import socket
 import subprocess
 import threading
 import time
@@ -18,9 +19,12 @@ from cm.services import ServiceType
 from cm.services import service_states
 from cm.services.registry import ServiceRegistry
 from cm.services.data.filesystem import Filesystem
-from cm.util import cluster_status, comm, misc, Time
+from cm.util import cluster_status, comm, instance_states, misc, Time
 from cm.util.decorators import TestFlag, cluster_ready
+from cm.util.disk_usage import df_size, disk_usage
 from cm.util.manager import BaseConsoleManager
+from cm.util.nfs_export import NFSExport
+from cm.util import peer_distribution
 import cm.util.paths as paths
 
 from boto.exception import EC2ResponseError, S3ResponseError
@@ -56,6 +60,10 @@ class ConsoleManager(BaseConsoleManager):
         self.cluster_status = cluster_status.STARTING
         # Number of worker nodes requested by user
         self.num_workers_requested = self.app.config.worker_initial_count
+        # Stopped worker instances kept for fast scale-up (see
+        # ``config.worker_pool_size``); a list of Instance objects
+        self.worker_pool = []
+        self._cm_archive_version = None
         # The actual worker nodes (note: this is a list of Instance objects)
         # (because get_worker_instances currently depends on tags, which is only
         # supported by EC2, get the list of instances only for the case of EC2 cloud.
@@ -238,9 +246,12 @@ class ConsoleManager(BaseConsoleManager):
         method looks through all the file systems and all volumes assoc. with a
         file system and returns the status and progress for the first volume
         going through the snapshot process.
-        In addition, if a file system is marked as needing to 'grow' or sharing
-        the cluster is currently pending but no volumes are currently being
-        snapshoted, the method returns 'configuring' as the status.
+        While a file system is being grown, the volumes being snapshotted are
+        no longer part of the file system so they are looked up among the
+        volumes being replaced. In addition, if a file system is marked as
+        needing to 'grow' or sharing the cluster is currently pending but no
+        volumes are currently being snapshoted, the method returns
+        'configuring' as the status.
 
         :rtype: array of strings of length 2
         :return: A pair of values as strings indicating (1) the status (e.g.,
@@ -248,7 +259,10 @@ class ConsoleManager(BaseConsoleManager):
         """
         fsarr = self.get_services(svc_type=ServiceType.FILE_SYSTEM)
         for fs in fsarr:
-            for vol in fs.volumes:
+            volumes = fs.volumes
+            if fs.grow:
+                volumes = volumes + fs.grow.get('smaller_vol_ids', [])
+            for vol in volumes:
                 if vol.snapshot_status is not None:
                     return (vol.snapshot_status, vol.snapshot_progress)
             # No volume is being snapshoted; check if waiting to 'grow' one
@@ -494,6 +508,10 @@ class ConsoleManager(BaseConsoleManager):
                     err = False
                     filesystem = Filesystem(self.app, fs['name'], svc_roles=ServiceRole.from_string_array(
                         fs['roles']), mount_point=fs.get('mount_point', None))
+                    filesystem.nfs_export_options = fs.get('nfs_export_options', None)
+                    filesystem.nfs_mount_options = fs.get('nfs_mount_options', None)
+                    filesystem.read_only = fs.get('read_only', False)
+                    filesystem.set_worker_cache(fs.get('worker_cache', None))
                     # Based on the kind, add the appropriate file system. We can
                     # handle 'volume', 'snapshot', or 'bucket' kind
                     if fs['kind'] == 'volume':
@@ -916,7 +934,8 @@ class ConsoleManager(BaseConsoleManager):
         appropriate values.
 
         :rtype: dictionary
-        :return: A dictionary with keys `total`, `used`, and `used_percent` as
+        :return: A dictionary with keys `total`, `used` (formatted like
+                 ``df -h``, e.g., ``20G``), and `used_percent` as
                  strings. Also included is a bool `updated` field, which
                  indicates if the disk status values were updated as part of
                  this function call.
@@ -928,15 +947,13 @@ class ConsoleManager(BaseConsoleManager):
         else:
             fs_svc = self.service_registry.get_active('transient_nfs')
         if fs_svc:
-            cmd = ("df -h {0} | sed 1d | awk '{{print $2, $3, $5}}'"
-                   .format(fs_svc.mount_point))
-            disk_usage = misc.getoutput(cmd, quiet=True)
-            disk_usage = disk_usage.split(' ')
-            if len(disk_usage) == 3:
-                disk_status = {'total': disk_usage[0],
-                               'used': disk_usage[1],
-                               'used_percent': disk_usage[2],
-                               'updated': True}
+            usage = disk_usage.usage(fs_svc.mount_point)
+            if usage:
+                # A stale value is still reported but not as an update
+                disk_status = {'total': df_size(usage['total']),
+                               'used': df_size(usage['used']),
+                               'used_percent': usage['used_percent'],
+                               'updated': not usage['stale']}
         return disk_status
 
     def get_cluster_status(self):
@@ -992,15 +1009,58 @@ class ConsoleManager(BaseConsoleManager):
             reservations = self.app.cloud_interface.get_all_instances(filters=filters)
             for reservation in reservations:
                 for inst in reservation.instances:
-                    if inst.state != 'terminated' and inst.state != 'shutting-down':
+                    if inst.state in ['stopped', 'stopping']:
+                        # A previously pooled worker; keep it in the pool unless
+                        # it has cached a different version of CloudMan
+                        cm_archive = self.app.cloud_interface.get_tag(inst, 'cm_archive')
+                        if not cm_archive or cm_archive != self.cm_archive_version:
+                            log.info("Stopped worker instance '%s' has an outdated "
+                                     "copy of CloudMan; terminating it." % inst.id)
+                            self.app.cloud_interface.terminate_instance(inst.id)
+                            continue
+                        i = Instance(self.app, inst=inst, m_state=inst.state)
+                        i.alias = self.app.cloud_interface.get_tag(inst, 'alias') or i.alias
+                        i.type = inst.instance_type
+                        i.joined = True
+                        i.worker_status = 'Stopped'
+                        self.worker_pool.append(i)
+                        log.info("Existing stopped worker instance '%s' added to "
+                                 "the worker pool." % inst.id)
+                    elif inst.state != 'terminated' and inst.state != 'shutting-down':
                         i = Instance(self.app, inst=inst, m_state=inst.state, reboot_required=True)
                         instances.append(i)
                         log.info("Existing worker instance '%s' found alive "
                                  "(will configure it later)." % inst.id)
         except EC2ResponseError, e:
             log.debug("Error checking for live instances: %s" % e)
+        self._reserve_aliases([inst.alias for inst in self.worker_pool])
         return instances
 
+    def _reserve_aliases(self, aliases):
+        """
+        Advance ``app.number_generator`` past the numbers used by the given
+        worker ``aliases`` (e.g., ``w3``), which were restored from instance
+        tags, so newly added workers do not get an alias that is already taken.
+        """
+        numbers = [int(alias[1:]) for alias in aliases
+                   if alias and alias[0] == 'w' and alias[1:].isdigit()]
+        if numbers:
+            while self.app.number_generator.next() < max(numbers):
+                pass
+
+    @property
+    def cm_archive_version(self):
+        """
+        The MD5 checksum of the CloudMan archive this master runs from or
+        ``None`` if the archive is not available. Pooled workers are tagged
+        with it to tell if their cached copy of CloudMan is still current.
+        """
+        if self._cm_archive_version is None:
+            self._cm_archive_version = misc.file_md5(os.path.join(
+                self.app.config.get('cloudman_home', ''),
+                self.app.config.cloudman_source_file_name))
+        return self._cm_archive_version
+
     @TestFlag([])
     def get_attached_volumes(self):
         """
@@ -1235,35 +1295,35 @@ class ConsoleManager(BaseConsoleManager):
         is removed. This can be overridden by setting ``force`` to ``True``. In that
         case, removable instances are removed first, then additional instances are
         chosen at random and removed.
+
+        The chosen instances are removed as a single batch (see
+        ``remove_instance_batch``).
         """
-        num_terminated = 0
+        to_remove = []
         # First look for idle instances that can be removed
         idle_instances = self.get_idle_instances()
         if len(idle_instances) > 0:
             log.debug("Found %s idle instances; trying to remove %s." %
                       (len(idle_instances), num_nodes))
-            for i in range(0, num_nodes):
-                for inst in idle_instances:
-                    if num_terminated < num_nodes:
-                        self.remove_instance(inst.id)
-                        num_terminated += 1
+            for inst in idle_instances:
+                if len(to_remove) < num_nodes and inst not in to_remove:
+                    to_remove.append(inst)
         else:
             log.info("No idle instances found")
-        log.debug("Num to terminate: %s, num terminated: %s; force set to '%s'"
-                  % (num_nodes, num_terminated, force))
+        log.debug("Num to terminate: %s, num idle to terminate: %s; force set to '%s'"
+                  % (num_nodes, len(to_remove), force))
         # If force is set, terminate requested number of instances regardless
         # whether they are idle
-        if force is True and num_terminated < num_nodes:
-            force_kill_instances = num_nodes - num_terminated
-            log.info("Forcefully terminating %s instances." % force_kill_instances)
-            for i in range(force_kill_instances):
-                for inst in self.worker_instances:
-                    if not inst.is_spot() or inst.spot_was_filled():
-                        self.remove_instance(inst.id)
-                        num_terminated += 1
-        if num_terminated > 0:
+        if force is True and len(to_remove) < num_nodes:
+            log.info("Forcefully terminating %s instances." % (num_nodes - len(to_remove)))
+            for inst in self.worker_instances:
+                if len(to_remove) < num_nodes and inst not in to_remove and \
+                   (not inst.is_spot() or inst.spot_was_filled()):
+                    to_remove.append(inst)
+        if to_remove:
+            self.remove_instance_batch(to_remove)
             log.info("Initiated requested termination of instances. Terminating "
-                     "'%s' instances." % num_terminated)
+                     "'%s' instances." % len(to_remove))
         else:
             log.info("Did not terminate any instances.")
 
@@ -1277,21 +1337,114 @@ class ConsoleManager(BaseConsoleManager):
             log.warning("Tried to remove an instance but did not receive instance ID")
             return False
         log.debug("Specific termination of instance '%s' requested." % instance_id)
-        for inst in self.worker_instances:
-            if inst.id == instance_id:
-                inst.worker_status = 'Stopping'
-                log.debug("Set instance {0} state to {1}".format(inst.get_desc(),
-                          inst.worker_status))
-                for job_manager_svc in self.service_registry.active(
-                        service_role=ServiceRole.JOB_MANAGER):
-                    job_manager_svc.remove_node(inst)
-                # Remove the given instance from /etc/hosts files
-                misc.remove_from_etc_hosts(inst.private_ip)
-                self.sync_etc_hosts()
-                # Terminate the instance
-                inst.terminate()
-                log.info("Initiated requested termination of instance. "
-                         "Terminating '%s'." % instance_id)
+        self.remove_instance_batch([inst for inst in self.worker_instances
+                                    if inst.id == instance_id])
+
+    def remove_instance_batch(self, instances):
+        """
+        Remove all the ``instances`` (a list of ``Instance`` objects) from the
+        cluster at once: the job managers remove all the nodes in one go,
+        ``/etc/hosts`` is rewritten and synced to the remaining workers once,
+        and the instances that are not kept in the worker pool are terminated
+        with a single cloud middleware request.
+        """
+        if not instances:
+            return
+        for inst in instances:
+            inst.worker_status = 'Stopping'
+            log.debug("Set instance {0} state to {1}".format(inst.get_desc(),
+                      inst.worker_status))
+        for job_manager_svc in self.service_registry.active(
+                service_role=ServiceRole.JOB_MANAGER):
+            job_manager_svc.remove_nodes(instances)
+        # Remove the given instances from /etc/hosts files
+        misc.remove_from_etc_hosts([inst.private_ip for inst in instances])
+        self.sync_etc_hosts()
+        to_terminate = []
+        for inst in instances:
+            if self._can_pool_instance(inst):
+                inst.stop()
+                log.info("Initiated stopping of instance '%s' to keep it in "
+                         "the worker pool." % inst.id)
+            else:
+                to_terminate.append(inst)
+        if to_terminate:
+            t_thread = threading.Thread(target=self.__terminate_instances,
+                                        args=(to_terminate,))
+            t_thread.start()
+
+    def __terminate_instances(self, instances):
+        """
+        Terminate ``instances`` with a single cloud middleware request and
+        update each ``Instance`` object with the outcome.
+        """
+        terminated = self.app.cloud_interface.bulk_terminate_instances(
+            [inst.id for inst in instances if inst.id],
+            [inst.spot_request_id for inst in instances if inst.is_spot()])
+        for inst in instances:
+            inst.terminated(inst.id in terminated or not inst.id)
+
+    def _can_pool_instance(self, inst):
+        """
+        Decide if worker instance ``inst`` should be stopped and kept in the
+        worker pool instead of being terminated. Only on-demand, EBS-backed
+        workers that have joined the cluster at least once are pooled, up to
+        ``config.worker_pool_size`` instances, and never while the cluster is
+        shutting down.
+        """
+        num_pooled = len(self.worker_pool) + len(
+            [i for i in self.worker_instances if i.worker_status == 'Stopping' and
+             i.pooling])
+        if (self.cluster_status != cluster_status.SHUTTING_DOWN and
+                num_pooled < self.app.config.worker_pool_size and
+                inst.joined and not inst.is_spot() and
+                getattr(inst.inst, 'root_device_type', 'ebs') == 'ebs'):
+            inst.pooling = True
+            return True
+        return False
+
+    def start_pooled_instances(self, num_nodes, instance_type=''):
+        """
+        Start up to ``num_nodes`` stopped workers of type ``instance_type``
+        from the worker pool (an empty type matches the master's type). The
+        started instances are moved back into the list of worker instances
+        and rejoin the cluster under their original alias. Return the number
+        of instances started.
+        """
+        instance_type = instance_type or self.app.cloud_interface.get_type()
+        to_start = []
+        for inst in [i for i in self.worker_pool if i.type == instance_type]:
+            if len(to_start) == num_nodes:
+                break
+            # Instances restored into the pool may still be stopping and
+            # cannot be started until they have stopped
+            if inst.m_state != instance_states.STOPPED:
+                inst.get_m_state()
+            if inst.m_state == instance_states.STOPPED:
+                to_start.append(inst)
+            elif inst.m_state in [instance_states.TERMINATED, instance_states.SHUTTING_DOWN]:
+                self.worker_pool.remove(inst)
+        if not to_start:
+            return 0
+        if not self.app.cloud_interface.start_instances([inst.id for inst in to_start]):
+            return 0
+        for inst in to_start:
+            self.worker_pool.remove(inst)
+            inst.pooling = False
+            inst.start()
+            self.worker_instances.append(inst)
+        log.info("Started {0} pooled worker instance(s): {1}".format(
+            len(to_start), [inst.alias for inst in to_start]))
+        return len(to_start)
+
+    def terminate_pooled_instances(self):
+        """
+        Terminate all the stopped worker instances kept in the worker pool.
+        """
+        for inst in self.worker_pool[:]:
+            log.debug("Terminating pooled worker instance {0}".format(inst.id))
+            if self.app.cloud_interface.terminate_instance(inst.id):
+                self.worker_pool.remove(inst)
 
     def reboot_instance(self, instance_id='', count_reboot=True):
         """
@@ -1318,9 +1471,12 @@ class ConsoleManager(BaseConsoleManager):
             self.toggle_master_as_exec_host(force_removal=True)
         else:
             log.debug("Not modifying master's exec host status.")
-        self.app.cloud_interface.run_instances(num=num_nodes,
-                                               instance_type=instance_type,
-                                               spot_price=spot_price)
+        if not spot_price and self.worker_pool:
+            num_nodes -= self.start_pooled_instances(num_nodes, instance_type)
+        if num_nodes > 0:
+            self.app.cloud_interface.run_instances(num=num_nodes,
+                                                   instance_type=instance_type,
+                                                   spot_price=spot_price)
 
     def add_live_instance(self, instance_id):
         """
@@ -1522,6 +1678,10 @@ class ConsoleManager(BaseConsoleManager):
                 fs = Filesystem(self.app, fs_template['name'],
                                 svc_roles=ServiceRole.from_string_array(fs_template.get('roles', None)),
                                 mount_point=fs_template.get('mount_point', None))
+                fs.nfs_export_options = fs_template.get('nfs_export_options', None)
+                fs.nfs_mount_options = fs_template.get('nfs_mount_options', None)
+                fs.read_only = fs_template.get('read_only', False)
+                fs.set_worker_cache(fs_template.get('worker_cache', None))
                 # Check if an already attached volume maps to the current filesystem
                 att_vol = self.get_vol_if_fs(attached_volumes, fs_template['name'])
                 if att_vol:
@@ -1537,6 +1697,8 @@ class ConsoleManager(BaseConsoleManager):
                     if ServiceRole.GALAXY_DATA in ServiceRole.from_string_array(fs_template.get('roles', None)):
                         size = pss
                     fs.add_volume(size=size, from_snapshot_id=fs_template['snap_id'])
+                    prewarm = fs_template.get('prewarm')
+                    fs.prewarm = 'background' if prewarm is True else prewarm
                 elif 'volume_id' in fs_template:
                     log.debug("Adding a volume-based ({0}) file system."
                               .format(fs_template['volume_id']))
@@ -2221,6 +2383,7 @@ class ConsoleManager(BaseConsoleManager):
         """
         log.info("Stopping all '%s' worker instance(s)" % len(self.worker_instances))
         self.remove_instances(len(self.worker_instances), force=True)
+        self.terminate_pooled_instances()
 
     @TestFlag({})  # {'default_CM_rev': '64', 'user_CM_rev':'60'} # For testing
     @synchronized(s3_rlock)
@@ -2402,7 +2565,9 @@ class ConsoleManager(BaseConsoleManager):
         try:
             shutil.copy("/etc/hosts", paths.P_ETC_TRANSIENT_PATH)
             for wrk in self.worker_instances:
-                wrk.send_sync_etc_host(paths.P_ETC_TRANSIENT_PATH)
+                # Workers on their way out do not need the update
+                if wrk.worker_status != 'Stopping':
+                    wrk.send_sync_etc_host(paths.P_ETC_TRANSIENT_PATH)
         except IOError, e:
             log.error("Trouble copying /etc/hosts to shared NFS {0}: {1}"
                       .format(paths.P_ETC_TRANSIENT_PATH, e))
@@ -2446,7 +2611,8 @@ class ConsoleManager(BaseConsoleManager):
                 load = "0 0 0"
         return {'id': self.app.cloud_interface.get_instance_id(), 'ld': load,
                 'time_in_state': misc.format_seconds(Time.now() - self.startup_time),
-                'instance_type': self.app.cloud_interface.get_type(), 'public_ip': public_ip}
+                'instance_type': self.app.cloud_interface.get_type(), 'public_ip': public_ip,
+                'nfsd': NFSExport.get_nfsd_stats()}
 
 
 class ConsoleMonitor(object):
@@ -2463,6 +2629,12 @@ class ConsoleMonitor(object):
         self.last_system_change_time = Time.now()
         self.update_frequency = 10  # Frequency (in seconds) between system updates
         self.num_workers = -1
+        self.last_nfsd_stats = None  # NFS server stats at the last check
+        # Serves the chunks of (and tracks) the file systems workers fetch
+        # from the master and each other; started on first use
+        self.peer_server = None
+        self.seeded_file_systems = set()  # Names of the FSs being seeded
+        self.peer_lock = threading.Lock()
         # Start the monitor thread
         self.monitor_thread = threading.Thread(target=self.__monitor)
 
@@ -2532,9 +2704,21 @@ class ConsoleMonitor(object):
         should be called to resume cluster services after the expansion process
         has completed.
 
+        Where the file system can be grown in place (see
+        ``Filesystem.can_grow_online``), it is grown in the background while
+        the cluster services keep running.
+
         :type fs_svc: :class: ``cm.services.data.filesystem.Filesystem`` object
         :param fs_svc: A Filesystem service object to be resized.
         """
+        if fs_svc.grow.get('online', True) and fs_svc.can_grow_online():
+            log.info("Initiating online {0} file system expansion."
+                     .format(fs_svc.get_full_name()))
+            fs_svc.grow['status'] = 'growing_online'
+            t = threading.Thread(target=fs_svc.grow_online)
+            t.daemon = True
+            t.start()
+            return
         log.info("Initiating {0} file system expansion.".format(fs_svc.get_full_name()))
         self.app.manager._stop_app_level_services()
         fs_svc.expand()
@@ -2575,6 +2759,14 @@ class ConsoleMonitor(object):
                         fs['roles'] = ServiceRole.to_string_array(srvc.svc_roles)
                         fs['mount_point'] = srvc.mount_point
                         fs['kind'] = srvc.kind
+                        if srvc.nfs_export_options:
+                            fs['nfs_export_options'] = srvc.nfs_export_options
+                        if srvc.nfs_mount_options:
+                            fs['nfs_mount_options'] = srvc.nfs_mount_options
+                        if srvc.read_only:
+                            fs['read_only'] = True
+                        if srvc.worker_cache:
+                            fs['worker_cache'] = srvc.worker_cache
                         if srvc.kind == 'bucket':
                             fs['ids'] = [b.bucket_name for b in srvc.buckets]
                             fs['access_key'] = b.a_key
@@ -2717,13 +2909,58 @@ class ConsoleMonitor(object):
             self.app.manager.add_instances(self.app.manager.num_workers_requested)
             self.app.manager.num_workers_requested = 0  # Reset
 
+    def _add_file_systems(self, file_systems):
+        """
+        Add ``file_systems`` concurrently so provisioning them all takes about
+        as long as provisioning the slowest one. A file system whose mount
+        point is within another one's is added only once the enclosing one
+        has been added. Return ``True`` if any of the file systems was added.
+        """
+        added = []
+        threads = {}
+
+        def encloses(outer, inner):
+            return bool(outer.mount_point and inner.mount_point and
+                        inner.mount_point.rstrip('/').startswith(
+                            outer.mount_point.rstrip('/') + '/'))
+
+        def add(service, parents):
+            for parent, t in parents:
+                if t.is_alive():
+                    service.progress = "Waiting for {0}".format(parent.get_full_name())
+                    t.join()
+            log.debug("Monitor adding service '%s'" % service.get_full_name())
+            service.last_state_change_time = Time.now()
+            if service.add():
+                added.append(service)
+        # Start the enclosing file systems first so the nested ones can wait on them
+        for service in sorted(file_systems, key=lambda s: (s.mount_point or '').rstrip('/').count('/')):
+            parents = [(p, threads[p.name]) for p in file_systems
+                       if p.name in threads and encloses(p, service)]
+            threads[service.name] = threading.Thread(target=add, args=(service, parents))
+            threads[service.name].start()
+        for t in threads.values():
+            t.join()
+        for service in added:
+            log.debug("Monitor done adding service {0} (setting config_changed)"
+                      .format(service.get_full_name()))
+        return len(added) > 0
+
     def _start_services(self):
         config_changed = False  # Flag to indicate if cluster conf was changed
         # Check and add any new services
-        for service in self.app.manager.service_registry.active():
-            if service.state == service_states.UNSTARTED or \
-               service.state == service_states.SHUT_DOWN and \
-               service.state != service_states.STARTING:
+        to_add = [service for service in self.app.manager.service_registry.active()
+                  if service.state == service_states.UNSTARTED or
+                  service.state == service_states.SHUT_DOWN and
+                  service.state != service_states.STARTING]
+        # File systems are added concurrently, ahead of the services using them
+        file_systems = [s for s in to_add if s.svc_type == ServiceType.FILE_SYSTEM]
+        if file_systems:
+            self.last_system_change_time = Time.now()
+            if self._add_file_systems(file_systems):
+                config_changed = True
+        for service in to_add:
+            if service.svc_type != ServiceType.FILE_SYSTEM:
                 log.debug("Monitor adding service '%s'" % service.get_full_name())
                 self.last_system_change_time = Time.now()
                 service.last_state_change_time = self.last_system_change_time
@@ -2826,6 +3063,66 @@ class ConsoleMonitor(object):
             log.info(msg)
             self.app.msgs.info(msg)
 
+    def seed_file_system(self, fs):
+        """
+        Make the (read-only) file system ``fs`` available for workers to fetch
+        from the master and each other (see ``cm.util.peer_distribution``).
+        The file system's manifest is composed in the background; workers
+        wait for it to be ready. Return ``True`` if the file system is (being)
+        seeded, ``False`` otherwise.
+        """
+        with self.peer_lock:
+            if fs.name in self.seeded_file_systems:
+                return True
+            if self.peer_server is None:
+                try:
+                    self.peer_server = peer_distribution.PeerServer(
+                        tracker=peer_distribution.PeerTracker())
+                except socket.error, e:
+                    log.error("Cannot start serving file systems to workers: {0}".format(e))
+                    return False
+                self.peer_server.start()
+            self.seeded_file_systems.add(fs.name)
+
+        def seed():
+            log.debug("Composing manifest of file system {0} for workers to fetch".format(
+                fs.name))
+            try:
+                manifest = peer_distribution.build_manifest(fs.mount_point)
+            except (IOError, OSError), e:
+                log.error("Cannot seed file system {0}: {1}".format(fs.name, e))
+                with self.peer_lock:
+                    self.seeded_file_systems.discard(fs.name)
+                return
+            self.peer_server.add_dataset(fs.name, peer_distribution.Dataset(
+                fs.mount_point, manifest, complete=True))
+            self.peer_server.tracker.add_dataset(fs.name, manifest, '{0}:{1}'.format(
+                self.app.cloud_interface.get_private_ip(), self.peer_server.port))
+            log.info("Seeding file system {0} ({1} bytes in {2} chunks) to workers".format(
+                fs.name, manifest['size'], len(manifest['chunks'])))
+        t = threading.Thread(target=seed)
+        t.daemon = True
+        t.start()
+        return True
+
+    def _check_nfs_server(self):
+        """
+        Size the NFS server thread pool for the current number of workers and
+        warn if the server's thread pool has been saturated since the last
+        check.
+        """
+        NFSExport.tune_nfsd_threads(len(self.app.manager.worker_instances))
+        stats = NFSExport.get_nfsd_stats()
+        if not stats:
+            return
+        last = self.last_nfsd_stats
+        self.last_nfsd_stats = stats
+        if last and stats['sockets_enqueued'] > last['sockets_enqueued']:
+            log.warning("All {0} NFS server threads were busy {1} time(s) since the last "
+                        "check ({2} retransmitted requests)".format(
+                            stats['threads'], stats['sockets_enqueued'] - last['sockets_enqueued'],
+                            stats['retransmits'] - last['retransmits']))
+
     def __monitor(self):
         log.debug("Starting __monitor thread")
         if not self.app.manager.manager_started:
@@ -2895,6 +3192,7 @@ class ConsoleMonitor(object):
                         log.debug("Instance {0} has been quiet for a while (last check "
                                   "{1} secs ago); will wait a bit longer before a check..."
                                   .format(w_instance.get_desc(), (Time.now() - w_instance.last_state_update).seconds))
+                self._check_nfs_server()
             self._start_initial_workers()
             # Store cluster configuraiton if the configuration has changed
             config_changed = self._start_services()
@@ -1,6 +1,7 @@
 import os
 import re
 import fileinput
+import threading
 
 from cm.conftemplates import conf_manager
 from cm.util import misc
@@ -12,6 +13,10 @@ from cm.services.apps import ApplicationService
 import logging
 log = logging.getLogger('cloudman')
 
+# Number of seconds over which changes to the managed config are coalesced
+# before HTCondor is reconfigured
+RECONFIG_DELAY = 5
+
 
 class HTCondorService(ApplicationService):
     def __init__(self, app, srv_type="master", host=""):
@@ -25,6 +30,12 @@ class HTCondorService(ApplicationService):
         self.svc_roles = [ServiceRole.HTCONDOR]
         self.name = ServiceRole.to_string(ServiceRole.HTCONDOR)
         self.srv_type = srv_type
+        # Runtime configuration values managed by CloudMan: a dict mapping a
+        # config key to a tuple of (action, list of values); see
+        # ``modify_htcondor``
+        self.managed_config = {}
+        self.managed_config_lock = threading.Lock()
+        self.reconfig = misc.Debouncer(self._apply_managed_config, RECONFIG_DELAY)
         if self.srv_type == "master":
             self.flock_to = ""
         else:
@@ -68,6 +79,11 @@ class HTCondorService(ApplicationService):
             if os.path.exists(paths.P_HTCONDOR_CONFIG_PATH):
                 with open(paths.P_HTCONDOR_CONFIG_PATH, 'a') as f:
                     print >> f, condor_template
+                # Any values set before the service started are picked up by
+                # the restart below
+                misc.make_dir(os.path.dirname(paths.P_HTCONDOR_MANAGED_CONFIG_PATH))
+                misc.write_file_atomically(paths.P_HTCONDOR_MANAGED_CONFIG_PATH,
+                                           self._render_managed_config())
                 misc.run(paths.P_HTCONDOR_HOME + "/condor restart")
                 all_done = True
                 self.state = service_states.RUNNING
@@ -83,34 +99,71 @@ class HTCondorService(ApplicationService):
     def modify_htcondor(self, key, value, action="a"):
         """
         Modifying HTCondor environment for running HTCondor as desired.
-        It will restart HTCondor after modifying the configuration.
         The configuration format is in the form of a key value string pair
         and if the action passed as "a" then it will add the new value to the
-        old value.
-        """
-        log.debug("modifying HTCondor")
+        old value; otherwise, the value replaces any previous value.
 
-        all_done = False
-        try:
-            default_val = self.find_config(key, '/etc/condor/condor_config')
-            log.debug(default_val)
-            val = ""
-            if action == "a":
-                if default_val != "":
-                    val = value + "," + default_val
-                else:
-                    val = value
+        The values are kept in memory and written into a managed config
+        fragment (``paths.P_HTCONDOR_MANAGED_CONFIG_PATH``) only when they
+        change. Changes made within ``RECONFIG_DELAY`` seconds of each other
+        are applied together with a single ``condor_reconfig``.
+        """
+        with self.managed_config_lock:
+            current = self.managed_config.get(key)
+            if action == "a" and current and current[0] == "a":
+                if value in current[1]:
+                    log.debug("HTCondor {0} already includes {1}".format(key, value))
+                    return True
+                new = (action, current[1] + [value])
             else:
-                val = value
-            with open(paths.P_HTCONDOR_CONFIG_PATH, 'a') as f:
-                print >> f, str(key) + "=" + str(val)
-            misc.run(paths.P_HTCONDOR_HOME + "/condor restart")
-            all_done = True
-        except Exception, e:
-            log.debug("Error while configuring HTCondor: {0}".format(e))
-            all_done = False
-            self.state = service_states.ERROR
-        return all_done
+                new = (action, [value])
+            if new == current:
+                log.debug("HTCondor {0} is already set to {1}".format(key, value))
+                return True
+            self.managed_config[key] = new
+        log.debug("Scheduling HTCondor config update: {0} {1}".format(key, value))
+        self.reconfig.trigger()
+        return True
+
+    def _render_managed_config(self):
+        """
+        Compose the contents of the managed config fragment. Appended values
+        extend the value set in the main config file via a self-reference.
+        """
+        lines = ["# This file is managed by CloudMan; do not edit."]
+        with self.managed_config_lock:
+            for key in sorted(self.managed_config):
+                action, values = self.managed_config[key]
+                if action == "a":
+                    values = ["$({0})".format(key)] + values
+                lines.append("{0} = {1}".format(key, ", ".join(values)))
+        return "\n".join(lines) + "\n"
+
+    def _apply_managed_config(self):
+        """
+        Atomically write the managed config fragment and ask the running
+        HTCondor daemons to re-read their configuration. Nothing is done
+        while the service is not running; the managed config is written
+        when the service starts (see ``configure_htcondor``).
+        """
+        if self.state != service_states.RUNNING:
+            log.debug("HTCondor is not running ({0}); its managed config will be "
+                      "applied when it starts".format(self.state))
+            return True
+        log.debug("Applying HTCondor managed config")
+        condor_reconfig = self.app.path_resolver.condor_reconfig
+        if not condor_reconfig:
+            log.error("Cannot reconfigure HTCondor: condor_reconfig not found")
+            return False
+        misc.make_dir(os.path.dirname(paths.P_HTCONDOR_MANAGED_CONFIG_PATH))
+        if misc.write_file_atomically(paths.P_HTCONDOR_MANAGED_CONFIG_PATH,
+                                      self._render_managed_config()):
+            if not misc.run(condor_reconfig):
+                self.state = service_states.ERROR
+                return False
+            return True
+        self.state = service_states.ERROR
+        return False
 
     def status(self):
         """
@@ -38,6 +38,24 @@ class BaseJobManager(ApplicationService):
         """
         raise NotImplementedError("remove_node method not implemented")
 
+    def remove_nodes(self, instances):
+        """
+            Remove all the ``instances`` from the list of worker nodes in the
+            cluster. Job managers that can apply a removal for a number of
+            nodes at once should override this method; by default, it calls
+            ``remove_node`` for each instance.
+
+            :type instances: list
+            :param instances: A list of ``cm.instance.Instance`` objects being
+                              removed from the cluster.
+
+            :rtype: bool
+            :return: ``True`` if all the nodes were successfully removed from
+                     the cluster; ``False`` otherwise.
+        """
+        results = [self.remove_node(instance) for instance in instances]
+        return all(results)
+
     def enable_node(self, alias, address):
         """
             Enable the node identified by ``alias`` and/or ``address`` for
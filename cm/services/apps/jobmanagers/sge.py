@@ -639,7 +639,8 @@ class SGEService(BaseJobManager):
         """
         Return a list of jobs currently registered with the job mamanger.
         """
-        return self.sge_info.parse_qstat(self._get_qstat_out()).get('jobs', [])
+        return self.sge_info.parse_qstat(
+            self._get_qstat_out(args='-f -xml -r -u "*"')).get('jobs', [])
 
     def _check_sge(self):
         """
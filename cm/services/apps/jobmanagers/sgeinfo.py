@@ -1,6 +1,11 @@
 from datetime import datetime
 from xml.dom import minidom
 
+from cm.util.misc import mem_to_mb
+
+# Resource requests (per slot) that are interpreted as a job's memory request
+MEMORY_RESOURCES = ['h_vmem', 'mem_free', 'virtual_free', 's_vmem']
+
 
 class SGEInfo(object):
     """
@@ -29,7 +34,9 @@ class SGEInfo(object):
             Given an XML representation of a ``job`` from the output of ``qstat``,
             return a dict with parsed job info. The returned dict contains the
             following keys: ``job_state``, ``job_number``, ``job_slots``,
-            ``time_job_entered_state``, and ``job_node_name``.
+            ``time_job_entered_state``, ``job_node_name``, ``job_cpus``,
+            ``job_mem`` (in MB) and ``job_queue``. Memory and queue requests
+            are only available if ``qstat`` was run with the ``-r`` option.
         """
         job_state = job.getAttribute("state")
         job_number = int(job.getElementsByTagName('JB_job_number')[0].childNodes[0].data)
@@ -49,9 +56,21 @@ class SGEInfo(object):
             time_job_entered_state = datetime.strptime(time_job_entered_state,
                                                        "%Y-%m-%dT%H:%M:%S")
         job_slots = int(job.getElementsByTagName('slots')[0].childNodes[0].data)
+        job_mem = 0
+        for request in job.getElementsByTagName('hard_request'):
+            if request.getAttribute('name') in MEMORY_RESOURCES and request.childNodes:
+                job_mem = mem_to_mb(request.childNodes[0].data) * job_slots
+                break
+        job_queue = None
+        for tag in ['queue_name', 'hard_req_queue']:
+            elements = job.getElementsByTagName(tag)
+            if elements and elements[0].childNodes:
+                job_queue = elements[0].childNodes[0].data.split('@')[0]
+                break
         job_info = {'job_state': job_state, 'job_number': job_number,
                     'time_job_entered_state': time_job_entered_state, 'job_slots': job_slots,
-                    'job_node_name': job_node_name}
+                    'job_node_name': job_node_name, 'job_cpus': job_slots,
+                    'job_mem': job_mem, 'job_queue': job_queue}
         return job_info
 
     def parse_qstat(self, qstat_out):
@@ -207,6 +207,18 @@ class SlurmctldService(BaseJobManager):
         self.disable_node(instance.alias, instance.private_ip, state="DOWN")
         return self._reconfigure_cluster()
 
+    def remove_nodes(self, instances):
+        """
+        Remove all the ``instances`` from the cluster with a single
+        ``scontrol update`` and a single cluster reconfiguration.
+        """
+        if not instances:
+            return True
+        aliases = ','.join([instance.alias for instance in instances])
+        log.debug("Removing nodes {0} from Slurm cluster".format(aliases))
+        self.disable_node(aliases, None, state="DOWN")
+        return self._reconfigure_cluster()
+
     def enable_node(self, alias, address):
         """
         Enable node identified by ``alias`` for running jobs by setting it's
@@ -3,6 +3,8 @@ import commands
 import datetime
 import logging
 
+from cm.util.misc import mem_to_mb
+
 log = logging.getLogger('cloudman')
 
 
@@ -18,23 +20,31 @@ class SlurmInfo(object):
         Get list of jobs with info about each.
 
         Each list entry is a dict with the following keys:
-        ``time_job_entered_state`` and ``job_state`` keys. Valid ``job_state``
-        values include: ``running``,  ``pending``.
+        ``time_job_entered_state``, ``job_state``, ``req_node_not_avail``,
+        ``job_cpus``, ``job_mem`` (in MB) and ``job_queue`` (i.e., the
+        partition). Valid ``job_state`` values include: ``running``,
+        ``pending``.
         """
         jobs = []
-        # For now we're only filtering jobs in pending or running state
-        cmd = "squeue -h -o'%T %S %R' --states=PENDING,RUNNING"
+        # For now we're only filtering jobs in pending or running state. The
+        # fields are delimited with '|' and the reason goes last because it
+        # may contain spaces (e.g., '(ReqNodeNotAvail, UnavailableNodes:w1)')
+        cmd = "squeue -h -o'%T|%S|%C|%m|%P|%R' --states=PENDING,RUNNING"
         squeue_out = commands.getoutput(cmd)
         if squeue_out:
             squeue_out = squeue_out.split('\n')
             for job in squeue_out:
-                job_state = job.split()[0].lower()
-                job_submit_time = job.split()[1]
-                reason = job.split()[2].lower()
+                fields = job.split('|', 5)
+                if len(fields) < 6:
+                    log.debug("Unexpected squeue output: %s" % job)
+                    continue
+                job_state = fields[0].lower()
+                job_submit_time = fields[1]
+                reason = fields[5].strip().lower()
                 req_node_not_avail = False
                 # log.debug("Job state: %s, job_submit_time: %s, reason: %s" %
                 #           (job_state, job_submit_time, reason))
-                if reason in ['(reqnodenotavail)']:
+                if reason.startswith('(reqnodenotavail'):
                     req_node_not_avail = True
                     time_job_entered_state = \
                         datetime.datetime.now() - datetime.timedelta(minutes=5)
@@ -46,6 +56,12 @@ class SlurmInfo(object):
                 job_info = {'job_state': job_state, 'time_job_entered_state':
                             time_job_entered_state, 'req_node_not_avail':
                             req_node_not_avail}
+                try:
+                    job_info['job_cpus'] = int(fields[2])
+                except ValueError:
+                    job_info['job_cpus'] = 0
+                job_info['job_mem'] = mem_to_mb(fields[3])
+                job_info['job_queue'] = fields[4].rstrip('*')
                 # log.debug("job_info: %s" % job_info)
                 jobs.append(job_info)
         return jobs
@@ -1,11 +1,78 @@
 import datetime
 import logging
+import math
 from cm.services import (Service, ServiceDependency, ServiceRole, ServiceType,
                          service_states)
+from cm.util import Time
+from cm.util.misc import RingBuffer
 
 
 log = logging.getLogger('cloudman')
 
+# Number of autoscaling evaluations kept in the in-memory decision log
+DECISION_LOG_SIZE = 500
+# Fraction of an instance's nominal memory assumed to be usable by jobs
+USABLE_MEMORY_FRACTION = 0.9
+
+
+def _fits(job, cpus, memory):
+    return job['cpus'] <= cpus and job['memory'] <= memory
+
+
+def _usable(spec):
+    return spec['cpus'], int(spec['memory'] * USABLE_MEMORY_FRACTION)
+
+
+def plan_instances(jobs, instance_specs):
+    """
+    Bin-pack the resource requests of ``jobs`` onto instances chosen from
+    ``instance_specs`` and return the list of instance type keys to launch.
+
+    Jobs are placed largest first. Each time a new instance is needed, every
+    type that can run the largest unplaced job is tried by greedily filling it
+    with the remaining jobs; the type with the lowest price per placed job
+    (cheaper type on a tie) is chosen. Jobs that do not fit any type are
+    logged and left out of the plan.
+
+    :type jobs: list
+    :param jobs: A list of dicts, each with ``cpus`` and ``memory`` (in MB)
+                 keys describing a pending job's requirements.
+
+    :type instance_specs: list
+    :param instance_specs: A list of dicts with ``key``, ``cpus``, ``memory``
+                           (in MB) and ``price`` keys (see
+                           ``Configuration.instance_type_specs``).
+
+    :rtype: list
+    :return: Instance type keys, one per instance to launch.
+    """
+    plan = []
+    pending = []
+    for job in sorted(jobs, key=lambda j: (j['memory'], j['cpus']), reverse=True):
+        if any(_fits(job, *_usable(spec)) for spec in instance_specs):
+            pending.append(job)
+        else:
+            log.warning("No instance type can accommodate job requesting %s "
+                        "CPU(s) and %s MB of memory" % (job['cpus'], job['memory']))
+    while pending:
+        best = None
+        for spec in instance_specs:
+            cpus, memory = _usable(spec)
+            if not _fits(pending[0], cpus, memory):
+                continue
+            placed = []
+            for index, job in enumerate(pending):
+                if _fits(job, cpus, memory):
+                    placed.append(index)
+                    cpus -= job['cpus']
+                    memory -= job['memory']
+            score = (spec['price'] / len(placed), spec['price'])
+            if best is None or score < best[0]:
+                best = (score, spec, placed)
+        plan.append(best[1]['key'])
+        pending = [job for index, job in enumerate(pending) if index not in best[2]]
+    return plan
+
 
 class AutoscaleService(Service):
     def __init__(self, app, as_min=-1, as_max=-1, instance_type=None,
@@ -41,6 +108,18 @@ class AutoscaleService(Service):
         self.as_max = as_max
         self.as_min = as_min
         self.instance_type = instance_type
+        self.num_queued_jobs = num_queued_jobs
+        self.mean_runtime_threshold = mean_runtime_threshold
+        self.num_instances_to_add = num_instances_to_add
+        # Audit trail of autoscaling evaluations (see ``get_decision_log``)
+        self.decisions = RingBuffer(DECISION_LOG_SIZE)
+        self.counters = {'evaluations': 0, 'scale_up': 0, 'scale_down': 0,
+                         'instances_added': 0, 'instances_removed': 0,
+                         'last_scale_up': None, 'last_scale_down': None}
+        # Inputs gathered during an evaluation (reset on each ``status`` call)
+        self._rule = None
+        self._q_jobs = None
+        self._idle_nodes = None
 
     @property
     def num_queued_jobs(self):
@@ -94,19 +173,79 @@ class AutoscaleService(Service):
     def status(self):
         """
         Check the status/size of the cluster and initiate appropriate action
-        if necessary.
+        if necessary. Each evaluation is recorded in the decision log.
         """
+        self._rule = None
+        self._q_jobs = None
+        self._idle_nodes = None
+        decision = {'action': 'none', 'instances': 0, 'instance_types': []}
         if self.too_large():
             # Remove idle instances, leaving at least self.as_min
             num_instances_to_remove = self.get_num_instances_to_remove()
             log.debug(
                 "Autoscaling DOWN: %s instance(s)" % num_instances_to_remove)
             self.app.manager.remove_instances(num_instances_to_remove)
+            decision.update({'action': 'down', 'instances': num_instances_to_remove})
         elif self.too_small():
-            num_instances_to_add = self.get_num_instances_to_add()
-            log.debug("Autoscaling UP: %s instance(s)" % num_instances_to_add)
-            self.app.manager.add_instances(
-                num_instances_to_add, instance_type=self.instance_type)
+            instance_types = self.get_instance_types_to_add()
+            if instance_types:
+                for instance_type in set(instance_types):
+                    num_instances_to_add = instance_types.count(instance_type)
+                    log.debug("Autoscaling UP: %s instance(s) of type '%s'" %
+                              (num_instances_to_add, instance_type))
+                    self.app.manager.add_instances(
+                        num_instances_to_add, instance_type=instance_type)
+            else:
+                num_instances_to_add = self.get_num_instances_to_add()
+                log.debug("Autoscaling UP: %s instance(s)" % num_instances_to_add)
+                self.app.manager.add_instances(
+                    num_instances_to_add, instance_type=self.instance_type)
+                instance_types = [self.instance_type] * num_instances_to_add
+            decision.update({'action': 'up', 'instances': len(instance_types),
+                             'instance_types': instance_types})
+        self._record_decision(decision)
+        self._q_jobs = None
+        self._idle_nodes = None
+
+    def _record_decision(self, decision):
+        """
+        Add the outcome of an evaluation (``decision``), along with the inputs
+        the evaluation was based on, to the decision log and update counters.
+        Only inputs already gathered during the evaluation are recorded (the
+        job queue is not queried just for the log); the others are ``None``.
+        """
+        q_jobs = self._q_jobs
+        decision.update({
+            'time': Time.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'rule': self._rule,
+            'queued_jobs': len(q_jobs['queued']) if q_jobs else None,
+            'running_jobs': len(q_jobs['running']) if q_jobs else None,
+            'idle_nodes': self._idle_nodes,
+            'workers': len(self.app.manager.worker_instances),
+            'available_workers': self.app.manager.get_num_available_workers(),
+            'as_min': self.as_min,
+            'as_max': self.as_max})
+        self.decisions.append(decision)
+        self.counters['evaluations'] += 1
+        if decision['action'] == 'up':
+            self.counters['scale_up'] += 1
+            self.counters['instances_added'] += decision['instances']
+            self.counters['last_scale_up'] = decision['time']
+        elif decision['action'] == 'down':
+            self.counters['scale_down'] += 1
+            self.counters['instances_removed'] += decision['instances']
+            self.counters['last_scale_down'] = decision['time']
+
+    def get_decision_log(self, num_entries=None):
+        """
+        Return a dict with autoscaling ``counters`` and the ``history`` of
+        recent evaluations (oldest first), optionally limited to the last
+        ``num_entries`` evaluations.
+        """
+        history = self.decisions.tolist()
+        if num_entries:
+            history = history[-int(num_entries):]
+        return {'counters': dict(self.counters), 'history': history}
 
     def too_large(self):
         """
@@ -120,12 +259,14 @@ class AutoscaleService(Service):
         # log.debug("Checking if cluster is too LARGE")
         if len(self.app.manager.worker_instances) > self.as_max:
             log.debug("Cluster is too explicitly large")
+            self._rule = 'above_max'
             return True
         elif int(datetime.datetime.utcnow().strftime("%M")) > 57 and \
             len(self.app.manager.worker_instances) > self.as_min and \
                 self.get_num_instances_to_remove() > 0:
             # len(self.app.manager.get_idle_instances()) > 0 and \
             log.debug("Cluster is too large")
+            self._rule = 'idle_at_hour_end'
             return True
         return False
 
@@ -137,27 +278,29 @@ class AutoscaleService(Service):
               user
             - minute in the current hour is less than 55 (this is to ensure
               down-scaling and up-scaling don't conflict)
-            - there are no idle resources, jobs are queued and job turnaround
-              time is slow
+            - there are no idle resources, jobs are queued, job turnaround
+              time is slow and the queued demand is not already covered by
+              instances that are still booting
             - there are no workers, jobs are queued and the master is set to
               not run jobs
         """
         log.debug("Checking if cluster too SMALL: minute:%s,idle:%s,total "
                   "workers:%s,avail workers:%s,min:%s,max:%s" %
                   (datetime.datetime.utcnow().strftime("%M"),
-                   len(self.app.manager.get_idle_instances()),
+                   self.get_num_idle_instances(),
                    len(self.app.manager.worker_instances),
                    self.app.manager.get_num_available_workers(), self.as_min,
                    self.as_max))
 
         if len(self.app.manager.worker_instances) < self.as_min:
+            self._rule = 'below_min'
             return True
         elif (int(datetime.datetime.utcnow().strftime("%M")) < 55 and
-              len(self.app.manager.get_idle_instances()) == 0 and
+              self.get_num_idle_instances() == 0 and
               len(self.app.manager.worker_instances) < self.as_max and
-              len(self.app.manager.worker_instances) ==
-              self.app.manager.get_num_available_workers() and
-              self.slow_job_turnover()):
+              self.slow_job_turnover() and
+              self.get_num_instances_to_add() > 0):
+            self._rule = 'slow_job_turnover'
             return True
         return False
 
@@ -171,7 +314,7 @@ class AutoscaleService(Service):
         threshold (``self.mean_runtime_threshold``) and there are at least as
         many queued jobs as ``self.num_queued_jobs``, returns ``True``.
         """
-        q_jobs = self.get_queue_jobs()
+        q_jobs = self.get_evaluation_queue_jobs()
         # log.debug('q_jobs: %s' % q_jobs)
         r_jobs_mean, r_jobs_stdv = self.meanstdv(q_jobs['running'])
         qw_jobs_mean, qw_jobs_stdv = self.meanstdv(q_jobs['queued'])
@@ -193,14 +336,22 @@ class AutoscaleService(Service):
         jobs. Return a dict with two keys 'running' and 'queued' where each
         key corresponds to a list of queued times (in seconds) for running
         and queued jobs, respectively. For example: {'running': [169147,
-        149527], 'queued': [167525, 167512]}
+        149527], 'queued': [167525, 167512]}. The dict also contains the
+        ``queued_slots`` key, holding the total number of CPUs (slots)
+        requested by the queued jobs; jobs that do not report a request are
+        assumed to need one slot, and the ``pending_requirements`` key,
+        holding a list of dicts with ``cpus`` and ``memory`` keys, one for
+        each queued job whose resource requests are reported by the job
+        manager (jobs that do not request memory are assumed to need none).
         """
         running_jobs = []
         queued_jobs = []
+        queued_slots = 0
+        pending_requirements = []
+        req_node_not_avail = False
         for job_manager_svc in self.app.manager.service_registry.active(
                 service_role=ServiceRole.JOB_MANAGER):
             jobs = job_manager_svc.jobs()
-            req_node_not_avail = False
             # log.debug("Autoscaling jobs: {0}".format(jobs))
             for job in jobs:
                 now = datetime.datetime.now()
@@ -213,14 +364,38 @@ class AutoscaleService(Service):
                     time_job_entered_state = job.get('time_job_entered_state',
                                                      datetime.datetime.now)
                     queued_jobs.append(self.total_seconds(now - time_job_entered_state))
+                    queued_slots += job.get('job_cpus') or 1
+                    if job.get('job_cpus'):
+                        pending_requirements.append({'cpus': job['job_cpus'],
+                                                     'memory': job.get('job_mem') or 0})
         return {'running': running_jobs, 'queued': queued_jobs,
+                'queued_slots': queued_slots,
+                'pending_requirements': pending_requirements,
                 'req_node_not_avail': req_node_not_avail}
 
+    def get_evaluation_queue_jobs(self):
+        """
+        Return the job queue as summarized by ``get_queue_jobs``. Within an
+        evaluation (see ``status``), the job managers are queried only once.
+        """
+        if self._q_jobs is None:
+            self._q_jobs = self.get_queue_jobs()
+        return self._q_jobs
+
+    def get_num_idle_instances(self):
+        """
+        Return the number of idle worker instances. Within an evaluation (see
+        ``status``), the job manager is asked for the idle nodes only once.
+        """
+        if self._idle_nodes is None:
+            self._idle_nodes = len(self.app.manager.get_idle_instances())
+        return self._idle_nodes
+
     def get_num_instances_to_remove(self):
         """Return the number of instance to remove during auto-DOWN-scaling.
            The function returns the number of idle instances while respecting
            the min number of instances that autoscaling should maintain."""
-        num_instances_to_remove = len(self.app.manager.get_idle_instances())
+        num_instances_to_remove = self.get_num_idle_instances()
         # If there are already more running instances than the current as_max,
         # leave the max number of instances running after scaling down
         if len(self.app.manager.worker_instances) > int(self.as_max):
@@ -232,18 +407,88 @@ class AutoscaleService(Service):
                 self.app.manager.worker_instances) - int(self.as_min)
         return num_instances_to_remove
 
+    def get_num_booting_instances(self):
+        """
+        Return the number of worker instances that have been requested but
+        are not yet available to run jobs (e.g., pending or starting up).
+        """
+        return len([inst for inst in self.app.manager.worker_instances
+                    if inst.worker_status not in ['Ready', 'Stopping', 'Error']])
+
+    def get_slots_per_instance(self):
+        """
+        Return the number of job slots (CPUs) an instance of
+        ``self.instance_type`` provides. The size is taken from the configured
+        instance types, falling back to the largest CPU count reported by the
+        current workers and finally to ``1``.
+        """
+        for spec in self.app.config.instance_type_specs:
+            if spec['key'] == self.instance_type:
+                return spec['cpus']
+        worker_cpus = [inst.num_cpus for inst in self.app.manager.worker_instances
+                       if inst.worker_status == 'Ready']
+        return max(worker_cpus) if worker_cpus else 1
+
     def get_num_instances_to_add(self):
-        """Return the number of instance to add during auto-UP-scaling.
-           The function returns 1 unless the number of instances autoscaling should
-           maintain is less then the current number of instances. In that case, it
-           returns the difference."""
-        num_instances_to_add = self.num_instances_to_add
-        if len(self.app.manager.worker_instances) + num_instances_to_add < self.as_min:
-            num_instances_to_add = int(
-                self.as_min) - len(self.app.manager.worker_instances)
-        elif len(self.app.manager.worker_instances) + num_instances_to_add > self.as_max:
-            num_instances_to_add = 0  # Already at as_max
-        return num_instances_to_add
+        """
+        Return the number of instances to add during auto-UP-scaling.
+
+        If the cluster is smaller than ``as_min``, return the difference.
+        Otherwise, size the step from the backlog: the number of queued slots
+        divided by the slots per instance, less the instances that are already
+        booting (so the same demand is not ordered twice). The step is at least
+        ``num_instances_to_add``, at most the configured
+        ``autoscaling_max_instances_per_step``, and never takes the cluster
+        above ``as_max``.
+        """
+        num_workers = len(self.app.manager.worker_instances)
+        if num_workers < self.as_min:
+            return int(self.as_min) - num_workers
+        q_jobs = self.get_evaluation_queue_jobs()
+        queued_slots = q_jobs.get('queued_slots', len(q_jobs['queued']))
+        num_instances_to_add = int(math.ceil(
+            queued_slots / float(self.get_slots_per_instance())))
+        num_instances_to_add -= self.get_num_booting_instances()
+        if num_instances_to_add <= 0:
+            return 0
+        num_instances_to_add = min(
+            max(num_instances_to_add, self.num_instances_to_add),
+            self.app.config.autoscaling_max_instances_per_step,
+            int(self.as_max) - num_workers)
+        return max(num_instances_to_add, 0)
+
+    def get_pending_job_requirements(self):
+        """
+        Return a list of dicts with ``cpus`` and ``memory`` keys, one for each
+        pending job whose resource requests are reported by a job manager
+        (see ``get_queue_jobs``).
+        """
+        return self.get_evaluation_queue_jobs()['pending_requirements']
+
+    def get_instance_types_to_add(self):
+        """
+        Plan a resource-aware scale-up: bin-pack the pending jobs onto the
+        configured instance types (``config.instance_type_specs``) and return
+        a list of instance type keys to launch, one per instance. The plan is
+        reduced by the number of instances that are already booting and
+        trimmed to respect ``as_max`` and the per-step limit. An empty list is returned if there is
+        not enough information to plan (e.g., no sized instance types or no
+        job requirements), or if the cluster is below ``as_min``, in which
+        case the caller should fall back to ``get_num_instances_to_add``.
+        """
+        num_workers = len(self.app.manager.worker_instances)
+        if not self.app.config.autoscaling_by_job_requirements or \
+                num_workers < self.as_min:
+            return []
+        specs = self.app.config.instance_type_specs
+        jobs = self.get_pending_job_requirements()
+        if not specs or not jobs:
+            return []
+        plan = plan_instances(jobs, specs)
+        log.debug("Autoscaling plan for %s pending job(s): %s" % (len(jobs), plan))
+        plan = plan[:max(len(plan) - self.get_num_booting_instances(), 0)]
+        return plan[:max(min(int(self.as_max) - num_workers,
+                             self.app.config.autoscaling_max_instances_per_step), 0)]
 
     def total_seconds(self, td):
         """Compute the total number of seconds in a timedelta object td"""
@@ -9,6 +9,7 @@ from cm.util import misc
 from cm.services import service_states
 from cm.util.misc import _if_not_installed
 from cm.util.decorators import TestFlag
+from cm.util.mount_table import mount_table
 
 import logging
 log = logging.getLogger('cloudman')
@@ -132,6 +133,10 @@ class Bucket(object):
         try:
             log.debug("Mounting file system {0} from bucket {1} to {2}"
                       .format(self.fs.get_full_name(), self.bucket_name, self.mount_point))
+            if mount_table.is_mounted(self.mount_point):
+                log.debug("Bucket file system at {0} is already mounted from {1}"
+                          .format(self.mount_point, mount_table.device(self.mount_point)))
+                return True
             if os.path.exists(self.mount_point):
                 if len(os.listdir(self.mount_point)) != 0:
                     log.warning(
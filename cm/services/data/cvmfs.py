@@ -41,8 +41,6 @@ class CVMFS(object):
         """Check if the mount point contains data and mark as running if so."""
         if os.listdir(self.fs.mount_point):
             self.fs.state = service_states.RUNNING
-            update_size_cmd = ("df --block-size 1 | grep %s$ | awk "
-                               "'{print $2, $3, $5}'" % self.fs.mount_point)
-            self.fs._update_size(cmd=update_size_cmd)
+            self.fs._update_size()
         else:
             self.fs.state = service_states.ERROR
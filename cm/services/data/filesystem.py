@@ -4,8 +4,8 @@ aware of it and can thus manipulate it.
 """
 import os
 import shutil
-import commands
 import threading
+import time
 from datetime import datetime
 
 from cm.util import misc
@@ -21,10 +21,19 @@ from cm.services.data.volume import Volume
 from cm.services.data.bucket import Bucket
 from cm.services.data.transient_storage import TransientStorage
 from cm.util.nfs_export import NFSExport
+from cm.util.mount_table import mount_table
+from cm.util.disk_usage import disk_usage
 
 import logging
 log = logging.getLogger('cloudman')
 
+# Commands to grow a mounted file system, by file system type
+GROWFS_COMMANDS = {
+    'xfs': '/usr/sbin/xfs_growfs {mount_point}',
+    'ext3': '/sbin/resize2fs {device}',
+    'ext4': '/sbin/resize2fs {device}',
+}
+
 
 class Filesystem(DataService):
     def __init__(self, app, name, svc_roles=[ServiceRole.GENERIC_FS], mount_point=None, persistent=True):
@@ -47,6 +56,7 @@ class Filesystem(DataService):
         self.size = None  # Total size of this file system
         self.size_used = None  # Used size of the this file system
         self.size_pct = None  # Used percentage of this file system
+        self.stale = False  # Set if the last size probe of this file system hung
         self.kind = None  # Choice of 'snapshot', 'volume', 'bucket', 'transient', or 'nfs'
         self.mount_point = mount_point if mount_point else os.path.join(
             self.app.path_resolver.mount_root, self.name)
@@ -55,6 +65,20 @@ class Filesystem(DataService):
         # keys so look around carefully (i.e., this should probably be turned
         # into a helper class)
         self.grow = {}
+        # Whether to pre-warm volumes restored from snapshots: ``None`` (do
+        # not), ``background`` or ``wait`` (i.e., keep the file system from
+        # becoming available until done); see ``Volume.prewarm``
+        self.prewarm = None
+        self.progress = None  # What adding this FS is busy with, for the UI
+        self.nfs_export_options = None  # NFS export options, if not the defaults
+        self.nfs_mount_options = None  # Options for workers to mount this FS with, if not the defaults
+        self.read_only = False  # Whether this FS is exported to the workers read-only
+        # How workers cache this FS locally: ``None`` (they do not),
+        # ``fscache`` (FS-Cache on the workers' transient disk), ``copy`` (a
+        # local copy of the whole FS) or ``peer`` (a local copy fetched from
+        # the master and other workers); copies are for read-only FSs only
+        # (see ``self.set_worker_cache``)
+        self.worker_cache = None
         # A time stamp when the state changed to STARTING; it is used to
         # avoid brief ERROR states during system configuration.
         self.started_starting = datetime.utcnow()
@@ -99,7 +123,11 @@ class Filesystem(DataService):
         details['size_used'] = nice_size(self.size_used)
         details['size_pct'] = self.size_pct
         details['status'] = self.state
+        details['progress'] = self.progress
         details['err_msg'] = ""
+        if self.stale:
+            details['err_msg'] = "File system is not responding; size info may be out of date."
+        details['stale'] = self.stale
         details['mount_point'] = self.mount_point
         details['persistent'] = "Yes" if self.persistent else "No"
         return details
@@ -115,6 +143,7 @@ class Filesystem(DataService):
                 self.state = service_states.STARTING
                 self.last_state_change_time = Time.now()
                 self.started_starting = datetime.utcnow()
+                self.progress = "Adding devices"
                 if not self.activated:
                     self.activated = True
                     log.debug("Service {0} self-activated".format(self.get_full_name()))
@@ -122,10 +151,20 @@ class Filesystem(DataService):
                 # be `added` and thus we know what `kind` a FS is. So, instead of
                 # iterating over all devices, just use `self.kind`-based if/else, right?
                 # See `nfs` case as an example
-                for vol in self.volumes:
-                    # Threading has some issues w/ race conditions over device IDs
-                    # threading.Thread(target=vol.add).start()
-                    vol.add()
+                if len(self.volumes) > 1:
+                    # Attach the volumes concurrently (device names are handed
+                    # out by the device allocator) and mount once all are attached
+                    attach_threads = [threading.Thread(target=vol.prepare)
+                                      for vol in self.volumes]
+                    for t in attach_threads:
+                        t.start()
+                    for t in attach_threads:
+                        t.join()
+                    for vol in self.volumes:
+                        vol.add(prepared=True)
+                else:
+                    for vol in self.volumes:
+                        vol.add()
                 for b in self.buckets:
                     self.kind = 'bucket'
                     threading.Thread(target=b.mount).start()
@@ -264,15 +303,10 @@ class Filesystem(DataService):
             # Keep track of the Volume objects before removing them
             self.grow['smaller_vol_ids'] = self.volumes[:]
             self.__remove(delete_devices=False, remove_from_master=False)
-            self.grow['snap_ids'] = []
             # Create a snapshots of the original volumes
-            for vol in self.grow['smaller_vol_ids']:
-                snap_id = vol.create_snapshot(self.grow['snap_description'])
-                if snap_id:
-                    self.grow['snap_ids'].append(snap_id)
-                else:
-                    log.warning("Did not create a snapshot of vol {0}?!"
-                                .format(vol.volume_id))
+            snapshots = self._start_snapshots(self.grow['smaller_vol_ids'],
+                                              self.grow['snap_description'])
+            self.grow['snap_ids'] = self._finish_snapshots(snapshots)
         else:
             log.debug("Tried to grow '%s' but `self.grow` field is not set." %
                       self.get_full_name())
@@ -323,25 +357,82 @@ class Filesystem(DataService):
                           .format(snap_id))
         self.grow = {}  # Reset the grow flag
 
+    def can_grow_online(self):
+        """
+        Check if this file system can be grown in place, while mounted and in
+        use: it needs to be backed by a single volume that the cloud can
+        resize while attached (i.e., on AWS) and be of a type that can be
+        grown while mounted.
+        """
+        if self.app.cloud_type != 'ec2' or len(self.volumes) != 1 or not self.volumes[0].device:
+            return False
+        entry = mount_table.get(self.mount_point)
+        return entry is not None and entry['fs_type'] in GROWFS_COMMANDS
+
+    def grow_online(self):
+        """
+        Grow this file system without unmounting it: resize the underlying
+        volume in place, grow the file system on the resized device and
+        re-probe its size. No services need to be stopped.
+
+        If the volume cannot be resized, ``self.grow`` is set back to
+        ``pending`` with online growth disabled so the offline expansion
+        (see ``self.expand``) is used instead.
+        """
+        log.debug("Growing file system {0} online".format(self.get_full_name()))
+        self.grow['status'] = 'growing_online'
+        vol = self.volumes[0]
+        if not vol.grow(self.grow.get('new_size')):
+            log.warning("Could not grow file system {0} online; falling back to offline "
+                        "expansion".format(self.get_full_name()))
+            self.grow['online'] = False
+            self.grow['status'] = 'pending'
+            return False
+        entry = mount_table.get(self.mount_point)
+        cmd = GROWFS_COMMANDS[entry['fs_type']].format(mount_point=self.mount_point,
+                                                       device=vol.device)
+        if not run(cmd, "Error growing file system '%s'" % self.mount_point,
+                   "Successfully grew file system '%s'" % self.mount_point):
+            # The volume has been resized already so there is nothing to gain
+            # from the offline path; growing can be retried manually
+            self.grow = {}
+            return False
+        self._update_size()
+        self.grow = {}  # Reset the grow flag
+        return True
+
     def create_snapshot(self, snap_description=None):
         """
         Create a snapshot of this file system.
 
+        Where volumes can be snapshotted while attached (i.e., on AWS), the
+        file system is frozen (``fsfreeze``), snapshots of all its volumes are
+        initiated concurrently and the file system is thawed as soon as all
+        the snapshots have been acknowledged, yielding crash-consistent
+        snapshots without taking the file system offline. Otherwise (or if the
+        file system cannot be frozen), the file system is removed for the
+        duration of the snapshot initiation. In either case, the snapshot
+        progress is tracked in the background and reflected in the volumes'
+        ``snapshot_status``.
+
         .. note::
             This functionality applies only to file systems based on volumes.
         """
-        detach = True
-        if self.app.cloud_type == "ec2":
-            # On AWS it is possible to snapshot a volume while it's still
-            # attached so do that because it's faster
-            detach = False
+        # On AWS it is possible to snapshot a volume while it's still
+        # attached so do that because it's faster
+        if self.app.cloud_type == "ec2" and self._freeze():
+            try:
+                snapshots = self._start_snapshots(self.volumes, snap_description)
+            finally:
+                self._thaw()
+            return self._finish_snapshots(snapshots)
+        detach = self.app.cloud_type != "ec2"
         # Keep track of the Volume objects before removing them
         volumes = self.volumes[:]
         self.__remove(delete_devices=False, detach=detach)
-        snap_ids = []
         # Create a snapshot of the detached volumes
+        snapshots = self._start_snapshots(volumes, snap_description)
         for vol in volumes:
-            snap_ids.append(vol.create_snapshot(snap_description=snap_description))
             self.add_volume(vol_id=vol.volume_id)  # Add back the volume device
         # After the snapshot has begun, add the file system back as a cluster
         # service
@@ -349,7 +440,110 @@ class Filesystem(DataService):
                   "services.".format(self.get_full_name()))
         self.state = service_states.UNSTARTED  # Need to reset state so it gets picked up by monitor
         self.app.manager.activate_master_service(self)
-        return snap_ids
+        return self._finish_snapshots(snapshots)
+
+    def _freeze(self):
+        """
+        Suspend access to this file system so its volumes can be snapshotted
+        in a consistent state. Return ``True`` if the file system was frozen.
+        """
+        return run('/sbin/fsfreeze -f {0}'.format(self.mount_point),
+                   "Error freezing file system {0}".format(self.mount_point),
+                   "Froze file system {0}".format(self.mount_point))
+
+    def _thaw(self):
+        """Resume access to this (frozen) file system."""
+        return run('/sbin/fsfreeze -u {0}'.format(self.mount_point),
+                   "Error thawing file system {0}".format(self.mount_point),
+                   "Thawed file system {0}".format(self.mount_point))
+
+    def _start_snapshots(self, volumes, snap_description):
+        """
+        Initiate snapshots of all the ``volumes`` concurrently and return
+        once all of them have been acknowledged.
+
+        :rtype: list
+        :return: A list of (volume, boto Snapshot) tuples for the snapshots
+                 that were initiated.
+        """
+        snapshots = [None] * len(volumes)
+
+        def start_snapshot(i, vol):
+            snapshots[i] = vol.start_snapshot(snap_description=snap_description)
+        snap_threads = [threading.Thread(target=start_snapshot, args=(i, vol))
+                        for i, vol in enumerate(volumes)]
+        for t in snap_threads:
+            t.start()
+        for t in snap_threads:
+            t.join()
+        for vol, snap in zip(volumes, snapshots):
+            if not snap:
+                log.warning("Did not create a snapshot of vol {0}?!".format(vol.volume_id))
+        return [(vol, snap) for vol, snap in zip(volumes, snapshots) if snap]
+
+    def _finish_snapshots(self, snapshots):
+        """
+        Tag the initiated ``snapshots`` and start tracking their progress in
+        the background. Return a list of the snapshot IDs.
+        """
+        for vol, snap in snapshots:
+            vol.tag_snapshot(snap)
+            self._set_snapshot_status(vol, vol.snapshot_status, vol.snapshot_progress)
+        if snapshots:
+            t = threading.Thread(target=self._track_snapshots, args=(snapshots,))
+            t.daemon = True
+            t.start()
+        return [str(snap.id) for _, snap in snapshots]
+
+    def _track_snapshots(self, snapshots, max_failures=10):
+        """
+        Keep the volumes' ``snapshot_status`` and ``snapshot_progress`` up
+        to date until all the ``snapshots`` complete; check on all of them
+        with a single API call, backing off between the checks.
+
+        See ``self._set_snapshot_status`` for the volume objects that are
+        updated.
+        """
+        pending = dict((snap.id, vol) for vol, snap in snapshots)
+        delay = 5
+        failures = 0
+        while pending and failures < max_failures:
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+            snaps = self.app.cloud_interface.get_all_snapshots(snapshot_ids=pending.keys())
+            if not snaps:
+                failures += 1
+                continue
+            failures = 0
+            for snap in snaps:
+                vol = pending.get(snap.id)
+                if not vol:
+                    continue
+                self._set_snapshot_status(vol, snap.status, snap.progress)
+                if snap.status in ['completed', 'error']:
+                    log.info("Snapshot {0} of volume {1} finished with status {2}"
+                             .format(snap.id, vol.volume_id, snap.status))
+                    del pending[snap.id]
+                    self._set_snapshot_status(vol, None, None)
+        for vol in pending.values():
+            log.warning("Stopped tracking the snapshot of volume {0}".format(vol.volume_id))
+            self._set_snapshot_status(vol, None, None)
+
+    def _set_snapshot_status(self, vol, status, progress):
+        """
+        Set the snapshot ``status`` and ``progress`` of volume ``vol``.
+
+        While being snapshotted, a volume may be removed from this file system
+        and added back as a new ``Volume`` object (see ``self.create_snapshot``)
+        so the values are set on any of ``self.volumes`` for the same cloud
+        volume as well, which is where they are reported from.
+        """
+        vol.snapshot_status = status
+        vol.snapshot_progress = progress
+        for fs_vol in self.volumes:
+            if fs_vol is not vol and fs_vol.volume_id == vol.volume_id:
+                fs_vol.snapshot_status = status
+                fs_vol.snapshot_progress = progress
 
     def _get_attach_device_from_device(self, device):
         """
@@ -407,6 +601,25 @@ class Filesystem(DataService):
                         "'%s' (vols=%s)" % (self.app.cloud_interface.get_instance_id(),
                                             device, self.name, vols))
 
+    def set_worker_cache(self, worker_cache):
+        """
+        Set how workers cache this file system locally (see
+        ``self.worker_cache``). Local copies (``copy`` or ``peer``) do not see
+        changes made to the file system so they are accepted only if the file
+        system is ``read_only``; otherwise, the file system is not cached.
+
+        :rtype: bool
+        :return: ``True`` if ``worker_cache`` was accepted, ``False`` otherwise.
+        """
+        if worker_cache in ('copy', 'peer') and not self.read_only:
+            log.error("File system {0} is not read-only so workers cannot keep a local "
+                      "copy of it (worker_cache: {1}); not caching it"
+                      .format(self.get_full_name(), worker_cache))
+            self.worker_cache = None
+            return False
+        self.worker_cache = worker_cache
+        return True
+
     def nfs_share_and_set_state(self, ok_state=service_states.RUNNING,
                                 err_state=service_states.ERROR, mount_point=None):
         """
@@ -417,8 +630,10 @@ class Filesystem(DataService):
         previous_state = self.state
         if not mount_point:
             mount_point = self.mount_point
+        self.progress = None
         log.debug("Exporting FS {0} over NFS".format(mount_point))
-        if NFSExport.add_nfs_share(mount_point):
+        if NFSExport.add_nfs_share(mount_point, permissions='ro' if self.read_only else 'rw',
+                                   options=self.nfs_export_options):
             self.state = ok_state
         else:
             self.state = err_state
@@ -464,50 +679,36 @@ class Filesystem(DataService):
             return True
         return False
 
-    def _update_size(self, cmd=None):
+    def _update_size(self, path=None):
         """
         Update local size fields to reflect the current file system usage.
-        The optional ``cmd`` can be specified if the process of obtaining the
-        file system size differs from the *standard* one. If provided, the output
-        from this command must have the following format: *total used percentage*,
-        in bytes. For example: ``11524096   2314808   21%``
-        """
-        if not cmd:
-            # Get the size and usage status for this file system in bytes
-            cmd = "df --block-size 1 | grep %s$  | awk '{print $2, $3, $5}'" % self.name
-        # Extract size & usage
-        try:
-            disk_usage = commands.getoutput(cmd)
-            if disk_usage:
-                disk_usage = disk_usage.split(' ')
-                if len(disk_usage) == 3:
-                    self.size = disk_usage[0]
-                    self.size_used = disk_usage[1]
-                    self.size_pct = disk_usage[2]
-            else:
-                log.warning("Empty disk usage for FS '{0}'".format(self.name))
-        except Exception, e:
-            log.debug("Error updating file system {0} size and usage: {1}".format(
-                self.get_full_name(), e))
+        The optional ``path`` can be specified if the file system whose size
+        should be reported differs from the one mounted at ``self.mount_point``.
+
+        The size is obtained via ``disk_usage`` so a stale mount cannot block
+        the caller; if the probe times out, the last good values are kept and
+        the file system is flagged as ``stale``.
+        """
+        if not path:
+            path = self.mount_point
+        usage = disk_usage.usage(path)
+        if usage:
+            self.size = usage['total']
+            self.size_used = usage['used']
+            self.size_pct = usage['used_percent']
+            self.stale = usage['stale']
+        else:
+            self.stale = disk_usage.is_stale(path)
+            log.warning("No disk usage available for FS '{0}'".format(self.name))
 
     def _is_mounted(self, mount_point=None):
         """
         Check if the `mount_point` (or `self.mount_point` if the argument is not
-        provided) is mounted. Do so by inspecting `/proc/mounts`.
+        provided) is mounted. Do so by consulting the shared mount table.
         """
         if not mount_point:
             mount_point = self.mount_point
-        cmd = ("cat /proc/mounts | grep {0}[[:space:]] | cut -d' ' -f2"
-               .format(mount_point))
-        mnt_location = misc.getoutput(cmd)
-        if mnt_location:
-            try:
-                if mount_point == mnt_location:
-                    return True
-            except Exception, e:
-                log.error("Exception checking if FS {0} is mounted at {1}: {2}"
-                          .format(self.name, mount_point, e))
-        return False
+        return mount_table.is_mounted(mount_point)
 
     def status(self):
         """
@@ -540,29 +741,20 @@ class Filesystem(DataService):
         elif self._service_starting():
             pass
         elif self.mount_point is not None:
-            mnt_location = commands.getstatusoutput("cat /proc/mounts | grep %s[[:space:]] "
-                                                    "| cut -d' ' -f1,2" % self.mount_point)
-            if mnt_location[0] == 0 and mnt_location[1] != '':
+            mnt_entry = mount_table.get(self.mount_point)
+            if mnt_entry:
                 try:
-                    device, mnt_path = mnt_location[1].split(' ')
                     # Check volume(s) if part of the file system
                     if len(self.volumes) > 0:
                         self.check_and_update_volume(
-                            self._get_attach_device_from_device(device))
-                    # Check mount point
-                    if mnt_path == self.mount_point:
-                        self.state = service_states.RUNNING
-                        self._update_size()
-                    else:
-                        log.error("STATUS CHECK [FS %s]: Retrieved mount path '%s' "
-                                  "does not match expected path '%s'" %
-                                  (self.get_full_name(), mnt_location[1], self.mount_point))
-                        self.state = service_states.ERROR
+                            self._get_attach_device_from_device(mnt_entry['device']))
+                    self.state = service_states.RUNNING
+                    self._update_size()
                 except Exception, e:
                     log.error("STATUS CHECK: Exception checking status of FS "
                               "'{0}': {1}".format(self.name, e))
                     self.state = service_states.ERROR
-                    log.debug(mnt_location)
+                    log.debug(mnt_entry)
             else:
                 log.error("STATUS CHECK: File system {0} is not mounted at {1}"
                           .format(self.name, self.mount_point))
@@ -6,17 +6,64 @@ storage over NFS to the rest of the cluster.
     The file system behind this device is transient, meaning that it will
     dissapear at instance termination and it cannot be recovered.
 """
+import grp
 import logging
 import os
+import pwd
 
 from cm.services import ServiceRole, service_states
 from cm.services.data import BlockStorage
 from cm.util import misc
 from cm.util import ExtractArchive
+from cm.util.archive_cache import ArchiveCache
 from cm.util.nfs_export import NFSExport
+from cm.util.mount_table import mount_table
 
 log = logging.getLogger('cloudman')
 
+# The md RAID0 array combining the instance's unused ephemeral disks
+TRANSIENT_MD_DEVICE = '/dev/md/cm_transient'
+# RAID0 chunk size, in KB
+TRANSIENT_RAID_CHUNK_SIZE = 256
+# Label of the file system created over the ephemeral disks
+TRANSIENT_FS_LABEL = 'cm_transient'
+
+
+def _os_device(name):
+    """
+    Return the path of the block device the OS exposes for a device named
+    ``name`` in the instance metadata (e.g., ``sdb`` may be ``/dev/xvdb``),
+    or ``None`` if there is no such device.
+    """
+    name = os.path.basename(name)
+    candidates = ['/dev/' + name]
+    if name.startswith('sd'):
+        candidates.append('/dev/xvd' + name[2:])
+    for device in candidates:
+        if os.path.exists(device):
+            return device
+    return None
+
+
+def _device_in_use(device):
+    """
+    Check if ``device`` (or a partition on it) is mounted or held by another
+    device (e.g., it is part of an md array).
+    """
+    mounted = mount_table.mounted_devices()
+    name = os.path.basename(os.path.realpath(device))
+    sys_dir = os.path.join('/sys/class/block', name)
+    devs = [name]
+    if os.path.isdir(sys_dir):
+        devs += [p for p in os.listdir(sys_dir) if p.startswith(name)]
+    for dev in devs:
+        if '/dev/' + dev in mounted:
+            return True
+        holders = os.path.join('/sys/class/block', dev, 'holders')
+        if os.path.isdir(holders) and os.listdir(holders):
+            return True
+    return False
+
 
 class TransientStorage(BlockStorage):
 
@@ -56,12 +103,14 @@ class TransientStorage(BlockStorage):
         """
         log.debug("Adding a transient FS at {0}".format(self.fs.mount_point))
         misc.make_dir(self.fs.mount_point, owner='ubuntu')
+        if ServiceRole.TRANSIENT_NFS in self.fs.svc_roles:
+            self._mount_ephemeral_devices()
         # Make the default instance transient storage group writable
         if self.fs.name == 'transient_nfs':
             misc.chmod(self.fs.mount_point, 0775)
         # Set the device ID
-        cmd = "df %s | grep -v Filesystem | awk '{print $1}'" % self.fs.mount_point
-        self.device = misc.getoutput(cmd)
+        mnt_entry = mount_table.get_containing(self.fs.mount_point)
+        self.device = mnt_entry['device'] if mnt_entry else None
         # If based on an archive, extract archive contents to the mount point
         if self.from_archive:
             # Do not overwrite an existing dir structure w/ the archive content.
@@ -79,10 +128,74 @@ class TransientStorage(BlockStorage):
                           "dedicated thread.".format(self.get_full_name()))
                 ExtractArchive(self.from_archive['url'], self.fs.mount_point,
                                self.from_archive['md5_sum'],
-                               callback=self.fs.nfs_share_and_set_state).run()
+                               callback=self.fs.nfs_share_and_set_state,
+                               cache=ArchiveCache.from_config(self.app.config)).run()
         else:
             self.fs.nfs_share_and_set_state()
 
+    def _unused_ephemeral_devices(self):
+        """
+        Return a list of the instance's ephemeral disks that are not in use
+        (the first one is typically mounted at ``/mnt``).
+        """
+        devices = []
+        for name in self.app.cloud_interface.get_ephemeral_devices():
+            device = _os_device(name)
+            if device and not _device_in_use(device):
+                devices.append(device)
+        return devices
+
+    def _mount_ephemeral_devices(self):
+        """
+        Put the instance's otherwise unused ephemeral disks behind this file
+        system: combine them into an md RAID0 array (or, if there is only one
+        such disk, use it as is), format it with XFS and mount it at the
+        mount point. A device that was set up before (e.g., before a reboot)
+        is found by its file system label and mounted as is.
+
+        If there are no unused ephemeral disks, the file system remains a
+        directory on the instance's default transient storage (i.e., ``/mnt``).
+        Return ``True`` if the file system is on its own device.
+        """
+        mount_point = self.fs.mount_point
+        if mount_table.is_mounted(mount_point):
+            return True
+        device = misc.run('/sbin/blkid -L {0}'.format(TRANSIENT_FS_LABEL), quiet=True)
+        device = device.strip() if isinstance(device, basestring) else None
+        if not device:
+            devices = self._unused_ephemeral_devices()
+            if not devices:
+                return False
+            if len(devices) == 1:
+                device = devices[0]
+                mkfs_opts = ''
+            else:
+                log.info("Combining ephemeral disks {0} into a RAID0 array {1}"
+                         .format(devices, TRANSIENT_MD_DEVICE))
+                if not misc.run('/sbin/mdadm --create {0} --run --level=0 --chunk={1} '
+                                '--raid-devices={2} {3}'
+                                .format(TRANSIENT_MD_DEVICE, TRANSIENT_RAID_CHUNK_SIZE,
+                                        len(devices), ' '.join(devices)),
+                                "Error creating RAID0 array from {0}".format(devices)):
+                    return False
+                device = TRANSIENT_MD_DEVICE
+                # Align the file system with the RAID stripes
+                mkfs_opts = '-d su={0}k,sw={1} '.format(TRANSIENT_RAID_CHUNK_SIZE,
+                                                        len(devices))
+            if not misc.run('/sbin/mkfs.xfs -f -L {0} {1}{2}'
+                            .format(TRANSIENT_FS_LABEL, mkfs_opts, device),
+                            "Error creating a file system on {0}".format(device)):
+                return False
+        if not misc.run('/bin/mount -o noatime {0} {1}'.format(device, mount_point),
+                        "Error mounting {0} at {1}".format(device, mount_point),
+                        "Mounted {0} at {1}".format(device, mount_point)):
+            return False
+        try:
+            os.chown(mount_point, pwd.getpwnam("ubuntu")[2], grp.getgrnam("ubuntu")[2])
+        except (KeyError, OSError), e:
+            log.debug("Could not set the owner of {0}: {1}".format(mount_point, e))
+        return True
+
     def remove(self):
         """
         Initiate removal of this file system from the system.
@@ -97,7 +210,7 @@ class TransientStorage(BlockStorage):
     def status(self):
         """
         Update the status of this data service: make sure the mount point exists
-        and that it is in /etc/exports for NFS
+        and that it is exported over NFS
         """
         # log.debug("Checking the status of {0}".format(self.fs.mount_point))
         if self.fs._service_transitioning():
@@ -119,18 +232,18 @@ class TransientStorage(BlockStorage):
                     # Transient storage needs to be special-cased because
                     # it's not a mounted disk per se but a disk on an
                     # otherwise default device for an instance (i.e., /mnt)
-                    update_size_cmd = ("df --block-size 1 | grep /mnt$ | "
-                                       "awk '{print $2, $3, $5}'")
                     # Some AWS instance types do not have transient storage
                     # and /mnt is just part of / so report that file system size
-                    if not misc.getoutput(update_size_cmd, quiet=True):
-                        update_size_cmd = ("df --block-size 1 | grep /$ | "
-                                           "awk '{print $2, $3, $5}'")
-                    self.fs._update_size(cmd=update_size_cmd)
+                    if mount_table.is_mounted(self.fs.mount_point):
+                        self.fs._update_size()
+                    elif mount_table.is_mounted('/mnt'):
+                        self.fs._update_size(path='/mnt')
+                    else:
+                        self.fs._update_size(path='/')
                 else:
                     # Or should this set it to UNSTARTED? Because this FS is just an
                     # NFS-exported file path...
-                    log.warning("Data service {0} not found in /etc/exports; error!"
+                    log.warning("Data service {0} not found in NFS exports; error!"
                                 .format(self.fs.get_full_name()))
                     self.fs.state = service_states.ERROR
             except Exception, e:
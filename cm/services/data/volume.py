@@ -8,6 +8,7 @@ import pwd
 import time
 import shutil
 import subprocess
+import threading
 from glob import glob
 
 from boto.exception import EC2ResponseError
@@ -19,12 +20,19 @@ from cm.services import ServiceRole
 from cm.services.data import BlockStorage
 from cm.services.data import volume_status
 from cm.util import ExtractArchive
+from cm.util.archive_cache import ArchiveCache
+from cm.util.device_watcher import device_watcher
+from cm.util.prewarm import PrewarmDevice
 
 import logging
 log = logging.getLogger('cloudman')
 
 
 MIN_TIME_BETWEEN_STATUS_CHECKS = 2  # seconds to wait before updating volume status
+MAX_STATUS_CHECK_INTERVAL = 16  # max seconds between volume status checks while waiting
+DEVICE_APPEAR_TIMEOUT = 300  # seconds to wait for an attaching volume to show up in the OS
+DEVICE_GROW_TIMEOUT = 600  # seconds to wait for a modified volume to grow in the OS
+DISK_BY_ID_DIR = '/dev/disk/by-id'
 volume_status_map = {
     'creating': volume_status.CREATING,
     'available': volume_status.AVAILABLE,
@@ -35,6 +43,162 @@ volume_status_map = {
 }
 
 
+class DeviceAllocator(object):
+
+    """
+    Hand out device names for volume attachments so concurrent attaches do
+    not pick the same device. A device name is reserved from the time it is
+    chosen until the attach process of the volume it was chosen for is
+    complete (by which time the device is visible in the OS and accounted
+    for by the device list).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reserved = {}  # attach device name -> volume ID
+
+    def reserve(self, volume_id, next_devices):
+        """
+        Reserve a set of candidate attach devices for volume ``volume_id``.
+
+        :type next_devices: callable
+        :param next_devices: A function that, given a set of device names
+                             that are already reserved, returns a list of
+                             candidate device names (see
+                             ``Volume._get_likely_next_devices``).
+
+        :rtype: tuple
+        :return: The reserved candidate device names, in order of preference.
+        """
+        with self.lock:
+            devices = tuple(next_devices(reserved=frozenset(self.reserved)) or ())
+            for device in devices:
+                self.reserved[device] = volume_id
+            if devices:
+                log.debug("Reserved devices {0} for volume {1}".format(devices, volume_id))
+            return devices
+
+    def release(self, volume_id):
+        """Release all device names reserved for volume ``volume_id``."""
+        with self.lock:
+            for device in [d for d, v in self.reserved.items() if v == volume_id]:
+                del self.reserved[device]
+
+    def reserved_by_others(self, volume_id):
+        """Return the set of device names reserved for other volumes."""
+        with self.lock:
+            return frozenset(d for d, v in self.reserved.items() if v != volume_id)
+
+
+# The allocator shared by all the volumes in the process
+device_allocator = DeviceAllocator()
+
+
+def get_device_by_volume_id(volume_id):
+    """
+    Find the block device for an attached volume ``volume_id`` by its serial
+    number, as exposed under ``/dev/disk/by-id`` (e.g., EBS volumes attached
+    as NVMe devices or Cinder volumes attached via virtio, which use the
+    first 20 characters of the volume ID as the serial number). Return the
+    device path (e.g., ``/dev/nvme1n1``) or ``None`` if it cannot be found.
+    """
+    if not volume_id:
+        return None
+    serials = (volume_id.replace('-', ''), volume_id[:20])
+    for link in glob(os.path.join(DISK_BY_ID_DIR, '*')):
+        name = os.path.basename(link)
+        if '-part' in name:
+            continue
+        if any(name.endswith(serial) for serial in serials):
+            return os.path.realpath(link)
+    return None
+
+
+def get_device_size(device):
+    """
+    Return the size (in bytes) of block ``device`` (e.g., ``/dev/xvdg``), as
+    currently seen by the kernel, or ``None`` if it cannot be determined.
+    """
+    if not device:
+        return None
+    size_file = os.path.join('/sys/class/block',
+                             os.path.basename(os.path.realpath(device)), 'size')
+    try:
+        with open(size_file) as f:
+            # The size is always reported in 512-byte sectors
+            return int(f.read().strip()) * 512
+    except (IOError, ValueError):
+        return None
+
+
+class VolumeInventory(object):
+
+    """
+    A cache of the cloud's view of all the volumes known to this process.
+    All the volumes are refreshed with a single describe call when the
+    cached view is older than ``max_age`` seconds (or has been invalidated)
+    so the number of API calls does not grow with the number of volumes.
+    """
+
+    def __init__(self, max_age=MIN_TIME_BETWEEN_STATUS_CHECKS):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.volume_ids = set()  # IDs of the volumes to keep track of
+        self.volumes = {}  # volume ID -> boto Volume object
+        self.last_refresh = None
+        self.refreshed_ids = set()  # IDs of the volumes included in the last refresh
+
+    def invalidate(self):
+        """
+        Force a refresh on the next lookup; call after changing a volume's
+        state (e.g., attaching it).
+        """
+        with self.lock:
+            self.last_refresh = None
+
+    def forget(self, volume_id):
+        """Stop keeping track of volume ``volume_id`` (e.g., after deleting it)."""
+        with self.lock:
+            self.volume_ids.discard(volume_id)
+            self.volumes.pop(volume_id, None)
+
+    def _refresh(self, cloud_interface):
+        volume_ids = sorted(self.volume_ids)
+        try:
+            vols = cloud_interface.get_all_volumes(volume_ids=volume_ids) or []
+        except EC2ResponseError, e:
+            if e.error_code != 'InvalidVolume.NotFound':
+                log.error("Error refreshing volume inventory: {0}".format(e))
+                return
+            # Some of the volumes are gone; find out which ones one by one
+            vols = []
+            for vol_id in volume_ids:
+                try:
+                    vols += cloud_interface.get_all_volumes(volume_ids=[vol_id]) or []
+                except EC2ResponseError, e:
+                    log.debug("Volume {0} not found: {1}".format(vol_id, e))
+        self.volumes = dict((v.id, v) for v in vols)
+        self.refreshed_ids = set(volume_ids)
+        self.last_refresh = time.time()
+
+    def get(self, cloud_interface, volume_id):
+        """
+        Return the current boto Volume object for volume ``volume_id``, or
+        ``None`` if the volume does not exist. The volume is kept track of
+        from the first lookup on.
+        """
+        with self.lock:
+            self.volume_ids.add(volume_id)
+            if (self.last_refresh is None or volume_id not in self.refreshed_ids or
+                    self.last_refresh < time.time() - self.max_age):
+                self._refresh(cloud_interface)
+            return self.volumes.get(volume_id)
+
+
+# The inventory shared by all the volumes in the process
+volume_inventory = VolumeInventory()
+
+
 class Volume(BlockStorage):
 
     def __init__(
@@ -55,8 +219,8 @@ class Volume(BlockStorage):
         self.static = static
         self.snapshot_progress = None
         self.snapshot_status = None
+        self.prewarmer = None  # A PrewarmDevice thread, if pre-warming the volume
         self._status = volume_status.NONE
-        self._last_status_check = None
 
         if (vol_id):  # get the volume object immediately, if id is passed
             self.update(vol_id)
@@ -98,6 +262,8 @@ class Volume(BlockStorage):
         details['from_archive'] = "No" if not self.from_archive else self.from_archive['url']
         details['snapshot_progress'] = self.snapshot_progress
         details['snapshot_status'] = self.snapshot_status
+        details['prewarm_status'] = self.prewarmer.status if self.prewarmer else None
+        details['prewarm_progress'] = self.prewarmer.progress if self.prewarmer else None
         # TODO: keep track of any errors
         details['err_msg'] = None if details.get('err_msg', '') == '' else details['err_msg']
         details['snapshots_created'] = self.snapshots_created
@@ -198,7 +364,10 @@ class Volume(BlockStorage):
             log.debug("For volume {0} ({1}) set from_snapshot_id to {2}"
                       .format(self.volume_id, self.fs.get_full_name(), self.from_snapshot_id))
             # Check if the volume is already attached
-            if run('ls {0}'.format(attach_device), quiet=True):
+            by_id_device = get_device_by_volume_id(vol.id)
+            if by_id_device:
+                self.device = by_id_device
+            elif run('ls {0}'.format(attach_device), quiet=True):
                 self.device = attach_device
             elif attach_device:
                 # Attach device is different than the system device so figure it out
@@ -237,8 +406,7 @@ class Volume(BlockStorage):
         """
         Returns the device this volume is attached as, as reported by the cloud middleware.
         """
-        if self.volume:
-            self.volume.update()
+        if self.volume and self._refresh_volume():
             return self.volume.attach_data.device
         else:
             return None
@@ -251,28 +419,34 @@ class Volume(BlockStorage):
         if not self.volume:
             # no volume active
             status = volume_status.NONE
-        elif self._status and self._last_status_check >= time.time() - MIN_TIME_BETWEEN_STATUS_CHECKS:
-            status = self._status
+        elif not self._refresh_volume():
+            status = volume_status.NONE
         else:
-            try:
-                self.volume.update()
-                # Take only the first word of the status as openstack adds some extra info
-                # after a space
-                status = volume_status_map.get(self.volume.status.split(' ')[0], None)
-                if status == volume_status.IN_USE and self.volume.attachment_state() == 'attached':
-                    status = volume_status.ATTACHED
-                if not status:
-                    log.error("Unknown volume status: {0}. Setting status to volume_status.NONE"
-                              .format(self.volume.status))
-                    status = volume_status.NONE
-                self._status = status
-                self._last_status_check = time.time()
-            except EC2ResponseError as e:
-                log.error(
-                    'Cannot retrieve status of current volume. {0}'.format(e))
+            # Take only the first word of the status as openstack adds some extra info
+            # after a space
+            status = volume_status_map.get(self.volume.status.split(' ')[0], None)
+            if status == volume_status.IN_USE and self.volume.attachment_state() == 'attached':
+                status = volume_status.ATTACHED
+            if not status:
+                log.error("Unknown volume status: {0}. Setting status to volume_status.NONE"
+                          .format(self.volume.status))
                 status = volume_status.NONE
+            self._status = status
         return status
 
+    def _refresh_volume(self):
+        """
+        Update ``self.volume`` from the volume inventory. Return ``False``
+        if the volume no longer exists.
+        """
+        vol = volume_inventory.get(self.app.cloud_interface, self.volume.id)
+        if vol is None:
+            log.error('Cannot retrieve status of current volume {0}.'.format(self.volume.id))
+            return False
+        if vol is not self.volume:
+            self.volume._update(vol)
+        return True
+
     def wait_for_status(self, status, timeout=-1):
         """
         Wait for ``timeout`` seconds, or until the volume reaches a desired status
@@ -285,17 +459,11 @@ class Volume(BlockStorage):
                 'Attempted to wait for a status ({0}) on a non-existent volume'.format(status))
             return False  # no volume means not worth waiting
         else:
-            start_time = time.time()
-            end_time = start_time + timeout
-            if timeout == -1:
-                checks = "infinite"
-                wait_time = 5
-                wait_forever = True
-            else:
-                checks = 10
-                wait_time = float(timeout) / checks
-                wait_forever = False
-            while wait_forever or time.time() <= end_time:
+            end_time = time.time() + timeout
+            wait_forever = timeout == -1
+            # Back off exponentially between checks to spare the cloud API
+            wait_time = 1
+            while True:
                 if self.status == status:
                     log.debug("Volume {0} ({1}) has reached status '{2}'"
                               .format(self.volume_id, self.fs.get_full_name(), status))
@@ -304,13 +472,17 @@ class Volume(BlockStorage):
                     log.debug("No volume ID; not waiting for desired status ({0})"
                               .format(status))
                     return False
-                else:
-                    log.debug('Waiting for volume {0} (status "{1}"; {2}) to reach status "{3}". '
-                              'Remaining checks: {4}'.format(self.volume_id, self.status,
-                                                             self.fs.get_full_name(), status, checks))
-                    if timeout != -1:
-                        checks -= 1
-                    time.sleep(wait_time)
+                remaining = end_time - time.time()
+                if not wait_forever and remaining <= 0:
+                    break
+                if not wait_forever:
+                    wait_time = min(wait_time, remaining)
+                log.debug('Waiting for volume {0} (status "{1}"; {2}) to reach status "{3}". '
+                          'Next check in {4:.0f} seconds'.format(self.volume_id, self.status,
+                                                                 self.fs.get_full_name(), status,
+                                                                 wait_time))
+                time.sleep(wait_time)
+                wait_time = min(wait_time * 2, MAX_STATUS_CHECK_INTERVAL)
             log.debug('Wait for volume {0} ({1}) to reach status {2} timed out. Current status {3}.'
                       .format(self.volume_id, self.fs.get_full_name(), status, self.status))
             return False
@@ -351,6 +523,7 @@ class Volume(BlockStorage):
                 self.size,
                 self.app.cloud_interface.get_zone(),
                 snapshot=self.from_snapshot_id)
+            volume_inventory.invalidate()
             if self.volume:
                 # When creating from a snapshot in Euca, volume.size may be None
                 self.size = int(self.volume.size or 0)
@@ -386,6 +559,7 @@ class Volume(BlockStorage):
         if self.volume:
             if self.app.cloud_interface.delete_volume(self.volume_id):
                 log.debug("Deleted volume '%s'" % self.volume_id)
+                volume_inventory.forget(self.volume_id)
                 self.volume = None
                 self.volume_id = None
                 return True
@@ -439,7 +613,7 @@ class Volume(BlockStorage):
         new_id = base + chr(ord(letter) + 1)
         return new_id
 
-    def _get_likely_next_devices(self, devices=None):
+    def _get_likely_next_devices(self, devices=None, reserved=frozenset()):
         """
         Returns a list of possible devices to attempt to attempt to attach to.
 
@@ -450,8 +624,9 @@ class Volume(BlockStorage):
         ``/dev/xvd?`` devices exist, then we know to use the next of those.
         Otherwise, test ``/dev/sd?``, ``/dev/xvd?``, then ``/dev/vd?``.
 
-        **This is so totally not thread-safe.** If other devices get attached
-        externally, the device id may already be in use when we get there.
+        Device names in ``reserved`` (i.e., ones that are being attached but
+        are not visible yet) are skipped. On its own, this is not thread-safe;
+        use ``device_allocator`` to obtain devices for an attach.
         """
         if not devices:
             devices = self._get_device_list()
@@ -470,20 +645,93 @@ class Volume(BlockStorage):
             # out the next API device ID. The process accounts for less than
             # six additional volumes being attached...
             potential_device_ids = ['f', 'g', 'h', 'i', 'j', 'k']
-            lnd = '/dev/sd%s' % potential_device_ids[len(nvme) - 1]
+            lnd = self._skip_reserved(
+                '/dev/sd%s' % potential_device_ids[len(nvme) - 1], reserved)
             log.debug("Likely next attach device: %s" % lnd)
             return (lnd,)
         elif vds:
-            return (self._increment_device_id(vds[-1]),)
+            return (self._skip_reserved(self._increment_device_id(vds[-1]), reserved),)
         elif xvds:
-            return (self._increment_device_id(xvds[-1]),)
+            return (self._skip_reserved(self._increment_device_id(xvds[-1]), reserved),)
         elif sds:
-            return (self._increment_device_id(sds[-1]), '/dev/vda', '/dev/xvda')
+            return tuple(d for d in (self._skip_reserved(self._increment_device_id(sds[-1]), reserved),
+                                     '/dev/vda', '/dev/xvda') if d not in reserved)
         else:
             log.error("Could not determine next available device from {0}".format(
                 devices))
             return None
 
+    def _skip_reserved(self, device_id, reserved):
+        """
+        Return ``device_id`` or, if it is in ``reserved``, the first
+        following device ID that is not.
+        """
+        while device_id in reserved:
+            device_id = self._increment_device_id(device_id)
+        return device_id
+
+    def _wait_for_device(self, attempted_device, pre_devices):
+        """
+        Wait for the device of this (attaching) volume to show up in the OS
+        and return it, or return ``None`` if it does not show up in time or
+        the attach fails.
+
+        The device is looked up by the volume ID if the cloud exposes it as
+        the device serial number. Otherwise, it is determined from the
+        devices that appeared since ``pre_devices`` were listed, ignoring
+        any that were reserved by other, concurrent attaches; if several
+        such devices appear and none is ``attempted_device``, the device
+        cannot be determined and the wait is aborted. The lookup is
+        repeated as device events arrive; the cloud API is consulted only
+        as a fallback, with an exponential backoff.
+        """
+        others = device_allocator.reserved_by_others(self.volume_id)
+        # A device reserved as /dev/sd? may show up as /dev/xvd?
+        others |= frozenset(d.replace('/dev/sd', '/dev/xvd') for d in others)
+        ambiguous = [False]
+
+        def find_device():
+            device = get_device_by_volume_id(self.volume_id)
+            if device:
+                return device
+            new_devices = self._get_device_list() - pre_devices - others
+            if attempted_device in new_devices:
+                return attempted_device
+            elif len(new_devices) == 1:
+                return tuple(new_devices)[0]
+            elif len(new_devices) > 1:
+                log.error("Multiple devices (%s) added to OS during process, "
+                          "and none are the requested device. Can't determine "
+                          "new device. Aborting" % ', '.join(new_devices))
+                ambiguous[0] = True
+                return True  # Stop waiting
+            return None
+
+        attach_seen = [False]
+
+        def attach_in_progress():
+            status = self.status
+            if status in [volume_status.ATTACHING, volume_status.ATTACHED,
+                          volume_status.IN_USE]:
+                attach_seen[0] = True
+                return True
+            # The attach failed if the volume went back to being available
+            if status == volume_status.NONE or (
+                    attach_seen[0] and status == volume_status.AVAILABLE):
+                log.debug("Volume {0} is no longer attaching (status: {1})"
+                          .format(self.volume_id, status))
+                return False
+            return True
+
+        device = device_watcher.wait_for(find_device, DEVICE_APPEAR_TIMEOUT,
+                                         fallback=attach_in_progress)
+        if ambiguous[0]:
+            return None
+        if not device:
+            log.debug('Could not find attached device for volume {0}. Attempted device = {1}'
+                      .format(self.volume_id, attempted_device))
+        return device
+
     def _do_attach(self, attach_device):
         """
         Do the actual process of attaching this volume to the current instance.
@@ -496,6 +744,7 @@ class Volume(BlockStorage):
                            attach_device))
                 self.volume.attach(
                     self.app.cloud_interface.get_instance_id(), attach_device)
+                volume_inventory.invalidate()
             else:
                 log.error("Attaching volume '%s' to instance '%s' failed because "
                           "could not determine device."
@@ -554,39 +803,26 @@ class Volume(BlockStorage):
                 return None
 
         # attempt to attach
-        for attempted_device in self._get_likely_next_devices():
-            pre_devices = self._get_device_list()
-            log.debug(
-                'Before attach, devices = {0}'.format(' '.join(pre_devices)))
-            if self._do_attach(attempted_device):
-                if self.wait_for_status(volume_status.ATTACHED):
-                    time.sleep(10)  # give a few seconds for the device to show up in the OS
-                    post_devices = self._get_device_list()
-                    log.debug('After attach, devices = {0}'.format(
-                        ' '.join(post_devices)))
-                    new_devices = post_devices - pre_devices
-                    log.debug('New devices = {0}'.format(' '.join(new_devices)))
-                    if len(new_devices) == 0:
-                        log.debug('Could not find attached device for volume {0}. Attempted device = {1}'
-                                  .format(self.volume_id, attempted_device))
-                    elif attempted_device in new_devices:
-                        self.device = attempted_device
-                        return attempted_device
-                    elif len(new_devices) > 1:
-                        log.error("Multiple devices (%s) added to OS during process, "
-                                  "and none are the requested device. Can't determine "
-                                  "new device. Aborting" % ', '.join(new_devices))
-                        return None
-                    else:
-                        device = tuple(new_devices)[0]
+        attempted_devices = device_allocator.reserve(self.volume_id,
+                                                     self._get_likely_next_devices)
+        try:
+            for attempted_device in attempted_devices:
+                pre_devices = self._get_device_list()
+                log.debug(
+                    'Before attach, devices = {0}'.format(' '.join(pre_devices)))
+                if self._do_attach(attempted_device):
+                    device = self._wait_for_device(attempted_device, pre_devices)
+                    if device:
                         self.device = device
                         log.debug("For {0}, set self.device to {1}".format(
                                   self.fs.get_full_name(), device))
                         return device
-                # requested device didn't attach, for whatever reason
-                if self.status != volume_status.AVAILABLE and attempted_device[-3:-1] != 'vd':
-                    self.detach()  # in case it attached invisibly
-                self.wait_for_status(volume_status.AVAILABLE, 60)
+                    # requested device didn't attach, for whatever reason
+                    if self.status != volume_status.AVAILABLE and attempted_device[-3:-1] != 'vd':
+                        self.detach()  # in case it attached invisibly
+                    self.wait_for_status(volume_status.AVAILABLE, 60)
+        finally:
+            device_allocator.release(self.volume_id)
         return None  # no device properly attached
 
     def detach(self):
@@ -598,6 +834,7 @@ class Volume(BlockStorage):
            and self.volume:
             try:
                 self.volume.detach()
+                volume_inventory.invalidate()
             except EC2ResponseError, e:
                 log.error("Detaching volume '%s' from instance '%s' failed. Exception: %s"
                           % (self.volume_id, self.app.cloud_interface.get_instance_id(), e))
@@ -607,6 +844,7 @@ class Volume(BlockStorage):
                 log.debug('Attempting to detach again.')
                 try:
                     self.volume.detach()
+                    volume_inventory.invalidate()
                 except EC2ResponseError, e:
                     log.error("Detaching volume '%s' from instance '%s' failed. Exception: %s" % (
                         self.volume_id, self.app.cloud_interface.get_instance_id(), e))
@@ -626,23 +864,73 @@ class Volume(BlockStorage):
         Create a point-in-time snapshot of the current volume, optionally
         specifying a description for the snapshot.
         """
+        snapshot = self.start_snapshot(snap_description)
+        if snapshot:
+            self.tag_snapshot(snapshot)
+            return str(snapshot.id)
+        return None
+
+    def start_snapshot(self, snap_description=None):
+        """
+        Initiate a snapshot of the current volume and return the boto
+        Snapshot object (or ``None`` if the snapshot could not be created)
+        as soon as the cloud acknowledges the request. The snapshot's status
+        and progress are reflected in ``self.snapshot_status`` and
+        ``self.snapshot_progress``.
+        """
         log.debug("Initiating creation of a snapshot for volume '%s'" % self.volume_id)
         try:
             snapshot = self.volume.create_snapshot(description=snap_description)
             log.info("Created snapshot {0} from volume {1} ({2}). Check the snapshot "
                      "for status.".format(snapshot.id, self.volume_id, self.fs))
             self._derived_snapshots.append(snapshot)
-            # Add tags to the newly created snapshot
+            self.snapshot_status = snapshot.status
+            self.snapshot_progress = snapshot.progress
+            return snapshot
+        except EC2ResponseError as ex:
+            log.error("Error creating a snapshot from volume '%s': %s" %
+                      (self.volume_id, ex))
+            return None
+
+    def tag_snapshot(self, snapshot):
+        """
+        Add tags to the newly created ``snapshot`` of this volume.
+        """
+        try:
             self.app.cloud_interface.add_tag(snapshot, 'Name',
                                              self.app.config['cluster_name'])
             self.app.cloud_interface.add_tag(
                 self.volume, 'bucketName', self.app.config['bucket_cluster'])
             self.app.cloud_interface.add_tag(self.volume, 'filesystem', self.fs.name)
-            return str(snapshot.id)
         except EC2ResponseError as ex:
-            log.error("Error creating a snapshot from volume '%s': %s" %
-                      (self.volume_id, ex))
-            return None
+            log.error("Error tagging snapshot '%s' of volume '%s': %s" %
+                      (snapshot.id, self.volume_id, ex))
+
+    def grow(self, new_size):
+        """
+        Grow this (attached) volume to ``new_size`` GB in place and wait for
+        its block device to reflect the new size. Return ``True`` if the
+        device has grown, ``False`` otherwise (e.g., if the cloud does not
+        support modifying volumes).
+        """
+        log.debug("Growing volume {0} from {1}GB to {2}GB"
+                  .format(self.volume_id, self.size, new_size))
+        if not self.app.cloud_interface.modify_volume_size(self.volume_id, new_size):
+            return False
+        volume_inventory.invalidate()
+        new_bytes = int(new_size) * 1024 ** 3
+
+        def grown():
+            size = get_device_size(self.device)
+            return size is not None and size >= new_bytes
+        # The kernel sends a change event once the device capacity changes
+        if not device_watcher.wait_for(grown, DEVICE_GROW_TIMEOUT, initial_delay=5,
+                                       max_delay=60):
+            log.error("Device {0} of volume {1} did not grow to {2}GB in {3} seconds"
+                      .format(self.device, self.volume_id, new_size, DEVICE_GROW_TIMEOUT))
+            return False
+        self.size = int(new_size)
+        return True
 
     def get_from_snap_id(self):
         """
@@ -651,12 +939,14 @@ class Volume(BlockStorage):
         """
         return self.from_snapshot_id
 
-    def add(self):
+    def prepare(self):
         """
-        Add this volume as a file system. This implies creating a volume (if
-        it does not already exist), attaching it to the instance, and mounting
-        the file system.
+        Create this volume (if it does not already exist) and attach it to the
+        instance. Return the attached device or ``None`` if the volume could
+        not be attached.
         """
+        if not self.volume_id:
+            self.fs.progress = "Creating volume"
         self.create(self.fs.name)
         # Mark a volume as 'static' if created from a snapshot
         # Note that if a volume is marked as 'static', it is assumed it
@@ -678,10 +968,21 @@ class Volume(BlockStorage):
                 self.fs.kind = 'snapshot'
         else:
             self.fs.kind = 'volume'
-        if self.attach():
+        self.fs.progress = "Attaching volume {0}".format(self.volume_id)
+        return self.attach()
+
+    def add(self, prepared=False):
+        """
+        Add this volume as a file system. This implies creating a volume (if
+        it does not already exist), attaching it to the instance, and mounting
+        the file system. If ``prepared`` is set, the volume has already been
+        created and attached (see ``prepare``) so just mount it.
+        """
+        if (self.device if prepared else self.prepare()):
             us = os.path.join(self.app.path_resolver.galaxy_data, 'upload_store')
             misc.remove(us)
             log.debug("Volume attached, mounting {0}".format(self.fs.mount_point))
+            self.fs.progress = "Mounting volume {0}".format(self.volume_id)
             self.mount(self.fs.mount_point)
 
     def remove(self, mount_point, delete_vols=False, detach=True):
@@ -825,10 +1126,14 @@ class Volume(BlockStorage):
                         self.fs.nfs_share_and_set_state()
                     else:
                         self.fs.state = service_states.CONFIGURING
+                        self.fs.progress = "Extracting archive"
                         # Extract the FS archive in a separate thread
                         ExtractArchive(self.from_archive['url'], mount_point,
                                        self.from_archive['md5_sum'],
-                                       callback=self.fs.nfs_share_and_set_state).run()
+                                       callback=self.fs.nfs_share_and_set_state,
+                                       cache=ArchiveCache.from_config(self.app.config)).run()
+                elif self.from_snapshot_id and self.fs.prewarm:
+                    self.prewarm()
                 else:
                     self.fs.nfs_share_and_set_state()
                 return True
@@ -837,11 +1142,35 @@ class Volume(BlockStorage):
                             "(%s/30)." % (self.volume_id, self.status, counter))
                 time.sleep(2)
 
+    def prewarm(self):
+        """
+        Read every block of this volume (restored from a snapshot) in the
+        background so the data is loaded from the snapshot before it is
+        needed. If the file system is set to wait for it (i.e., its
+        ``prewarm`` is ``wait``), the file system is held in ``CONFIGURING``
+        state (so services depending on it do not start) until the volume is
+        pre-warmed; otherwise, it is made available right away.
+        """
+        if self.fs.prewarm == 'wait':
+            self.fs.state = service_states.CONFIGURING
+            self.fs.progress = "Pre-warming volume {0}".format(self.volume_id)
+            callback = self.fs.nfs_share_and_set_state
+        else:
+            self.fs.nfs_share_and_set_state()
+            callback = None
+        self.prewarmer = PrewarmDevice(self.device, callback=callback)
+        self.prewarmer.start()
+
     def unmount(self, mount_point):
         """
         Unmount the file system from the specified mount point, removing it from
         NFS in the process.
         """
+        if self.prewarmer:
+            # Wait for the readers to let go of the device
+            self.prewarmer.stop()
+            if self.prewarmer.is_alive():
+                self.prewarmer.join()
         self.fs.remove_nfs_share()
         self.fs.status()
         if self.fs.state == service_states.RUNNING or self.fs.state == service_states.SHUTTING_DOWN:
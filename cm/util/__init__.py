@@ -11,10 +11,12 @@ import requests
 import os
 import sys
 import tarfile
+import time
 from contextlib import closing
 
 from cm.util import misc
 from cm.util.bunch import Bunch
+from cm.util.archive_cache import CachingReader
 
 # Define available states for various services
 cluster_status = Bunch(
@@ -32,6 +34,8 @@ instance_states = Bunch(
     RUNNING="running",
     SHUTTING_DOWN="shutting-down",
     TERMINATED="terminated",
+    STOPPING="stopping",
+    STOPPED="stopped",
     ERROR="error"
 )
 instance_lifecycle = Bunch(
@@ -47,6 +51,17 @@ spot_states = Bunch(
 log = logging.getLogger('cloudman')
 _lock = threading.RLock()
 
+# Number of concurrent connections used to download an archive
+DEFAULT_DOWNLOAD_CONNECTIONS = 4
+# Number of bytes fetched by a single HTTP Range request
+DEFAULT_DOWNLOAD_RANGE_SIZE = 8 * 1024 * 1024
+# Number of downloaded ranges that may be buffered ahead of the reader
+DEFAULT_DOWNLOAD_BUFFERED_RANGES = 8
+# Number of times a range is resumed after a transient error
+DEFAULT_DOWNLOAD_RETRIES = 5
+# Number of seconds to wait for the server to connect or send data
+DOWNLOAD_TIMEOUT = 60
+
 
 def synchronized(func):
     """This wrapper will serialize access to 'func' to a single thread. Use it as a decorator."""
@@ -164,6 +179,211 @@ if __name__ == '__main__':
     doctest.testmod(sys.modules[__name__], verbose=False)
 
 
+class ParallelDownload(object):
+
+    """
+    A read-only file-like object over the contents of `url`, which are
+    downloaded ahead of the reader with up to `connections` concurrent HTTP
+    Range requests of `range_size` bytes each. Downloaded ranges are
+    reassembled in order; at most `max_buffered` ranges are held ahead of
+    the reader so the download is paced by the consumer (e.g., `tar`).
+
+    A range interrupted by a transient error is resumed from the last byte
+    received, up to `retries` times. If the server does not support range
+    requests, the contents are streamed over a single connection (still
+    ahead of the reader).
+
+    Call `open` before reading and `close` when done.
+    """
+
+    def __init__(self, url, connections=DEFAULT_DOWNLOAD_CONNECTIONS,
+                 range_size=DEFAULT_DOWNLOAD_RANGE_SIZE,
+                 max_buffered=DEFAULT_DOWNLOAD_BUFFERED_RANGES,
+                 retries=DEFAULT_DOWNLOAD_RETRIES):
+        self.url = url
+        self.connections = connections
+        self.range_size = range_size
+        self.max_buffered = max_buffered
+        self.retries = retries
+        self.size = None  # Total size of the contents, if known
+        self.ranged = False  # Set if the contents are fetched in ranges
+        self.cond = threading.Condition()
+        self.ranges = {}  # Range index -> downloaded data not read yet
+        self.num_ranges = None  # Total number of ranges, once known
+        self.next_range = 0  # Index of the next range to be fetched
+        self.read_range = 0  # Index of the next range to be read
+        self.error = None
+        self.closed = False
+        self._probe = None
+        self._buf = ''
+        self._pos = 0
+
+    def _get(self, first_byte=None, last_byte=None):
+        headers = {}
+        if first_byte is not None:
+            headers['Range'] = 'bytes={0}-{1}'.format(first_byte, last_byte)
+        r = requests.get(self.url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        r.raise_for_status()
+        return r
+
+    def open(self):
+        """
+        Start the download. The first range is requested right away; its
+        response tells whether the server supports range requests.
+        """
+        r = self._get(0, self.range_size - 1)
+        content_range = r.headers.get('content-range', '')
+        if r.status_code == 206 and '/' in content_range and not content_range.endswith('/*'):
+            self.ranged = True
+            self.size = int(content_range.rsplit('/', 1)[1])
+            self.num_ranges = max(1, -(-self.size // self.range_size))
+            self._probe = r
+            workers = [threading.Thread(target=self._fetch_ranges)
+                       for _ in range(min(self.connections, self.num_ranges))]
+        else:
+            log.debug("Server does not support range requests for {0}; downloading "
+                      "over a single connection".format(self.url))
+            self.size = int(r.headers.get('content-length', -1))
+            workers = [threading.Thread(target=self._stream, args=(r,))]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        return self
+
+    def close(self):
+        """Stop downloading; any buffered data is discarded."""
+        with self.cond:
+            self.closed = True
+            self.ranges = {}
+            self.cond.notify_all()
+
+    def _wait_for_slot(self, index):
+        """
+        Wait until range `index` may be buffered. Return `False` if the
+        download has been stopped in the meantime.
+        """
+        with self.cond:
+            while not (self.closed or self.error) and \
+                    index >= self.read_range + self.max_buffered:
+                self.cond.wait()
+            return not (self.closed or self.error)
+
+    def _put(self, index, data):
+        with self.cond:
+            if not self.closed:
+                self.ranges[index] = data
+            self.cond.notify_all()
+
+    def _fail(self, error):
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def _fetch_ranges(self):
+        while True:
+            with self.cond:
+                index = self.next_range
+                if index >= self.num_ranges or self.closed or self.error:
+                    return
+                self.next_range += 1
+            if not self._wait_for_slot(index):
+                return
+            try:
+                data = self._fetch_range(index)
+            except Exception, e:
+                self._fail(e)
+                return
+            self._put(index, data)
+
+    def _fetch_range(self, index):
+        """Download range `index`, resuming it after transient errors."""
+        first_byte = index * self.range_size
+        last_byte = min(first_byte + self.range_size, self.size) - 1
+        pieces = []
+        received = 0
+        attempt = 0
+        while True:
+            try:
+                if index == 0 and self._probe is not None:
+                    r, self._probe = self._probe, None
+                else:
+                    r = self._get(first_byte + received, last_byte)
+                    if r.status_code != 206:
+                        r.close()
+                        raise IOError("Unexpected response to a range request: {0}"
+                                      .format(r.status_code))
+                with closing(r):
+                    while first_byte + received <= last_byte:
+                        if self.closed:
+                            return None
+                        piece = r.raw.read(min(65536, last_byte + 1 - first_byte - received))
+                        if not piece:
+                            raise IOError("Connection closed by the server")
+                        pieces.append(piece)
+                        received += len(piece)
+                return ''.join(pieces)
+            except Exception, e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                log.debug("Error downloading bytes {0}-{1} of {2}: {3}; resuming from byte "
+                          "{4} (attempt {5}/{6})".format(first_byte, last_byte, self.url, e,
+                                                         first_byte + received, attempt,
+                                                         self.retries))
+                time.sleep(min(2 ** attempt, 30))
+
+    def _stream(self, r):
+        index = 0
+        try:
+            with closing(r):
+                while self._wait_for_slot(index):
+                    data = r.raw.read(self.range_size)
+                    if not data:
+                        break
+                    self._put(index, data)
+                    index += 1
+        except Exception, e:
+            self._fail(e)
+            return
+        with self.cond:
+            self.num_ranges = index
+            self.cond.notify_all()
+
+    def _next_range(self):
+        """
+        Wait for the next range to be downloaded and make it the current
+        buffer. Return `False` at the end of the contents.
+        """
+        with self.cond:
+            while True:
+                if self.error:
+                    raise IOError("Error downloading {0}: {1}".format(self.url, self.error))
+                if self.read_range in self.ranges:
+                    self._buf = self.ranges.pop(self.read_range)
+                    self._pos = 0
+                    self.read_range += 1
+                    self.cond.notify_all()
+                    return True
+                if self.closed or (self.num_ranges is not None and
+                                   self.read_range >= self.num_ranges):
+                    return False
+                self.cond.wait()
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self._pos >= len(self._buf) and not self._next_range():
+                break
+            if size < 0:
+                piece = self._buf[self._pos:]
+            else:
+                piece = self._buf[self._pos:self._pos + size]
+                size -= len(piece)
+            self._pos += len(piece)
+            pieces.append(piece)
+        return ''.join(pieces)
+
+
 class ExtractArchive(threading.Thread):
 
     """
@@ -173,16 +393,26 @@ class ExtractArchive(threading.Thread):
     This is intended to be invoked in a separate thread. After the thread
     finishes execution, `callback` method will be called.
 
+    The archive is downloaded over up to `connections` concurrent
+    connections (see `ParallelDownload`) while it is being extracted and its
+    MD5 sum is computed as it is extracted. If a `cache` is provided, the
+    archive is extracted from (or added to) it and a completed extraction to
+    `path` is not repeated.
+
     Note: currently only tar files are supported for the archive.
     """
 
-    def __init__(self, archive_url, path, md5_sum=None, callback=None, num_retries=1):
+    def __init__(self, archive_url, path, md5_sum=None, callback=None, num_retries=1,
+                 connections=DEFAULT_DOWNLOAD_CONNECTIONS, cache=None):
         threading.Thread.__init__(self)
         self.archive_url = archive_url
         self.path = path
         self.md5_sum = md5_sum
         self.callback = callback
         self.num_retries = num_retries
+        self.connections = connections
+        self.cache = cache  # An optional cm.util.archive_cache.ArchiveCache
+        self.cache_key = None
 
     def _md5_check_ok(self, digest):
         """Do the MD5 checksum. Return `True` if OK; `False` otherwise."""
@@ -195,24 +425,61 @@ class ExtractArchive(threading.Thread):
                      self.archive_url, self.md5_sum, digest))
         return True
 
+    def _extract_from(self, fp, size):
+        """
+        Extract the tar archive read from `fp` (of `size` bytes, if known)
+        to `path` and return the MD5 sum of the archive.
+        """
+        start = datetime.utcnow()
+        stream = MD5TransparentFilter(fp)
+        with closing(tarfile.open(fileobj=stream, mode='r|*', errorlevel=0)) as archive:
+            archive.extractall(path=self.path)
+        # Consume any trailing padding so the checksum covers the whole file
+        while stream.read(65536):
+            pass
+        log.debug("Completed extracting archive {0} ({1}) to {2} ({3}) in {4}"
+                  .format(self.archive_url, misc.nice_size(size), self.path,
+                          misc.nice_size(misc.get_dir_size(self.path)),
+                          datetime.utcnow() - start))
+        return stream.hexdigest()
+
     def _extract(self):
         """
         Do the extraction of a tar archive from `archive_url` to a specified
-        `path`. The data is streamed. Currently supports only tar files.
+        `path`. If the archive is in the local cache, it is extracted from
+        there. Otherwise, the data is streamed, with the download running
+        ahead of the extraction, and added to the cache. Currently supports
+        only tar files.
         """
         try:
-            start = datetime.utcnow()
-            with closing(requests.get(self.archive_url, stream=True)) as r:
-                stream = MD5TransparentFilter(r.raw)
-                with closing(tarfile.open(fileobj=stream, mode='r|*', errorlevel=0)) as archive:
-                    archive.extractall(path=self.path)
-                    hexdigest = stream.hexdigest()
-                    archive_size = r.headers.get('content-length', -1)
-                    log.debug("Completed extracting archive {0} ({1}) to {2} ({3}) in {4}"
-                              .format(self.archive_url, misc.nice_size(archive_size),
-                                      self.path, misc.nice_size(misc.get_dir_size(self.path)),
-                                      datetime.utcnow() - start))
-                    return hexdigest
+            if self.cache_key:
+                cached = self.cache.lookup(self.cache_key)
+                if cached:
+                    log.info("Extracting archive {0} from the local cache ({1})"
+                             .format(self.archive_url, cached))
+                    with open(cached, 'rb') as f:
+                        digest = self._extract_from(f, os.path.getsize(cached))
+                    if not self.md5_sum or digest == self.md5_sum:
+                        return digest
+                    log.warning("Cached archive {0} is corrupt; removing it from the cache"
+                                .format(cached))
+                    self.cache.remove(self.cache_key)
+            download = ParallelDownload(self.archive_url, connections=self.connections)
+            with closing(download.open()):
+                out_file = None
+                if self.cache_key:
+                    out_file = self.cache.start_entry(
+                        self.cache_key, download.size if download.size >= 0 else None)
+                if out_file is None:
+                    return self._extract_from(download, download.size)
+                digest = None
+                try:
+                    digest = self._extract_from(CachingReader(download, out_file),
+                                                download.size)
+                    return digest
+                finally:
+                    self.cache.finish_entry(self.cache_key, out_file, digest is not None and
+                                            (not self.md5_sum or digest == self.md5_sum))
         except Exception as e:
             log.exception("Exception extracting archive {0} to {1}: {2}".format(
                 self.archive_url, self.path, e))
@@ -221,10 +488,22 @@ class ExtractArchive(threading.Thread):
     def run(self):
         log.info("Extracting archive url {0} to {1}. This could take a while..."
                  .format(self.archive_url, self.path))
+        if self.cache is not None:
+            self.cache_key = self.cache.key(self.archive_url, self.md5_sum)
+            if self.cache_key and self.cache.is_extracted(self.path, self.cache_key):
+                log.info("Archive {0} has already been extracted to {1}; not extracting it "
+                         "again".format(self.archive_url, self.path))
+                if self.callback:
+                    self.callback()
+                return
         digest = self._extract()
-        while not self._md5_check_ok(digest) and self.num_retries > 0:
+        ok = self._md5_check_ok(digest)
+        while not ok and self.num_retries > 0:
             digest = self._extract()
+            ok = self._md5_check_ok(digest)
             self.num_retries -= 1
+        if ok and digest and self.cache_key:
+            self.cache.mark_extracted(self.path, self.cache_key)
         if self.callback:
             log.debug(" (X) Callback method defined; calling it now.")
             self.callback()
@@ -0,0 +1,194 @@
+"""
+A local, content-addressed cache of downloaded file system archives.
+
+Archives are cached under a key derived from the archive URL and its MD5 sum
+(or, if no MD5 sum is known, the ETag the server reports for it) so a changed
+archive is never mistaken for a cached one. Entries are written under a
+temporary name and renamed into place only once the download completed and
+verified, so any entry present in the cache is complete. The least recently
+used entries are evicted to keep the cache under a size cap.
+
+Extracted archives are recorded with a marker file in the extraction
+directory so an intact extraction of the same archive can be reused as is.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+import requests
+
+from cm.util.misc import make_dir
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Name of the file recording the archive extracted into a directory
+EXTRACTED_MARKER = '.cloudman_archive'
+
+
+class CachingReader(object):
+
+    """
+    A read-only file-like object that copies everything read from ``fp``
+    into ``out_file``.
+    """
+
+    def __init__(self, fp, out_file):
+        self._fp = fp
+        self._out = out_file
+
+    def read(self, size=-1):
+        buf = self._fp.read(size)
+        self._out.write(buf)
+        return buf
+
+
+class ArchiveCache(object):
+
+    def __init__(self, path, max_size):
+        """
+        :type path: string
+        :param path: The directory to keep the cached archives in
+
+        :type max_size: int
+        :param max_size: Maximum total size of the cached archives, in bytes.
+                         A value of ``0`` disables caching.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create an archive cache as set in ``config`` (``archive_cache_dir``
+        and ``archive_cache_size``, in GB). Return ``None`` if no cache
+        directory is set (i.e., caching is disabled).
+        """
+        if not config.archive_cache_dir:
+            return None
+        return cls(config.archive_cache_dir, int(config.archive_cache_size * 1024 ** 3))
+
+    def key(self, url, md5_sum=None):
+        """
+        Compose the cache key for archive ``url``. If ``md5_sum`` is not
+        provided, the archive's ETag is retrieved from the server instead.
+        Return ``None`` if the archive cannot be identified (in which case it
+        should not be cached).
+        """
+        version = md5_sum
+        if not version:
+            try:
+                r = requests.head(url, allow_redirects=True, timeout=30)
+                version = r.headers.get('etag') if r.ok else None
+            except requests.exceptions.RequestException, e:
+                log.debug("Could not retrieve ETag for archive {0}: {1}".format(url, e))
+        if not version:
+            return None
+        return hashlib.sha1('{0}\0{1}'.format(url, version)).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def lookup(self, key):
+        """
+        Return the path of the cached archive for ``key``, marking it as
+        recently used, or ``None`` if the archive is not cached.
+        """
+        entry = self._entry(key)
+        with self.lock:
+            try:
+                os.utime(entry, None)
+            except OSError:
+                return None
+        return entry
+
+    def remove(self, key):
+        """Remove the archive for ``key`` from the cache (e.g., if corrupt)."""
+        with self.lock:
+            try:
+                os.remove(self._entry(key))
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith('.') or not os.path.isfile(entry):
+                continue
+            st = os.stat(entry)
+            entries.append((st.st_mtime, st.st_size, entry))
+        return sorted(entries)
+
+    def evict(self, reserve=0):
+        """
+        Remove the least recently used archives until the cache, together
+        with ``reserve`` more bytes, fits under the size cap.
+        """
+        with self.lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total + reserve <= self.max_size:
+                    break
+                log.debug("Evicting archive {0} from the cache".format(entry))
+                os.remove(entry)
+                total -= size
+
+    def start_entry(self, key, size=None):
+        """
+        Start adding the archive for ``key`` to the cache, making room for it
+        first. Return a file object to write the archive to, or ``None`` if
+        the archive should not be cached (e.g., if it is too large).
+        Complete the entry with ``finish_entry``. Each entry is written to a
+        file of its own so concurrent downloads of the same archive do not
+        interfere; the last one to finish replaces the others.
+        """
+        if not key or self.max_size <= 0 or (size is not None and size > self.max_size):
+            return None
+        try:
+            make_dir(self.path)
+            self.evict(reserve=size or 0)
+            return tempfile.NamedTemporaryFile(prefix='.{0}.'.format(key), suffix='.partial',
+                                               dir=self.path, delete=False)
+        except (IOError, OSError), e:
+            log.warning("Not caching archive {0}: {1}".format(key, e))
+            return None
+
+    def finish_entry(self, key, out_file, ok):
+        """
+        Complete (if ``ok``) or abandon the cache entry for ``key`` that was
+        written to ``out_file``.
+        """
+        out_file.close()
+        try:
+            if ok:
+                os.rename(out_file.name, self._entry(key))
+                log.debug("Cached archive {0}".format(self._entry(key)))
+                self.evict()
+            else:
+                os.remove(out_file.name)
+        except OSError, e:
+            log.warning("Trouble completing cache entry {0}: {1}".format(key, e))
+
+    @staticmethod
+    def is_extracted(path, key):
+        """
+        Check if the archive for ``key`` has been fully extracted to ``path``.
+        """
+        try:
+            with open(os.path.join(path, EXTRACTED_MARKER)) as f:
+                return f.read().strip() == key
+        except IOError:
+            return False
+
+    @staticmethod
+    def mark_extracted(path, key):
+        """Record that the archive for ``key`` has been extracted to ``path``."""
+        try:
+            with open(os.path.join(path, EXTRACTED_MARKER), 'w') as f:
+                f.write(key + '\n')
+        except IOError, e:
+            log.warning("Could not record extraction of archive to {0}: {1}".format(path, e))
@@ -26,17 +26,19 @@ def CatchCloudErr(f):
 def TestFlag(ret_val, quiet=False):
     """
     Check if ``app.TESTFLAG`` is ``True``. If so, return ``ret_val`` without
-    calling the function. Else, call the function.
+    calling the function. Else, call the function. If ``ret_val`` is callable,
+    the value returned is ``ret_val`` called with the function's arguments.
     If ``quiet`` is set to ``True``, do not log anything.
     """
     def decorator(fn):
         def df(*args, **kwargs):
             cl = args[0]  # Get the function class
             if cl.app.TESTFLAG is True and cl.app.LOCALFLAG is False:
+                val = ret_val(*args, **kwargs) if callable(ret_val) else ret_val
                 if not quiet:
                     log.debug("Attempted to use the '{0}->{1}.{2}' method but TESTFLAG is set. Returning '{3}'."
-                              .format(cl.__module__, cl.__class__.__name__, fn.func_name, ret_val))
-                return ret_val
+                              .format(cl.__module__, cl.__class__.__name__, fn.func_name, val))
+                return val
             else:
                 # TESTFLAG is not set; call the function
                 return fn(*args, **kwargs)
@@ -0,0 +1,127 @@
+"""
+Wake up threads waiting for block devices to show up in the OS.
+
+A single listener thread receives device events from the kernel (and udev)
+over a netlink socket or, if that is not available, from an inotify watch on
+``/dev``. Waiters re-check their condition whenever an event arrives and,
+as a fallback, on an exponentially backed-off timer.
+"""
+import ctypes
+import ctypes.util
+import os
+import socket
+import threading
+import time
+
+import logging
+log = logging.getLogger('cloudman')
+
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast groups for kernel uevents (1) and events processed by udev (2);
+# the latter are sent once udev has created device symlinks (e.g., by-id)
+UEVENT_GROUPS = 1 | 2
+IN_CREATE = 0x00000100
+IN_ATTRIB = 0x00000004
+WATCH_DIRS = ['/dev', '/dev/disk/by-id']
+
+
+class DeviceWatcher(object):
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.events = 0  # Number of device events seen so far
+        self.source = None  # Name of the event source in use, if any
+        self.started = False
+
+    def _open_netlink(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                             NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, UEVENT_GROUPS))
+        return lambda: sock.recv(65536)
+
+    def _open_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init()
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        for path in WATCH_DIRS:
+            if os.path.isdir(path):
+                libc.inotify_add_watch(fd, path, IN_CREATE | IN_ATTRIB)
+        return lambda: os.read(fd, 4096)
+
+    def start(self):
+        """
+        Start listening for device events if not already doing so. Return the
+        name of the event source in use or ``None`` if none is available.
+        """
+        with self.cond:
+            if self.started:
+                return self.source
+            self.started = True
+            for name, opener in [('netlink', self._open_netlink),
+                                 ('inotify', self._open_inotify)]:
+                try:
+                    read = opener()
+                except (socket.error, OSError, AttributeError), e:
+                    log.debug("Device events via {0} not available: {1}".format(name, e))
+                    continue
+                self.source = name
+                t = threading.Thread(target=self._listen, args=(read,))
+                t.daemon = True
+                t.start()
+                log.debug("Listening for device events via {0}".format(name))
+                break
+            return self.source
+
+    def _listen(self, read):
+        while True:
+            try:
+                read()
+            except (socket.error, OSError), e:
+                log.error("Error receiving device events from {0}: {1}"
+                          .format(self.source, e))
+                with self.cond:
+                    self.source = None
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.events += 1
+                self.cond.notify_all()
+
+    def wait_for(self, check, timeout, fallback=None, initial_delay=1, max_delay=16):
+        """
+        Wait until ``check`` returns a true value and return that value, or
+        return ``None`` after ``timeout`` seconds.
+
+        ``check`` is called whenever a device event arrives. In addition, it
+        is called after ``initial_delay`` seconds without success, with the
+        delay doubling each time up to ``max_delay`` seconds. At each such
+        point, the optional ``fallback`` function is called first (e.g., to
+        poll the cloud API); if it returns ``False``, the wait is abandoned.
+        """
+        self.start()
+        end_time = time.time() + timeout
+        delay = initial_delay
+        next_fallback = time.time() + delay
+        while True:
+            with self.cond:
+                seen = self.events
+            result = check()
+            if result:
+                return result
+            now = time.time()
+            if now >= end_time:
+                return None
+            if now >= next_fallback:
+                if fallback is not None and fallback() is False:
+                    return None
+                delay = min(delay * 2, max_delay)
+                next_fallback = now + delay
+                continue
+            with self.cond:
+                if self.events == seen:
+                    self.cond.wait(min(next_fallback, end_time) - now)
+
+
+# The watcher shared by all the threads in the process
+device_watcher = DeviceWatcher()
@@ -0,0 +1,136 @@
+"""
+Hang-proof file system size and usage probing.
+
+``df`` (and ``os.statvfs``, which it uses) blocks uninterruptibly when a
+network file system (e.g., NFS or s3fs) goes stale. To keep such a mount from
+freezing the calling thread (typically the monitor), each probe is done with
+``os.statvfs`` in a separate daemon thread and waited on for a limited time.
+A mount whose probe times out is marked stale and the last good value for it
+is returned instead; no new probe is started for that mount until the hung
+one completes.
+"""
+import math
+import os
+import threading
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Number of seconds to wait for a single probe to complete
+DEFAULT_PROBE_TIMEOUT = 5
+# Maximum number of probe threads that may be hung at any time
+MAX_HUNG_PROBES = 10
+
+
+def _usage_from_statvfs(st):
+    """
+    Compose a usage dict from an ``os.statvfs`` result. Like ``df``, the
+    percentage is computed against the space available to unprivileged users.
+    """
+    total = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    avail = st.f_bavail * st.f_frsize
+    if used + avail > 0:
+        # Round up, as df does
+        pct = -(-used * 100 // (used + avail))
+    else:
+        pct = 0
+    return {'total': total, 'used': used, 'avail': avail,
+            'used_percent': "{0}%".format(pct)}
+
+
+def df_size(size):
+    """
+    Format ``size`` (in bytes) the way ``df -h`` does: a power-of-1024 unit
+    letter, one decimal below 10 and sizes rounded up, e.g., ``20G``, ``9.6G``
+    or ``1.5T``.
+    """
+    units = ['', 'K', 'M', 'G', 'T', 'P', 'E']
+    value, unit = float(size), 0
+    while value >= 1024 and unit < len(units) - 1:
+        value /= 1024
+        unit += 1
+    if unit and value < 10 and math.ceil(value * 10) / 10 < 10:
+        return "{0:.1f}{1}".format(math.ceil(value * 10) / 10, units[unit])
+    value = math.ceil(value)
+    if value >= 1024 and unit < len(units) - 1:
+        return "1.0{0}".format(units[unit + 1])
+    return "{0:.0f}{1}".format(value, units[unit])
+
+
+class DiskUsageProber(object):
+
+    def __init__(self, timeout=DEFAULT_PROBE_TIMEOUT, max_hung=MAX_HUNG_PROBES):
+        self.timeout = timeout
+        self.max_hung = max_hung
+        self.lock = threading.Lock()
+        self.last_good = {}  # path -> last successfully retrieved usage dict
+        self.hung = {}  # path -> a probe thread that has not completed yet
+
+    def _last_good(self, path, stale):
+        usage = self.last_good.get(path)
+        if usage is not None:
+            usage = dict(usage, stale=stale)
+        return usage
+
+    def is_stale(self, path):
+        """Check if a probe of ``path`` is currently hung."""
+        with self.lock:
+            probe = self.hung.get(path)
+            return probe is not None and probe.is_alive()
+
+    def usage(self, path, timeout=None):
+        """
+        Return the size and usage of the file system ``path`` resides on.
+
+        :type path: string
+        :param path: A path on the file system to probe (e.g., a mount point)
+
+        :type timeout: int
+        :param timeout: Number of seconds to wait for the probe; defaults to
+                        ``self.timeout``
+
+        :rtype: dict
+        :return: A dict with ``total``, ``used`` and ``avail`` (in bytes),
+                 ``used_percent`` (a string, e.g., ``21%``) and ``stale``
+                 keys. If the probe did not complete in time or failed, the
+                 last good value is returned (with ``stale`` set if the probe
+                 timed out), or ``None`` if there is no such value.
+        """
+        with self.lock:
+            for p in [p for p, t in self.hung.items() if not t.is_alive()]:
+                log.debug("Previously hung size probe of {0} completed".format(p))
+                del self.hung[p]
+            if path in self.hung:
+                return self._last_good(path, stale=True)
+            if len(self.hung) >= self.max_hung:
+                log.warning("Too many hung file system probes ({0}); not probing {1}"
+                            .format(len(self.hung), path))
+                return self._last_good(path, stale=True)
+            result = {}
+            probe = threading.Thread(target=self._probe, args=(path, result))
+            probe.daemon = True
+            probe.start()
+        probe.join(timeout or self.timeout)
+        with self.lock:
+            if probe.is_alive():
+                log.warning("Probing size of {0} timed out after {1} seconds; "
+                            "marking it as stale".format(path, timeout or self.timeout))
+                self.hung[path] = probe
+                return self._last_good(path, stale=True)
+            if 'error' in result:
+                log.debug("Error probing size of {0}: {1}".format(path, result['error']))
+                return self._last_good(path, stale=False)
+            usage = _usage_from_statvfs(result['stat'])
+            self.last_good[path] = usage
+            return dict(usage, stale=False)
+
+    def _probe(self, path, result):
+        try:
+            result['stat'] = os.statvfs(path)
+        except OSError, e:
+            result['error'] = e
+
+
+# The prober shared by all services in the process
+disk_usage = DiskUsageProber()
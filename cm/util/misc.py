@@ -4,6 +4,7 @@ import commands
 import contextlib
 import datetime as dt
 import errno
+import hashlib
 import logging
 import os
 import re
@@ -11,6 +12,7 @@ import shutil
 import subprocess
 import threading
 import time
+import weakref
 import yaml
 import string
 import random
@@ -27,6 +29,12 @@ from cm.services import ServiceRole
 
 log = logging.getLogger('cloudman')
 
+# Files larger than this many bytes are uploaded to S3 in parts, concurrently
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_PART_SIZE = 16 * 1024 * 1024  # S3 requires at least 5 MB
+MULTIPART_THREADS = 4
+MULTIPART_PART_RETRIES = 4
+
 
 def load_yaml_file(filename):
     """Load ``filename`` in YAML format and return it as a dict"""
@@ -185,12 +193,70 @@ def format_time_delta(delta):
         return '%sm %ss' % (m, s)
 
 
+class BucketCache(object):
+
+    """
+    Handles to the S3 buckets known to exist, per S3 connection. Looking up a
+    bucket takes a request so the handles are kept and shared across calls
+    (and threads) for as long as the connection they belong to is around.
+    """
+
+    def __init__(self):
+        self._buckets = weakref.WeakKeyDictionary()  # s3_conn -> {bucket name: bucket}
+        self._lock = threading.Lock()
+
+    def get(self, s3_conn, bucket_name):
+        """Return the handle to ``bucket_name`` or ``None`` if not cached."""
+        with self._lock:
+            return self._buckets.get(s3_conn, {}).get(bucket_name)
+
+    def add(self, s3_conn, bucket_name, bucket):
+        """Record that ``bucket_name`` exists, with handle ``bucket``."""
+        with self._lock:
+            self._buckets.setdefault(s3_conn, {})[bucket_name] = bucket
+
+    def discard(self, s3_conn, bucket_name):
+        """Forget ``bucket_name`` (e.g., because it was deleted)."""
+        with self._lock:
+            self._buckets.get(s3_conn, {}).pop(bucket_name, None)
+
+
+# The bucket handles shared by all the threads in the process
+bucket_cache = BucketCache()
+
+
+def _bucket_handle(s3_conn, bucket_name):
+    """
+    Return a handle to bucket ``bucket_name`` without checking that the
+    bucket exists (which would take a request); operations on a bucket that
+    does not exist fail with a 404 error instead (see ``_no_such_bucket``).
+    Return ``None`` if there is no S3 connection.
+    """
+    if s3_conn is None or not bucket_name:
+        return None
+    return bucket_cache.get(s3_conn, bucket_name) or \
+        s3_conn.get_bucket(bucket_name, validate=False)
+
+
+def _no_such_bucket(s3_conn, bucket_name, e):
+    """
+    Check if S3 error ``e`` means that bucket ``bucket_name`` does not exist,
+    forgetting any cached handle to the bucket if so.
+    """
+    if e.status == 404 and getattr(e, 'error_code', None) == 'NoSuchBucket':
+        bucket_cache.discard(s3_conn, bucket_name)
+        return True
+    return False
+
+
 def bucket_exists(s3_conn, bucket_name):
     """Check if bucket `bucket_name` exists."""
     if s3_conn is None:
         log.debug("Checking if S3 bucket exists, but no S3 connection provided!?")
         return False
     if bucket_name:
+        if bucket_cache.get(s3_conn, bucket_name):
+            return True
         try:
             b = s3_conn.get_bucket(bucket_name, validate=False)
             try:
@@ -200,9 +266,11 @@ def bucket_exists(s3_conn, bucket_name):
             if b:
                 # log.debug("Checking if bucket '%s' exists... it does." %
                 # bucket_name)
+                bucket_cache.add(s3_conn, bucket_name, b)
                 return True
             else:
                 log.debug("Checking if bucket '%s' exists... it does not." % bucket_name)
+                bucket_cache.discard(s3_conn, bucket_name)
                 return False
         except S3ResponseError as e:
             log.error("Failed to lookup bucket '%s': %s" % (bucket_name, e))
@@ -215,7 +283,9 @@ def create_bucket(s3_conn, bucket_name):
     """Create a bucket called `bucket_name`."""
     try:
         log.debug("Creating bucket '%s'." % bucket_name)
-        s3_conn.create_bucket(bucket_name)
+        b = s3_conn.create_bucket(bucket_name)
+        if b:
+            bucket_cache.add(s3_conn, bucket_name, b)
         log.debug("Created bucket '%s'." % bucket_name)
     except (S3ResponseError, S3CreateError) as e:
         log.error("Failed to create bucket '%s': %s" % (bucket_name, e))
@@ -226,18 +296,16 @@ def create_bucket(s3_conn, bucket_name):
 def get_bucket(s3_conn, bucket_name, validate=False):
     """
     Get handle to bucket `bucket_name`, optionally validating that the bucket
-    actually exists by issuing a HEAD request.
+    actually exists by issuing a HEAD request. Return ``None`` if the bucket
+    does not exist. Handles to existing buckets are cached (see
+    ``bucket_cache``) so the bucket is looked up only the first time.
     """
-    b = None
+    b = bucket_cache.get(s3_conn, bucket_name) if s3_conn else None
+    if b:
+        return b
     if bucket_exists(s3_conn, bucket_name):
-        for i in range(0, 5):
-            try:
-                b = s3_conn.get_bucket(bucket_name, validate=validate)
-                break
-            except S3ResponseError:
-                log.error("Problem connecting to bucket '%s', attempt %s/5" % (
-                    bucket_name, i + 1))
-                time.sleep(2)
+        # Checking that the bucket exists validated it as well
+        b = bucket_cache.get(s3_conn, bucket_name)
     else:
         log.debug("Attempted to get bucket %s but it doesn't exist." % bucket_name)
     return b
@@ -253,7 +321,7 @@ def set_bucket_acl(s3_conn, bucket_name, acl_str='public-read'):
         - ``authenticated-read``: Anyone with a valid S3 account can do actions
           listed above.
     """
-    b = get_bucket(s3_conn, bucket_name)
+    b = _bucket_handle(s3_conn, bucket_name)
     if b:
         try:
             b.set_acl(acl_str)
@@ -275,7 +343,7 @@ def set_key_acl(s3_conn, bucket_name, key_name, acl_str='public-read'):
         - ``authenticated-read``: Anyone with a valid S3 account can do actions
           listed above.
     """
-    b = get_bucket(s3_conn, bucket_name)
+    b = _bucket_handle(s3_conn, bucket_name)
     if b:
         try:
             k = Key(b, key_name)
@@ -306,7 +374,7 @@ def add_bucket_user_grant(s3_conn, bucket_name, permission, canonical_ids, recur
                       will apply the grant to all keys within the bucket
                       or not.
     """
-    b = get_bucket(s3_conn, bucket_name)
+    b = _bucket_handle(s3_conn, bucket_name)
     if b:
         try:
             for c_id in canonical_ids:
@@ -339,7 +407,7 @@ def add_key_user_grant(s3_conn, bucket_name, key_name, permission, canonical_ids
     :param canonical_ids: A list of strings with canonical user ids associated
                         with the AWS account your are granting the permission to.
     """
-    b = get_bucket(s3_conn, bucket_name)
+    b = _bucket_handle(s3_conn, bucket_name)
     if b:
         try:
             k = Key(b, key_name)
@@ -537,7 +605,7 @@ def file_exists_in_bucket(s3_conn, bucket_name, remote_filename):
     :return: True if remote_filename exists in bucket_name
              False otherwise
     """
-    b = get_bucket(s3_conn, bucket_name)
+    b = _bucket_handle(s3_conn, bucket_name)
     if b:
         try:
             k = Key(b, remote_filename)
@@ -557,8 +625,8 @@ def file_in_bucket_older_than_local(s3_conn, bucket_name, remote_filename, local
     :return: True of file in bucket is older than the local file or an error
              while checking the time occurs. False otherwise.
     """
-    bucket = get_bucket(s3_conn, bucket_name)
-    key = bucket.get_key(remote_filename)
+    bucket = _bucket_handle(s3_conn, bucket_name)
+    key = bucket.get_key(remote_filename) if bucket else None
     if key is not None:
         try:
             # Time format must be matched the time provided by boto field
@@ -591,8 +659,8 @@ def get_file_from_bucket(conn, bucket_name, remote_filename, local_file, validat
     successfully retrieved. If an exception occurs or a zero size file is
     retrieved, return `False`.
     """
-    if bucket_exists(conn, bucket_name):
-        b = get_bucket(conn, bucket_name, validate)
+    b = get_bucket(conn, bucket_name, validate) if validate else _bucket_handle(conn, bucket_name)
+    if b:
         k = Key(b, remote_filename)
         try:
             k.get_contents_to_filename(local_file)
@@ -603,8 +671,12 @@ def get_file_from_bucket(conn, bucket_name, remote_filename, local_file, validat
                 log.warn("Got an empty file ({0})?!".format(local_file))
                 return False
         except S3ResponseError as e:
-            log.debug("Failed to get file '%s' from bucket '%s': %s" % (
-                remote_filename, bucket_name, e))
+            if _no_such_bucket(conn, bucket_name, e):
+                log.debug("Bucket '%s' does not exist, did not get remote file '%s'" % (
+                    bucket_name, remote_filename))
+            else:
+                log.debug("Failed to get file '%s' from bucket '%s': %s" % (
+                    remote_filename, bucket_name, e))
             if os.path.exists(local_file):
                 os.remove(local_file)  # Don't leave a partially downloaded or touched file
             return False
@@ -615,18 +687,98 @@ def get_file_from_bucket(conn, bucket_name, remote_filename, local_file, validat
     return True
 
 
+def _upload_file_in_parts(bucket, remote_filename, local_file):
+    """
+    Upload ``local_file`` to ``bucket`` as ``remote_filename`` using an S3
+    multipart upload: the file is sent in parts of ``MULTIPART_PART_SIZE``
+    bytes, by ``MULTIPART_THREADS`` concurrent threads, and each part is
+    retried (up to ``MULTIPART_PART_RETRIES`` times) if sending it fails, so
+    a transient failure does not restart the whole upload. If the upload
+    fails, it is aborted so the parts sent do not linger in the bucket.
+    If the object store does not implement multipart uploads, the file is
+    uploaded as a whole instead.
+    Return ``True`` if the file was uploaded, ``False`` otherwise.
+    """
+    size = os.path.getsize(local_file)
+    parts = [(i + 1, offset, min(MULTIPART_PART_SIZE, size - offset))
+             for i, offset in enumerate(range(0, size, MULTIPART_PART_SIZE))]
+    try:
+        mp = bucket.initiate_multipart_upload(remote_filename)
+    except S3ResponseError as e:
+        if e.status != 501 and e.error_code != 'NotImplemented':
+            raise
+        log.debug("Multipart uploads not supported for bucket '%s'; uploading '%s' "
+                  "as a whole" % (bucket.name, remote_filename))
+        Key(bucket, remote_filename).set_contents_from_filename(local_file)
+        return True
+    lock = threading.Lock()
+    errors = []
+
+    def upload_parts():
+        while True:
+            with lock:
+                if errors or not parts:
+                    return
+                part_num, offset, length = parts.pop(0)
+            for attempt in range(1, MULTIPART_PART_RETRIES + 1):
+                try:
+                    with open(local_file, 'rb') as fp:
+                        fp.seek(offset)
+                        mp.upload_part_from_file(fp, part_num, size=length)
+                    break
+                except Exception as e:
+                    log.debug("Error uploading part %s of '%s' (attempt %s/%s): %s" % (
+                        part_num, remote_filename, attempt, MULTIPART_PART_RETRIES, e))
+                    if attempt == MULTIPART_PART_RETRIES:
+                        with lock:
+                            errors.append(e)
+                        return
+                    time.sleep(2 ** attempt)
+    threads = [threading.Thread(target=upload_parts)
+               for _ in range(min(MULTIPART_THREADS, len(parts)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    try:
+        if not errors:
+            mp.complete_upload()
+            return True
+    except S3ResponseError as e:
+        errors.append(e)
+    log.error("Failed to upload file '%s' to bucket '%s' as '%s': %s; aborting the upload" % (
+        local_file, bucket.name, remote_filename, errors[0]))
+    try:
+        mp.cancel_upload()
+    except S3ResponseError as e:
+        log.warning("Could not abort upload of '%s' to bucket '%s': %s" % (
+            remote_filename, bucket.name, e))
+    return False
+
+
 def save_file_to_bucket(conn, bucket_name, remote_filename, local_file):
-    b = get_bucket(conn, bucket_name)
+    """
+    Save ``local_file`` to bucket ``bucket_name`` as ``remote_filename``.
+    Files larger than ``MULTIPART_THRESHOLD`` bytes are uploaded in parts
+    (see ``_upload_file_in_parts``). Return ``True`` if the file was saved.
+    """
+    b = _bucket_handle(conn, bucket_name)
     if b:
         k = Key(b, remote_filename)
         try:
-            k.set_contents_from_filename(local_file)
+            if os.path.getsize(local_file) > MULTIPART_THRESHOLD:
+                if not _upload_file_in_parts(b, remote_filename, local_file):
+                    return False
+            else:
+                k.set_contents_from_filename(local_file)
             log.debug("Saved file '%s' of size %sB as '%s' to bucket '%s'"
-                      % (local_file, k.size, remote_filename, bucket_name))
+                      % (local_file, os.path.getsize(local_file), remote_filename, bucket_name))
             # Store some metadata (key-value pairs) about the contents of the
             # file being uploaded
             k.set_metadata('date_uploaded', dt.datetime.utcnow())
-        except S3ResponseError as e:
+        except (S3ResponseError, OSError) as e:
+            if isinstance(e, S3ResponseError):
+                _no_such_bucket(conn, bucket_name, e)
             log.error("Failed to save file local file '%s' to bucket '%s' as file '%s': %s" % (
                 local_file, bucket_name, remote_filename, e))
             return False
@@ -665,7 +817,7 @@ def copy_file_in_bucket(s3_conn, src_bucket_name, dest_bucket_name, orig_filenam
 
 def delete_file_from_bucket(conn, bucket_name, remote_filename):
     """Delete an object from a bucket"""
-    b = get_bucket(conn, bucket_name)
+    b = _bucket_handle(conn, bucket_name)
     if b:
         try:
             k = Key(b, remote_filename)
@@ -721,6 +873,7 @@ def delete_bucket(conn, bucket_name):
             for key in keys:
                 key.delete()
             b.delete()
+            bucket_cache.discard(conn, bucket_name)
             log.info("Successfully deleted cluster bucket '%s'" % bucket_name)
     except S3ResponseError as e:
         log.error("Error deleting bucket '%s': %s" % (bucket_name, e))
@@ -734,7 +887,7 @@ def get_file_metadata(conn, bucket_name, remote_filename, metadata_key):
     """
     log.debug("Getting metadata '%s' for file '%s' from bucket '%s'" %
               (metadata_key, remote_filename, bucket_name))
-    b = get_bucket(conn, bucket_name)
+    b = _bucket_handle(conn, bucket_name)
     if b:
         k = b.get_key(remote_filename)
         if k and metadata_key:
@@ -753,7 +906,7 @@ def set_file_metadata(conn, bucket_name, remote_filename, metadata_key, metadata
     log.debug("Setting metadata '%s' for file '%s' in bucket '%s'" % (
         metadata_key, remote_filename, bucket_name))
 
-    b = get_bucket(conn, bucket_name)
+    b = _bucket_handle(conn, bucket_name)
     if b:
         k = b.get_key(remote_filename)
         if k and metadata_key:
@@ -1097,17 +1250,23 @@ def add_to_etc_hosts(ip_address, hosts=[]):
         log.error('Could not update /etc/hosts. {0}'.format(e))
 
 
-def remove_from_etc_hosts(host):
-    """Remove ``host`` (hostname or IP) from ``/etc/hosts``."""
-    if not host:
+def remove_from_etc_hosts(hosts):
+    """
+    Remove ``hosts`` (a hostname or IP, or a list of those) from ``/etc/hosts``.
+    All the hosts are removed with a single rewrite of the file.
+    """
+    if not isinstance(hosts, (list, tuple, set)):
+        hosts = [hosts]
+    hosts = [host for host in hosts if host]
+    if not hosts:
         log.debug("Cannot remove empty host from /etc/hosts")
         return
     try:
-        log.debug("Removing host {0} from /etc/hosts".format(host))
+        log.debug("Removing host(s) {0} from /etc/hosts".format(hosts))
         etc_hosts = open('/etc/hosts', 'r')
         tmp = NamedTemporaryFile()
         for l in etc_hosts:
-            if host not in l:
+            if not any(host in l.split() for host in hosts):
                 tmp.write(l)
         etc_hosts.close()
 
@@ -1150,6 +1309,84 @@ class Sleeper(object):
         self.condition.release()
 
 
+class Debouncer(object):
+
+    """
+    Coalesce calls that arrive in bursts: ``trigger`` schedules ``func`` to
+    run once, ``delay`` seconds after the first call that is not already
+    covered by a pending run. Calls arriving while a run is pending are
+    absorbed by it.
+    """
+
+    def __init__(self, func, delay):
+        self.func = func
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def trigger(self):
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self._run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Cancel any pending run and run ``func`` immediately."""
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        self.func()
+
+    def _run(self):
+        with self.lock:
+            self.timer = None
+        self.func()
+
+
+def write_file_atomically(file_name, contents, mode=0644):
+    """
+    Write ``contents`` to ``file_name`` so readers see either the old or the
+    new file but never a partially written one: the contents are written to a
+    temporary file in the same directory, synced and renamed into place.
+    Return ``True`` on success, ``False`` otherwise.
+    """
+    tmp_path = None
+    try:
+        fd, tmp_path = mkstemp(dir=os.path.dirname(file_name),
+                               prefix='.{0}.'.format(os.path.basename(file_name)))
+        with os.fdopen(fd, 'w') as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, file_name)
+        return True
+    except (IOError, OSError), e:
+        log.error("Trouble writing file {0}: {1}".format(file_name, e))
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def file_md5(file_name):
+    """
+    Return the hex MD5 digest of the contents of ``file_name`` or ``None`` if
+    the file cannot be read.
+    """
+    md5 = hashlib.md5()
+    try:
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), ''):
+                md5.update(block)
+    except IOError, e:
+        log.debug("Could not compute MD5 of file {0}: {1}".format(file_name, e))
+        return None
+    return md5.hexdigest()
+
+
 def meminfo():
     """
     Get node total memory and memory usage by parsing `/proc/meminfo`.
@@ -1242,6 +1479,28 @@ def size_to_bytes(size):
         return int(size)
 
 
+def mem_to_mb(mem):
+    """
+    Convert a memory request as reported by a job manager into an integer
+    number of megabytes. Values without a unit are assumed to be in megabytes
+    and unparsable values return ``0``.
+
+    >>> mem_to_mb('4000')
+    4000
+    >>> mem_to_mb('2G')
+    2048
+    """
+    multipliers = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 ** 2}
+    mem = str(mem).strip().upper()
+    unit = 'M'
+    if mem and mem[-1] in multipliers:
+        mem, unit = mem[:-1], mem[-1]
+    try:
+        return int(float(mem) * multipliers[unit])
+    except ValueError:
+        return 0
+
+
 def detect_symlinks(dir_path, link_name=None, symlink_as_file=True):
     """
     Recursively walk the given directory looking for symlinks. Return
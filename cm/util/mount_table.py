@@ -0,0 +1,158 @@
+"""
+An in-process view of the system mount table.
+
+Rather than spawning a ``cat /proc/mounts | grep ...`` pipeline for each check,
+storage services consult the shared ``mount_table`` instance, which parses
+``/proc/self/mountinfo`` and re-reads it only after the kernel reports a change
+to the mount table (via ``poll`` on the open file).
+"""
+import os
+import re
+import select
+import threading
+
+import logging
+log = logging.getLogger('cloudman')
+
+MOUNTINFO_FILE = '/proc/self/mountinfo'
+
+# Octal escapes used by the kernel for whitespace and backslashes in paths
+_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape(path):
+    return _ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def parse_mountinfo(lines):
+    """
+    Parse the lines of a ``mountinfo`` file (see ``man 5 proc``) and return a
+    dict keyed by the mount point. If multiple file systems are mounted on
+    the same mount point, the last one (i.e., the visible one) is kept.
+
+    Each value is a dict with the following keys: ``mount_point``, ``device``
+    (the mount source, e.g., ``/dev/xvdg`` or ``server:/export``), ``fs_type``,
+    ``root`` (the path within the source file system that is mounted),
+    ``dev_id`` (the ``major:minor`` string) and ``options`` (a list of the
+    per-mount and per-superblock options).
+    """
+    mounts = {}
+    for line in lines:
+        fields = line.split()
+        try:
+            # Optional fields are terminated by a single hyphen
+            sep = fields.index('-', 6)
+            mount_point = _unescape(fields[4])
+            options = fields[5].split(',')
+            options += [o for o in fields[sep + 3].split(',') if o not in options]
+            mounts[mount_point] = {
+                'mount_point': mount_point,
+                'device': _unescape(fields[sep + 2]),
+                'fs_type': fields[sep + 1],
+                'root': _unescape(fields[3]),
+                'dev_id': fields[2],
+                'options': options}
+        except (ValueError, IndexError):
+            log.debug("Skipping unparsable mountinfo line: {0}".format(line.strip()))
+    return mounts
+
+
+class MountTable(object):
+
+    """
+    A cached mount table. Lookups are answered from a dict; the table is
+    refreshed before a lookup only if the kernel has signalled a change since
+    the last read (where ``poll`` is not available, the file is re-read on
+    each lookup).
+    """
+
+    def __init__(self, mountinfo_file=MOUNTINFO_FILE):
+        self.mountinfo_file = mountinfo_file
+        self.mounts = {}
+        self.lock = threading.Lock()
+        self._file = None
+        self._poller = None
+
+    def _open(self):
+        self._file = open(self.mountinfo_file)
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._poller.register(self._file.fileno(), select.POLLERR | select.POLLPRI)
+
+    def _changed(self):
+        if self._file is None or self._poller is None:
+            return True
+        return len(self._poller.poll(0)) > 0
+
+    def refresh(self, force=False):
+        """
+        Re-read the mount table if it has changed since it was last read (or
+        unconditionally if ``force`` is set). Reading the file through the
+        same descriptor also re-arms the change notification.
+        """
+        with self.lock:
+            try:
+                if self._file is None:
+                    self._open()
+                elif not (force or self._changed()):
+                    return
+                self._file.seek(0)
+                self.mounts = parse_mountinfo(self._file.readlines())
+            except (IOError, OSError), e:
+                log.error("Trouble reading mount table {0}: {1}"
+                          .format(self.mountinfo_file, e))
+                self._file = None
+
+    def get(self, mount_point):
+        """
+        Return the mount table entry (see ``parse_mountinfo``) for the file
+        system mounted at ``mount_point`` or ``None`` if nothing is mounted
+        there.
+        """
+        self.refresh()
+        if mount_point and mount_point != '/':
+            mount_point = mount_point.rstrip('/')
+        return self.mounts.get(mount_point)
+
+    def is_mounted(self, mount_point):
+        """Check if a file system is mounted at ``mount_point``."""
+        return self.get(mount_point) is not None
+
+    def device(self, mount_point):
+        """
+        Return the device (mount source) of the file system mounted at
+        ``mount_point`` or ``None`` if nothing is mounted there.
+        """
+        entry = self.get(mount_point)
+        return entry['device'] if entry else None
+
+    def options(self, mount_point):
+        """
+        Return a list of mount options for the file system mounted at
+        ``mount_point`` or ``None`` if nothing is mounted there.
+        """
+        entry = self.get(mount_point)
+        return entry['options'] if entry else None
+
+    def mounted_devices(self):
+        """Return the set of devices (mount sources) currently mounted."""
+        self.refresh()
+        return set(entry['device'] for entry in self.mounts.values())
+
+    def get_containing(self, path):
+        """
+        Return the mount table entry for the file system that ``path``
+        resides on (i.e., the entry with the longest mount point that is a
+        prefix of ``path``).
+        """
+        self.refresh()
+        path = os.path.abspath(path)
+        while True:
+            entry = self.mounts.get(path)
+            if entry or path == '/':
+                return entry
+            path = os.path.dirname(path)
+
+
+# The mount table shared by all services in the process
+mount_table = MountTable()
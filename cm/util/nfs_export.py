@@ -1,22 +1,145 @@
 from cm.util.misc import run
 from cm.util.misc import flock
-import shlex
+from cm.util.misc import make_dir
+from cm.util.misc import Debouncer
+from cm.util.misc import write_file_atomically
+import multiprocessing
+import os
+import re
+import threading
 import logging
 log = logging.getLogger('cloudman')
 
+# Number of seconds over which export changes are coalesced before
+# being applied with ``exportfs``
+EXPORTS_RELOAD_DELAY = 2
+# Export options used unless a file system overrides them
+# NOTE: with Spot instances, should we use 'async' vs. 'sync' option?
+# See: http://linux.die.net/man/5/exports
+DEFAULT_EXPORT_OPTIONS = 'sync,no_root_squash,no_subtree_check'
+# Export options that override one another, besides ``X`` and ``no_X``
+EXPORT_OPTION_OPPOSITES = {'async': 'sync', 'insecure': 'secure'}
+# The number of NFS server threads is sized to the number of CPUs and worker
+# instances, within the given bounds
+NFSD_THREADS_PER_CPU = 8
+NFSD_THREADS_PER_WORKER = 4
+NFSD_MIN_THREADS = 8
+NFSD_MAX_THREADS = 256
+# Lines CloudMan used to write to ``/etc/exports`` itself
+LEGACY_EXPORT_LINE = re.compile(r'^\S+\t\*\((rw|ro),sync,no_root_squash,no_subtree_check\)$')
+
 
 class NFSExport:
 
+    """
+    NFS exports managed by CloudMan are kept as a desired-state set (the
+    ``exports`` dict, mapping a mount point to its permissions), which is
+    written to a CloudMan-owned file in ``/etc/exports.d`` whenever it
+    changes. Changes are applied with a (debounced) ``exportfs -ra``, which
+    leaves existing client state alone; the NFS server is restarted only if
+    it is found not to be running.
+
+    Earlier versions of CloudMan wrote their exports to ``/etc/exports``
+    directly; those lines are removed from there when the exports are first
+    written (see ``_remove_legacy_exports``).
+    """
+
     nfs_lock_file = '/tmp/nfs.lockfile'
-    nfs_dirty = False
-    ee_file = '/etc/exports'
+    ee_file = '/etc/exports.d/cloudman.exports'
+    legacy_ee_file = '/etc/exports'
+    legacy_exports_removed = False
+    nfsd_threads_file = '/proc/fs/nfsd/threads'
+    nfsd_defaults_file = '/etc/default/nfs-kernel-server'
+    nfsd_stats_file = '/proc/net/rpc/nfsd'
+    nfsd_pool_stats_file = '/proc/fs/nfsd/pool_stats'
+    nfsd_threads = None  # The number of NFS server threads last set
+    exports = {}  # mount point -> (permissions, export options)
+    exports_lock = threading.Lock()
+
+    @staticmethod
+    def _compose_exports():
+        """
+        Compose the contents of the exports file from the desired state.
+        """
+        lines = ["# This file is managed by CloudMan; do not edit."]
+        for mount_point in sorted(NFSExport.exports):
+            perms, options = NFSExport.exports[mount_point]
+            lines.append("{mp}\t*({perms},{options})"
+                         .format(mp=mount_point, perms=perms, options=options))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_exports():
+        """
+        Atomically write out the exports file and schedule the exports
+        to be re-read by the NFS server. Must be called with
+        ``exports_lock`` held.
+        """
+        make_dir(os.path.dirname(NFSExport.ee_file))
+        with flock(NFSExport.nfs_lock_file):
+            if not NFSExport.legacy_exports_removed:
+                NFSExport.legacy_exports_removed = NFSExport._remove_legacy_exports()
+            if not write_file_atomically(NFSExport.ee_file, NFSExport._compose_exports()):
+                return False
+        NFSExport.reload.trigger()
+        return True
+
+    @staticmethod
+    def _remove_legacy_exports():
+        """
+        Remove the lines written by earlier versions of CloudMan from
+        ``legacy_ee_file``, leaving any other lines alone. Otherwise, paths
+        would keep being exported from there, including ones no longer
+        shared. Must be called with ``nfs_lock_file`` held. Return ``True``
+        if there is nothing left to remove.
+        """
+        try:
+            with open(NFSExport.legacy_ee_file) as f:
+                lines = f.readlines()
+        except IOError:
+            return True  # Nothing to remove
+        kept = [l for l in lines if not LEGACY_EXPORT_LINE.match(l.rstrip('\n'))]
+        if len(kept) == len(lines):
+            return True
+        log.info("Removing {0} CloudMan export(s) from {1}; they are now kept in {2}".format(
+            len(lines) - len(kept), NFSExport.legacy_ee_file, NFSExport.ee_file))
+        return write_file_atomically(NFSExport.legacy_ee_file, ''.join(kept))
+
+    @staticmethod
+    def _export_option_name(option):
+        """
+        Return the name of export ``option`` shared with the options it
+        overrides (e.g., ``sync`` for ``async``, ``wdelay`` for ``no_wdelay``).
+        """
+        name = option.split('=', 1)[0]
+        if name.startswith('no_'):
+            name = name[3:]
+        return EXPORT_OPTION_OPPOSITES.get(name, name)
 
     @staticmethod
-    def add_nfs_share(mount_point, permissions='rw'):
+    def merge_export_options(options):
+        """
+        Merge export ``options`` (a list of options) over
+        ``DEFAULT_EXPORT_OPTIONS`` and return the resulting options as a
+        string. An option replaces the default it overrides (e.g., ``async``
+        replaces ``sync``); other options are added to the defaults.
+        """
+        merged = DEFAULT_EXPORT_OPTIONS.split(',')
+        for option in options:
+            name = NFSExport._export_option_name(option)
+            names = [NFSExport._export_option_name(o) for o in merged]
+            if name in names:
+                merged[names.index(name)] = option
+            else:
+                merged.append(option)
+        return ','.join(merged)
+
+    @staticmethod
+    def add_nfs_share(mount_point, permissions='rw', options=None):
         """
         Share the given/current file system/mount point over NFS. Note that
-        if the given mount point already exists in /etc/exports, replace
-        the existing line with the line composed within this method.
+        if the given mount point is already shared, its permissions and
+        options are replaced with the given ones (if different).
 
         :type mount_point: string
         :param mount_point: The mount point to add to the NFS share
@@ -25,38 +148,29 @@ class NFSExport:
         :param permissions: Choose the type of permissions for the hosts
                             mounting this NFS mount point. Use: 'rw' for
                             read-write (default) or 'ro' for read-only
+
+        :type options: string or list
+        :param options: Export options (e.g., ``async,no_wdelay``) to merge
+                        over ``DEFAULT_EXPORT_OPTIONS``
+                        (see ``merge_export_options``)
         """
         log.debug("Will attempt to share mount point {0} over NFS.".format(mount_point))
         try:
             if not mount_point:
                 raise Exception("add_nfs_share: No mount point provided")
-            # Compose the line that will be put into /etc/exports
-            # NOTE: with Spot instances, should we use 'async' vs. 'sync' option?
-            # See: http://linux.die.net/man/5/exports
-            ee_line = "{mp}\t*({perms},sync,no_root_squash,no_subtree_check)\n"\
-                .format(mp=mount_point, perms=permissions)
-            # Make sure we manipulate ee_file by a single process at a time
-            with flock(NFSExport.nfs_lock_file):
-                # Determine if the given mount point is already shared
-                with open(NFSExport.ee_file) as f:
-                    shared_paths = f.readlines()
-
-                mp_line_no = NFSExport.find_mount_point_entry(mount_point)
-                # If the mount point is already in /etc/exports, replace the existing
-                # entry with the newly composed ee_line (thus supporting change of
-                # permissions). Otherwise, append ee_line to the end of the
-                # file.
-                if mp_line_no > -1:
-                    shared_paths[mp_line_no] = ee_line
-                else:
-                    shared_paths.append(ee_line)
-                # Write out the newly composed file
-                with open(NFSExport.ee_file, 'w') as f:
-                    f.writelines(shared_paths)
-                log.debug("Added '{0}' line to NFS file {1}".format(
-                    ee_line.strip(), NFSExport.ee_file))
-            # Mark the NFS server as being in need of a restart
-            NFSExport.nfs_dirty = True
+            if isinstance(options, basestring):
+                options = options.split(',')
+            export = (permissions, NFSExport.merge_export_options(
+                [o.strip() for o in options or [] if o.strip()]))
+            with NFSExport.exports_lock:
+                if NFSExport.exports.get(mount_point) == export:
+                    log.debug("Mount point {0} is already shared over NFS".format(mount_point))
+                    return True
+                NFSExport.exports[mount_point] = export
+                if not NFSExport._write_exports():
+                    return False
+            log.debug("Added NFS share {0} ({1},{2}) to {3}".format(
+                mount_point, export[0], export[1], NFSExport.ee_file))
             return True
         except Exception, e:
             log.error(
@@ -68,21 +182,16 @@ class NFSExport:
         """
         Remove the given/current file system/mount point from being shared
         over NFS. The method removes the file system's ``mount_point`` from
-        ``/etc/share`` and indicates that the NFS server needs restarting.
+        the exports file and schedules the exports to be re-read.
         """
         try:
             if not mount_point:
                 raise Exception("remove_nfs_share: No mount point provided")
-            mount_point = mount_point.replace(
-                '/', '\/')  # Escape slashes for sed
-            cmd = "sed -i '/^{0}/d' {1}".format(mount_point, NFSExport.ee_file)
-            log.debug("Removing NSF share for mount point {0}; cmd: {1}".format(
-                mount_point, cmd))
-            # To avoid race conditions between threads, use a lock file
-            with flock(NFSExport.nfs_lock_file):
-                run(cmd)
-            NFSExport.nfs_dirty = True
-            return True
+            log.debug("Removing NSF share for mount point {0}".format(mount_point))
+            with NFSExport.exports_lock:
+                if NFSExport.exports.pop(mount_point, None) is None:
+                    return True
+                return NFSExport._write_exports()
         except Exception, e:
             log.error("Error removing FS {0} share from NFS: {1}".format(
                 mount_point, e))
@@ -91,27 +200,139 @@ class NFSExport:
     @staticmethod
     def find_mount_point_entry(mount_point):
         """
-        Returns the line no of a given mount point if it's present in /etc/exports
-        or -1 otherwise.
+        Returns the line no of a given mount point among the NFS shares
+        managed by CloudMan or -1 otherwise.
         """
-        with open(NFSExport.ee_file) as f:
-            shared_paths = f.readlines()
-            for i, sp in enumerate(shared_paths):
-                tokens = shlex.split(sp)
-                if tokens and mount_point == tokens[0]:
-                    return i
+        with NFSExport.exports_lock:
+            mount_points = sorted(NFSExport.exports)
+        if mount_point in mount_points:
+            return mount_points.index(mount_point)
         return -1
 
+    @staticmethod
+    def apply_nfs_exports():
+        """
+        Have the NFS server re-read the exports without restarting it.
+        """
+        with flock(NFSExport.nfs_lock_file):
+            return run("/usr/sbin/exportfs -ra", "Error reloading NFS exports",
+                       "Successfully reloaded NFS exports")
+
+    @staticmethod
+    def nfs_server_running():
+        """
+        Check if the NFS server is running, by inspecting the number of
+        ``nfsd`` threads.
+        """
+        try:
+            with open(NFSExport.nfsd_threads_file) as f:
+                return int(f.read().strip() or 0) > 0
+        except (IOError, ValueError):
+            return False
+
     @staticmethod
     def reload_nfs_exports(force=False):
         """
-        Reloads NFS exports if required (dirty flag is set).
+        Make sure the NFS server is running if there is anything to export,
+        restarting it if it is not. Changes to the exports are applied as
+        they are made so there is nothing else to do here unless ``force``
+        is set, in which case any pending changes are applied immediately.
 
         :type force: bool
-        :param force: Force reload, even if dirty flag is not set. Default is False.
+        :param force: Apply the exports now, even if no change is pending.
+                      Default is False.
         """
-        if NFSExport.nfs_dirty or force:
+        if NFSExport.exports and not NFSExport.nfs_server_running():
             with flock(NFSExport.nfs_lock_file):
-                if run("/etc/init.d/nfs-kernel-server restart", "Error restarting NFS server",
-                        "Successfully restarted NFS server"):
-                    NFSExport.nfs_dirty = False
\ No newline at end of file
+                run("/etc/init.d/nfs-kernel-server restart", "Error restarting NFS server",
+                    "Successfully restarted NFS server")
+        elif force:
+            NFSExport.reload.flush()
+
+    @staticmethod
+    def nfsd_thread_count(num_workers, num_cpus=None):
+        """
+        Return the number of NFS server threads suitable for serving
+        ``num_workers`` worker instances from a machine with ``num_cpus``
+        CPUs (by default, the number of CPUs on this machine).
+        """
+        if num_cpus is None:
+            num_cpus = multiprocessing.cpu_count()
+        threads = max(num_cpus * NFSD_THREADS_PER_CPU, num_workers * NFSD_THREADS_PER_WORKER)
+        return min(max(threads, NFSD_MIN_THREADS), NFSD_MAX_THREADS)
+
+    @staticmethod
+    def tune_nfsd_threads(num_workers):
+        """
+        Size the NFS server thread pool for ``num_workers`` worker instances.
+        The running server is adjusted in place (via ``nfsd_threads_file``)
+        and the count is recorded as ``RPCNFSDCOUNT`` in ``nfsd_defaults_file``
+        so it is kept across server restarts. Nothing is done if the count
+        has not changed since the last call.
+        """
+        threads = NFSExport.nfsd_thread_count(num_workers)
+        if threads == NFSExport.nfsd_threads:
+            return True
+        log.info("Setting the number of NFS server threads to {0} (for {1} workers)"
+                 .format(threads, num_workers))
+        try:
+            if os.path.exists(NFSExport.nfsd_defaults_file):
+                with open(NFSExport.nfsd_defaults_file) as f:
+                    contents = f.read()
+                line = 'RPCNFSDCOUNT={0}'.format(threads)
+                if re.search(r'^RPCNFSDCOUNT=', contents, re.M):
+                    contents = re.sub(r'^RPCNFSDCOUNT=.*$', line, contents, flags=re.M)
+                else:
+                    contents += line + '\n'
+                if not write_file_atomically(NFSExport.nfsd_defaults_file, contents):
+                    return False
+            if NFSExport.nfs_server_running():
+                with open(NFSExport.nfsd_threads_file, 'w') as f:
+                    f.write('{0}\n'.format(threads))
+        except (IOError, OSError), e:
+            log.error("Error setting the number of NFS server threads: {0}".format(e))
+            return False
+        NFSExport.nfsd_threads = threads
+        return True
+
+    @staticmethod
+    def get_nfsd_stats():
+        """
+        Return NFS server statistics from ``nfsd_stats_file`` and
+        ``nfsd_pool_stats_file`` as a dict with the following keys:
+        ``threads`` (the number of server threads), ``sockets_enqueued`` (the
+        number of times a request had to wait because all the threads were
+        busy, i.e., the pool was saturated), ``threads_timedout`` (the number
+        of times a thread sat idle long enough to time out, i.e., the pool had
+        spare threads), ``calls`` (the number of RPC calls), ``bad_calls``
+        (the number of rejected calls) and ``retransmits`` (the number of
+        retransmitted requests answered from the reply cache). The pool
+        counters are summed over all the thread pools. Return ``None`` if the
+        statistics are not available (e.g., the NFS server is not running).
+
+        .. note::
+            The "all threads busy" counter of the ``th`` line in
+            ``nfsd_stats_file`` is no longer maintained by the kernel (it is
+            always ``0``) so the pool statistics are used instead.
+        """
+        try:
+            with open(NFSExport.nfsd_stats_file) as f:
+                lines = dict((l.split()[0], l.split()[1:]) for l in f if l.strip())
+            with open(NFSExport.nfsd_pool_stats_file) as f:
+                rows = [l.split() for l in f if l.strip()]
+            # The first line names the columns, e.g.: # pool packets-arrived
+            # sockets-enqueued threads-woken threads-timedout
+            columns = rows[0][1:]
+            pools = [dict(zip(columns, row)) for row in rows[1:]]
+            return {'threads': int(lines['th'][0]),
+                    'sockets_enqueued': sum(int(p['sockets-enqueued']) for p in pools),
+                    'threads_timedout': sum(int(p['threads-timedout']) for p in pools),
+                    'calls': int(lines['rpc'][0]),
+                    'bad_calls': int(lines['rpc'][1]),
+                    'retransmits': int(lines['rc'][0])}
+        except (IOError, KeyError, IndexError, ValueError), e:
+            log.debug("NFS server statistics not available: {0}".format(e))
+            return None
+
+
+NFSExport.reload = Debouncer(NFSExport.apply_nfs_exports, EXPORTS_RELOAD_DELAY)
@@ -59,6 +59,9 @@ P_ETC_TRANSIENT_PATH = "/mnt/transient_nfs/hosts"
 
 # # Condor
 P_HTCONDOR_CONFIG_PATH = "/etc/condor/condor_config"
+# Config fragment with the values managed by CloudMan at runtime (read via
+# HTCondor's LOCAL_CONFIG_DIR)
+P_HTCONDOR_MANAGED_CONFIG_PATH = "/etc/condor/config.d/99_cloudman_managed"
 P_HTCONDOR_HOME = "/etc/init.d"
 
 try:
@@ -116,6 +119,9 @@ P_GALAXY_DATA = get_path(
     "galaxy_data", os.path.join(P_MOUNT_ROOT, 'galaxy'))
 P_GALAXY_INDICES = get_path(
     "galaxy_indices", os.path.join(P_MOUNT_ROOT, "galaxyIndices"))
+# Worker-local caches of file systems shared by the master
+P_FSCACHE_DIR = os.path.join(P_MOUNT_ROOT, "fscache")
+P_LOCAL_COPIES_DIR = os.path.join(P_MOUNT_ROOT, "local_copies")
 
 IMAGE_CONF_SUPPORT_FILE = os.path.join(P_BASE_INSTALL_DIR, 'imageConfig.yaml')
 
@@ -278,6 +284,14 @@ class PathResolver(object):
         possible_paths = ['/usr/sbin', '/usr/nginx/sbin', '/opt/galaxy/pkg/nginx/sbin']
         return misc.which('nginx', possible_paths)
 
+    @property
+    def condor_reconfig(self):
+        """
+        Get the path of HTCondor's ``condor_reconfig`` executable
+        """
+        possible_paths = ['/usr/sbin', '/usr/bin', '/usr/local/condor/sbin']
+        return misc.which('condor_reconfig', possible_paths)
+
     @property
     def nginx_conf_dir(self):
         """
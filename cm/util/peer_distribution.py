@@ -0,0 +1,649 @@
+"""
+Peer-assisted distribution of large read-only datasets to worker instances.
+
+A dataset (a directory tree) is split into fixed-size chunks of the
+concatenation of its files, taken in sorted order, and described by a
+manifest listing the files and a SHA1 sum of each chunk. The master seeds the
+dataset and runs a tracker recording which peers have which chunks. Workers
+fetch chunks from any peer that has them (the master or another worker),
+rarest chunks first, and serve the chunks they already have to the other
+workers. As each peer serves only a few chunks at a time, workers that arrive
+later fetch most chunks from the ones that came before rather than from the
+master; the number of copies of each chunk keeps doubling so the time to
+distribute a dataset to N workers grows with log(N) rather than N.
+
+Chunks and the tracker are served over HTTP by ``PeerServer`` (the tracker
+only on the master); workers learn about datasets to fetch from the master's
+``MOUNT`` message.
+"""
+import BaseHTTPServer
+import bisect
+import hashlib
+import json
+import os
+import random
+import SocketServer
+import threading
+import time
+
+import requests
+
+from cm.util.misc import make_dir
+
+import logging
+log = logging.getLogger('cloudman')
+
+DEFAULT_PEER_PORT = 42290
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+# Number of chunks a peer serves at a time; further requests are turned away
+# so they go to other peers
+DEFAULT_MAX_UPLOADS = 4
+# Number of chunks a peer fetches at a time
+DEFAULT_MAX_DOWNLOADS = 4
+# Number of seconds to keep waiting for a dataset's manifest to be ready
+MANIFEST_TIMEOUT = 3600
+# Minimum number of seconds between announcements while waiting for peers
+ANNOUNCE_INTERVAL = 1
+# Number of seconds to leave a busy or failed peer alone
+BUSY_PEER_DELAY = 0.2
+FAILED_PEER_DELAY = 30
+PEER_TIMEOUT = 60
+# Number of seconds between announcements of a fetched dataset that is
+# being served, to keep the peer from timing out at the tracker
+HEARTBEAT_INTERVAL = PEER_TIMEOUT / 3
+# Give up fetching a dataset after failing to fetch the same chunk this many
+# times or if no chunk could be fetched for this many seconds
+MAX_CHUNK_FAILURES = 5
+STALL_TIMEOUT = 600
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def encode_ranges(chunks):
+    """
+    Encode a collection of chunk numbers as a compact string of ranges
+    (e.g., ``[0, 1, 2, 5]`` as ``0-2,5``).
+    """
+    ranges = []
+    for c in sorted(chunks):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ','.join(str(a) if a == b else '{0}-{1}'.format(a, b) for a, b in ranges)
+
+
+def decode_ranges(ranges):
+    """Decode a string composed by ``encode_ranges`` into a set of chunk numbers."""
+    chunks = set()
+    for r in ranges.split(','):
+        if '-' in r:
+            a, b = r.split('-')
+            chunks.update(range(int(a), int(b) + 1))
+        elif r:
+            chunks.add(int(r))
+    return chunks
+
+
+def build_manifest(root, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compose the manifest of the dataset in directory ``root``: a dict with
+    the dataset's directories (``dirs``), symbolic links (``links``, as
+    ``[path, target]``), regular files (``files``, as ``[path, size, mode]``),
+    its total ``size``, the ``chunk_size`` and the SHA1 sum of each chunk
+    (``chunks``). All paths are relative to ``root``.
+    """
+    dirs, links, files = [], [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, root)
+        for name in dirnames + sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+            if os.path.islink(path):
+                links.append([rel_path, os.readlink(path)])
+            elif os.path.isdir(path):
+                dirs.append(rel_path)
+            elif os.path.isfile(path):
+                st = os.stat(path)
+                files.append([rel_path, st.st_size, st.st_mode & 0777])
+    chunks = []
+    h, filled = hashlib.sha1(), 0
+    for rel_path, _, _ in files:
+        with open(os.path.join(root, rel_path), 'rb') as f:
+            while True:
+                buf = f.read(min(chunk_size - filled, READ_BUFFER_SIZE))
+                if not buf:
+                    break
+                h.update(buf)
+                filled += len(buf)
+                if filled == chunk_size:
+                    chunks.append(h.hexdigest())
+                    h, filled = hashlib.sha1(), 0
+    if filled:
+        chunks.append(h.hexdigest())
+    return {'dirs': dirs, 'links': links, 'files': files, 'chunk_size': chunk_size,
+            'size': sum(f[1] for f in files), 'chunks': chunks}
+
+
+class Dataset(object):
+
+    def __init__(self, root, manifest, complete=False):
+        """
+        :type root: string
+        :param root: The directory holding (or to hold) the dataset
+
+        :type manifest: dict
+        :param manifest: The dataset's manifest (see ``build_manifest``)
+
+        :type complete: bool
+        :param complete: Whether ``root`` already holds all of the dataset
+        """
+        self.root = root
+        self.manifest = manifest
+        self.chunk_size = manifest['chunk_size']
+        self.num_chunks = len(manifest['chunks'])
+        self.have = set(range(self.num_chunks)) if complete else set()
+        self.lock = threading.Lock()
+        self._offsets = []  # The offset of each file in the dataset
+        offset = 0
+        for _, size, _ in manifest['files']:
+            self._offsets.append(offset)
+            offset += size
+
+    def prepare(self):
+        """
+        Create the dataset's directories, links and (empty, full-size)
+        files under ``root`` for the chunks to be written into.
+        """
+        make_dir(self.root)
+        for rel_path in self.manifest['dirs']:
+            make_dir(os.path.join(self.root, rel_path))
+        for rel_path, target in self.manifest['links']:
+            path = os.path.join(self.root, rel_path)
+            if os.path.lexists(path):
+                os.remove(path)
+            os.symlink(target, path)
+        for rel_path, size, mode in self.manifest['files']:
+            path = os.path.join(self.root, rel_path)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+            os.chmod(path, mode)
+
+    def _segments(self, index):
+        """
+        Return the parts of files making up chunk ``index``, as a list of
+        (path, offset in the file, length) tuples.
+        """
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.manifest['size'])
+        segments = []
+        i = bisect.bisect_right(self._offsets, start) - 1
+        while start < end:
+            rel_path, size, _ = self.manifest['files'][i]
+            n = min(end, self._offsets[i] + size) - start
+            if n > 0:
+                segments.append((os.path.join(self.root, rel_path), start - self._offsets[i], n))
+                start += n
+            i += 1
+        return segments
+
+    def read_chunk(self, index):
+        """Return the contents of chunk ``index``."""
+        data = []
+        for path, offset, length in self._segments(index):
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data.append(f.read(length))
+        return ''.join(data)
+
+    def write_chunk(self, index, data):
+        """
+        Write ``data`` as chunk ``index`` if it matches the chunk's SHA1 sum.
+        Return ``True`` if the chunk was written, ``False`` otherwise.
+        """
+        if hashlib.sha1(data).hexdigest() != self.manifest['chunks'][index]:
+            return False
+        pos = 0
+        for path, offset, length in self._segments(index):
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                f.write(data[pos:pos + length])
+            pos += length
+        with self.lock:
+            self.have.add(index)
+        return True
+
+
+class PeerTracker(object):
+
+    """
+    Keep track of the peers that have (parts of) each dataset. A peer that
+    has not announced itself in ``PEER_TIMEOUT`` seconds is forgotten, except
+    for the seed.
+    """
+
+    def __init__(self):
+        self.datasets = {}  # name -> {'manifest', 'seed', 'peers': {peer: (chunks, time)}}
+        self.lock = threading.Lock()
+
+    def add_dataset(self, name, manifest, seed):
+        """Start tracking dataset ``name``, of which ``seed`` has all the chunks."""
+        with self.lock:
+            self.datasets[name] = {
+                'manifest': manifest, 'seed': seed,
+                'peers': {seed: (set(range(len(manifest['chunks']))), None)}}
+
+    def get_manifest(self, name):
+        """Return the manifest of dataset ``name`` or ``None`` if not tracked."""
+        with self.lock:
+            return self.datasets.get(name, {}).get('manifest')
+
+    def announce(self, name, peer, chunks):
+        """
+        Record that ``peer`` has ``chunks`` of dataset ``name``. Return a
+        dict mapping each of the (other) live peers to the chunks it has, or
+        ``None`` if the dataset is not tracked.
+        """
+        now = time.time()
+        with self.lock:
+            if name not in self.datasets:
+                return None
+            ds = self.datasets[name]
+            if peer and peer != ds['seed']:
+                # Announcements may arrive out of order but a peer's chunks
+                # only ever accumulate
+                ds['peers'][peer] = (ds['peers'].get(peer, (set(), None))[0] | set(chunks), now)
+            for p, (_, seen) in ds['peers'].items():
+                if seen is not None and now - seen > PEER_TIMEOUT:
+                    del ds['peers'][p]
+            return dict((p, c) for p, (c, _) in ds['peers'].iteritems() if p != peer)
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _PeerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, body='', content_type='application/octet-stream'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.server.peer.send(self.wfile, body)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        peer = self.server.peer
+        if len(parts) == 3 and parts[0] == 'chunk':
+            code, body = peer.serve_chunk(parts[1], int(parts[2]))
+            self._reply(code, body)
+        elif len(parts) == 2 and parts[0] == 'manifest' and peer.tracker:
+            manifest = peer.tracker.get_manifest(parts[1])
+            if manifest is None:
+                self._reply(404)
+            else:
+                self._reply(200, json.dumps(manifest), 'application/json')
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        peer = self.server.peer
+        if len(parts) == 2 and parts[0] == 'announce' and peer.tracker:
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                peers = peer.tracker.announce(parts[1], body['peer'],
+                                              decode_ranges(body['chunks']))
+            except (ValueError, KeyError):
+                return self._reply(400)
+            if peers is None:
+                return self._reply(404)
+            self._reply(200, json.dumps(dict((p, encode_ranges(c))
+                                             for p, c in peers.iteritems())),
+                        'application/json')
+        else:
+            self._reply(404)
+
+
+class PeerServer(object):
+
+    def __init__(self, port=DEFAULT_PEER_PORT, host='', tracker=None,
+                 max_uploads=DEFAULT_MAX_UPLOADS, max_rate=0):
+        """
+        Serve the chunks of the datasets added with ``add_dataset`` (and,
+        if ``tracker`` is provided, the tracker) over HTTP on ``port``
+        (``0`` picks a free port; see ``self.port``).
+
+        :type tracker: PeerTracker
+        :param tracker: The tracker to serve, on the seeding peer
+
+        :type max_uploads: int
+        :param max_uploads: The number of chunks to serve at a time
+
+        :type max_rate: int
+        :param max_rate: Maximum rate to send the chunks at, in bytes per
+                         second (``0`` for no limit)
+        """
+        self.datasets = {}
+        self.tracker = tracker
+        self.max_uploads = max_uploads
+        self.max_rate = max_rate
+        self.uploads = 0
+        self.bytes_sent = 0
+        self.running = False
+        self.lock = threading.Lock()
+        self._send_time = 0
+        self.httpd = _ThreadingHTTPServer((host, port), _PeerRequestHandler)
+        self.httpd.peer = self
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        t = threading.Thread(target=self.httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        self.running = True
+        log.debug("Serving dataset chunks on port {0}".format(self.port))
+
+    def stop(self):
+        self.running = False
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add_dataset(self, name, dataset):
+        """Serve the chunks ``dataset`` has, under ``name``."""
+        with self.lock:
+            self.datasets[name] = dataset
+
+    def serve_chunk(self, name, index):
+        """
+        Return the HTTP status code and contents for a request for chunk
+        ``index`` of dataset ``name``.
+        """
+        dataset = self.datasets.get(name)
+        if not dataset or index not in dataset.have:
+            return 404, ''
+        with self.lock:
+            if self.uploads >= self.max_uploads:
+                return 503, ''
+            self.uploads += 1
+        try:
+            return 200, dataset.read_chunk(index)
+        except IOError, e:
+            log.error("Error reading chunk {0} of dataset {1}: {2}".format(index, name, e))
+            with self.lock:
+                self.uploads -= 1
+            return 500, ''
+
+    def send(self, out, data):
+        """Write ``data`` to ``out`` within ``max_rate``, ending an upload."""
+        try:
+            for pos in range(0, len(data), READ_BUFFER_SIZE):
+                buf = data[pos:pos + READ_BUFFER_SIZE]
+                if self.max_rate:
+                    with self.lock:
+                        self._send_time = max(self._send_time, time.time()) + \
+                            float(len(buf)) / self.max_rate
+                        delay = self._send_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                out.write(buf)
+                with self.lock:
+                    self.bytes_sent += len(buf)
+        finally:
+            with self.lock:
+                self.uploads = max(self.uploads - 1, 0)
+
+
+class PeerFetcher(threading.Thread):
+
+    """
+    Fetch dataset `name` into directory `root` from the peers known to the
+    tracker at `tracker_url`, rarest chunks first, with up to `max_downloads`
+    concurrent downloads. If `server` is provided, the fetched chunks are
+    served to other peers from it as they arrive, with the peer announced as
+    `address` (``host:port``); once the whole dataset is fetched, it keeps
+    being announced in the background for as long as `server` is serving it.
+    Fetching fails if the same chunk cannot be fetched `MAX_CHUNK_FAILURES`
+    times or no chunk can be fetched for `STALL_TIMEOUT` seconds. The
+    progress is available in `status`
+    (``pending``, ``running``, ``completed``, ``stopped`` or ``failed``) and
+    `progress` (a percentage). After the thread finishes execution,
+    `callback` method will be called, regardless of the outcome.
+    """
+
+    def __init__(self, tracker_url, name, root, server=None, address=None,
+                 max_downloads=DEFAULT_MAX_DOWNLOADS, callback=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tracker_url = tracker_url.rstrip('/')
+        self.name = name
+        self.root = root
+        self.server = server
+        self.address = address
+        self.max_downloads = max_downloads
+        self.callback = callback
+        self.status = 'pending'
+        self.dataset = None
+        self.lock = threading.Lock()
+        self.holders = {}  # chunk -> peers that have it
+        self.in_flight = set()
+        self.fetching_from = set()  # Peers a chunk is being fetched from
+        self.skip_until = {}  # peer -> time to leave it alone until
+        self.chunks_from = {}  # peer -> number of chunks fetched from it
+        self.chunk_failures = {}  # chunk -> number of failed attempts to fetch it
+        self._last_announce = 0
+        self._last_fetch = 0
+        self._stopped = False
+        self._failed = False
+
+    @property
+    def progress(self):
+        """Percentage of the dataset's chunks that have been fetched."""
+        if not self.dataset or not self.dataset.num_chunks:
+            return 100 if self.status == 'completed' else 0
+        return int(100 * len(self.dataset.have) / self.dataset.num_chunks)
+
+    def stop(self):
+        """Stop fetching the dataset."""
+        self._stopped = True
+
+    def _get_manifest(self):
+        url = '{0}/manifest/{1}'.format(self.tracker_url, self.name)
+        end_time = time.time() + MANIFEST_TIMEOUT
+        while not self._stopped and time.time() < end_time:
+            try:
+                r = requests.get(url, timeout=60)
+                if r.ok:
+                    return r.json()
+                log.debug("Manifest for dataset {0} not ready ({1})".format(
+                    self.name, r.status_code))
+            except (requests.exceptions.RequestException, ValueError), e:
+                log.debug("Error retrieving manifest for dataset {0}: {1}".format(self.name, e))
+            time.sleep(5)
+        return None
+
+    def _announce(self):
+        """
+        Tell the tracker which chunks this peer has and update the known
+        holders of each chunk from its reply.
+        """
+        self._last_announce = time.time()
+        with self.dataset.lock:
+            chunks = encode_ranges(self.dataset.have) if self.server else ''
+        try:
+            r = requests.post('{0}/announce/{1}'.format(self.tracker_url, self.name),
+                              data=json.dumps({'peer': self.address, 'chunks': chunks}),
+                              timeout=60)
+            r.raise_for_status()
+            peers = r.json()
+        except (requests.exceptions.RequestException, ValueError), e:
+            log.debug("Error announcing to tracker {0}: {1}".format(self.tracker_url, e))
+            return False
+        holders = {}
+        for peer, ranges in peers.iteritems():
+            for c in decode_ranges(ranges):
+                holders.setdefault(c, []).append(peer)
+        with self.lock:
+            self.holders = holders
+        return True
+
+    def _next_chunk(self):
+        """
+        Pick the next chunk to fetch and a peer to fetch it from: one of the
+        chunks with the fewest holders, among those with a holder available
+        (i.e., one not busy and not already being fetched from), and a random
+        one of its available holders. Fetching at most one chunk from a peer
+        at a time spreads the downloads over the peers rather than having
+        them all go to the seed, which has the rarest chunks. Return
+        ``(None, None)`` if there is nothing left to fetch or ``(None, True)``
+        if no holder is available right now.
+        """
+        now = time.time()
+        with self.lock:
+            left, best, best_count = False, [], None
+            for c in xrange(self.dataset.num_chunks):
+                if c in self.dataset.have or c in self.in_flight:
+                    continue
+                left = True
+                holders = self.holders.get(c, [])
+                if best_count is not None and len(holders) > best_count:
+                    continue
+                peers = [p for p in holders if p not in self.fetching_from and
+                         self.skip_until.get(p, 0) <= now]
+                if not peers:
+                    continue
+                if len(holders) != best_count:
+                    best, best_count = [], len(holders)
+                best.append((c, peers))
+            if not best:
+                return None, (True if left else None)
+            index, peers = random.choice(best)
+            peer = random.choice(peers)
+            self.in_flight.add(index)
+            self.fetching_from.add(peer)
+            return index, peer
+
+    def _chunk_failed(self, index):
+        """
+        Record a failed attempt to fetch chunk ``index``, giving up on the
+        dataset after ``MAX_CHUNK_FAILURES`` of them. Must be called with
+        ``self.lock`` held.
+        """
+        self.chunk_failures[index] = self.chunk_failures.get(index, 0) + 1
+        if self.chunk_failures[index] >= MAX_CHUNK_FAILURES and not self._failed:
+            log.error("Failed to fetch chunk {0} of dataset {1} {2} times; giving up".format(
+                index, self.name, self.chunk_failures[index]))
+            self._failed = True
+
+    def _download(self):
+        while not self._stopped and not self._failed:
+            index, peer = self._next_chunk()
+            if index is None:
+                if peer is None:
+                    return
+                if time.time() - self._last_fetch > STALL_TIMEOUT:
+                    with self.lock:
+                        if not self._failed:
+                            log.error("No chunk of dataset {0} could be fetched in {1} "
+                                      "seconds; giving up".format(self.name, STALL_TIMEOUT))
+                        self._failed = True
+                    return
+                time.sleep(BUSY_PEER_DELAY)
+                if time.time() - self._last_announce > ANNOUNCE_INTERVAL:
+                    self._announce()
+                continue
+            ok = False
+            try:
+                r = requests.get('http://{0}/chunk/{1}/{2}'.format(peer, self.name, index),
+                                 timeout=300)
+                if r.status_code == 503:
+                    with self.lock:
+                        self.skip_until[peer] = time.time() + BUSY_PEER_DELAY
+                elif r.ok and self.dataset.write_chunk(index, r.content):
+                    ok = True
+                else:
+                    log.debug("Bad chunk {0} of dataset {1} from peer {2} ({3})".format(
+                        index, self.name, peer, r.status_code))
+                    with self.lock:
+                        self.skip_until[peer] = time.time() + FAILED_PEER_DELAY
+                        self._chunk_failed(index)
+            except (requests.exceptions.RequestException, IOError), e:
+                log.debug("Error fetching chunk {0} of dataset {1} from peer {2}: {3}"
+                          .format(index, self.name, peer, e))
+                with self.lock:
+                    self.skip_until[peer] = time.time() + FAILED_PEER_DELAY
+                    self._chunk_failed(index)
+            with self.lock:
+                self.in_flight.discard(index)
+                self.fetching_from.discard(peer)
+                if ok:
+                    self.chunks_from[peer] = self.chunks_from.get(peer, 0) + 1
+                    self._last_fetch = time.time()
+            if ok:
+                self._announce()
+
+    def _heartbeat(self):
+        """
+        Keep announcing the (fetched) dataset to the tracker for as long as
+        ``self.server`` is serving it.
+        """
+        while not self._stopped:
+            time.sleep(HEARTBEAT_INTERVAL)
+            if not self.server.running or self.server.datasets.get(self.name) is not self.dataset:
+                return
+            self._announce()
+
+    def run(self):
+        manifest = self._get_manifest()
+        if manifest is None:
+            log.error("Could not get manifest for dataset {0} from {1}".format(
+                self.name, self.tracker_url))
+            self.status = 'failed'
+        else:
+            try:
+                self.dataset = Dataset(self.root, manifest)
+                self.dataset.prepare()
+            except (IOError, OSError), e:
+                log.error("Cannot fetch dataset {0} into {1}: {2}".format(self.name, self.root, e))
+                self.status = 'failed'
+            else:
+                start_time = time.time()
+                log.info("Fetching dataset {0} ({1} bytes) into {2}".format(
+                    self.name, manifest['size'], self.root))
+                self.status = 'running'
+                if self.server:
+                    self.server.add_dataset(self.name, self.dataset)
+                self._last_fetch = time.time()
+                self._announce()
+                downloaders = [threading.Thread(target=self._download)
+                               for _ in range(self.max_downloads)]
+                for t in downloaders:
+                    t.daemon = True
+                    t.start()
+                for t in downloaders:
+                    t.join()
+                self._announce()
+                if len(self.dataset.have) == self.dataset.num_chunks:
+                    log.info("Fetched dataset {0} in {1:.0f} seconds ({2})".format(
+                        self.name, time.time() - start_time, self.chunks_from))
+                    self.status = 'completed'
+                    if self.server:
+                        t = threading.Thread(target=self._heartbeat)
+                        t.daemon = True
+                        t.start()
+                elif self._failed:
+                    log.error("Could not fetch dataset {0} ({1}% fetched)".format(
+                        self.name, self.progress))
+                    self.status = 'failed'
+                else:
+                    log.debug("Stopped fetching dataset {0} at {1}%".format(
+                        self.name, self.progress))
+                    self.status = 'stopped'
+        if self.callback:
+            self.callback()
@@ -0,0 +1,131 @@
+"""
+Pre-warming of block devices.
+
+Volumes restored from snapshots are loaded lazily from object storage, so the
+first read of any block is many times slower than subsequent ones. Reading
+the whole device once, ahead of its users, takes that cost up front.
+"""
+import os
+import threading
+import time
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Number of concurrent readers
+DEFAULT_PREWARM_THREADS = 8
+# Number of bytes read at a time
+DEFAULT_PREWARM_CHUNK_SIZE = 1024 * 1024
+# Maximum read rate, in bytes per second (``0`` for no limit)
+DEFAULT_PREWARM_RATE = 100 * 1024 * 1024
+
+
+class PrewarmDevice(threading.Thread):
+
+    """
+    Read every block of `device` with `threads` concurrent readers, at no
+    more than `max_rate` bytes per second overall. The progress is available
+    in `status` (``pending``, ``running``, ``completed``, ``stopped`` or
+    ``failed``) and `progress` (a percentage). After the thread finishes
+    execution, `callback` method will be called, unless pre-warming was
+    stopped (i.e., the device is going away).
+    """
+
+    def __init__(self, device, threads=DEFAULT_PREWARM_THREADS,
+                 chunk_size=DEFAULT_PREWARM_CHUNK_SIZE, max_rate=DEFAULT_PREWARM_RATE,
+                 callback=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device = device
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.max_rate = max_rate
+        self.callback = callback
+        self.status = 'pending'
+        self.size = None
+        self.bytes_read = 0
+        self.lock = threading.Lock()
+        self._next_offset = 0
+        self._start_time = None
+        self._stopped = False
+        self._errors = []
+
+    @property
+    def progress(self):
+        """Percentage of the device that has been read."""
+        if not self.size:
+            return 0
+        return int(100 * self.bytes_read / self.size)
+
+    def stop(self):
+        """Stop reading the device (e.g., because it is going away)."""
+        with self.lock:
+            self._stopped = True
+
+    def _next_chunk(self):
+        """
+        Return the offset of the next chunk to read, once the rate limit
+        allows it, or ``None`` if there is nothing more to read.
+        """
+        with self.lock:
+            if self._stopped or self._errors or self._next_offset >= self.size:
+                return None
+            offset = self._next_offset
+            self._next_offset += self.chunk_size
+        if self.max_rate:
+            delay = self._start_time + float(offset) / self.max_rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return offset
+
+    def _read_chunks(self):
+        try:
+            fd = os.open(self.device, os.O_RDONLY)
+            try:
+                while True:
+                    offset = self._next_chunk()
+                    if offset is None:
+                        return
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    n = len(os.read(fd, self.chunk_size))
+                    with self.lock:
+                        self.bytes_read += n
+            finally:
+                os.close(fd)
+        except OSError, e:
+            with self.lock:
+                self._errors.append(e)
+
+    def run(self):
+        try:
+            fd = os.open(self.device, os.O_RDONLY)
+            try:
+                self.size = os.lseek(fd, 0, os.SEEK_END)
+            finally:
+                os.close(fd)
+        except OSError, e:
+            log.error("Cannot pre-warm device {0}: {1}".format(self.device, e))
+            self.status = 'failed'
+        else:
+            log.info("Pre-warming device {0} ({1} bytes)".format(self.device, self.size))
+            self.status = 'running'
+            self._start_time = time.time()
+            readers = [threading.Thread(target=self._read_chunks) for _ in range(self.threads)]
+            for t in readers:
+                t.daemon = True
+                t.start()
+            for t in readers:
+                t.join()
+            if self._errors:
+                log.error("Error pre-warming device {0}: {1}".format(self.device, self._errors[0]))
+                self.status = 'failed'
+            elif self._stopped:
+                log.debug("Stopped pre-warming device {0} at {1}%"
+                          .format(self.device, self.progress))
+                self.status = 'stopped'
+            else:
+                log.info("Pre-warmed device {0} in {1:.0f} seconds"
+                         .format(self.device, time.time() - self._start_time))
+                self.status = 'completed'
+        if self.callback and self.status != 'stopped':
+            self.callback()
@@ -7,7 +7,9 @@ import logging
 import os
 import os.path
 import pwd
+import re
 import shutil
+import socket
 import subprocess
 import threading
 import time
@@ -18,14 +20,22 @@ from cm.services.apps.hadoop import HadoopService
 from cm.services.apps.htcondor import HTCondorService
 from cm.services.apps.pss import PSSService
 from cm.services.data.filesystem import Filesystem
-from cm.util import comm, misc, paths
+from cm.util import comm, misc, paths, peer_distribution
 from cm.util.bunch import Bunch
 from cm.util.decorators import TestFlag
 from cm.util.manager import BaseConsoleManager
 from cm.util.misc import flock
+from cm.util.mount_table import mount_table
 
 log = logging.getLogger('cloudman')
 
+# Ways a file system shared by the master can be cached on a worker
+WORKER_CACHE_MODES = ['fscache', 'copy', 'peer']
+# Fraction of the local disk's free space a local copy may take up
+LOCAL_COPY_MAX_SPACE = 0.8
+FSCACHE_CONF_FILE = '/etc/cachefilesd.conf'
+FSCACHE_DEFAULTS_FILE = '/etc/default/cachefilesd'
+
 
 # Worker states
 worker_states = Bunch(
@@ -50,6 +60,12 @@ class ConsoleManager(BaseConsoleManager):
         # The following list of current mount points; each list element must
         # have the following structure: (label, local_path, type, server_path)
         self.mount_points = []
+        self.mount_errors = {}  # path -> error, for the paths that failed to mount
+        self.mount_caches = {}  # path -> worker cache mode, for the cached paths
+        self.local_copies = {}  # path -> status of its local copy
+        self.fscache_enabled = False
+        self.peer_server = None  # Serves chunks of FSs fetched from peers to other workers
+        self.peer_lock = threading.Lock()
         self.nfs_data = 0
         self.nfs_tools = 0
         self.nfs_indices = 0
@@ -86,29 +102,49 @@ class ConsoleManager(BaseConsoleManager):
         return "This is a worker node, cluster status not available."
 
     def mount_disk(self, fs_type, server, path, mount_options):
+        """
+        Mount file system of type ``fs_type`` from ``server`` at ``path``
+        with ``mount_options`` (a comma-separated string). If the options
+        include ``nconnect`` but the kernel does not support it, the file
+        system is mounted without it.
+
+        :rtype: tuple
+        :return: The return code of the ``mount`` command (``0`` if the file
+                 system is mounted) and its error output.
+        """
         # If a path is not specific for an nfs server, and only its ip is provided,
         # assume that the target path to mount at is the path on the server as well
         if fs_type == 'nfs' and ':' not in server:
             server = server + ":" + path
         # Before mounting, check if the file system is already mounted
-        mnt_location = commands.getstatusoutput("cat /proc/mounts | grep %s[[:space:]] | cut -d' ' -f1,2" % path)
-        if mnt_location[0] == 0 and mnt_location[1] != '':
-            log.debug("{0} is already mounted; returning code {1}".format(path,
-                                                                          mnt_location[0]))
-            return mnt_location[0]
-        else:
-            log.debug("Mounting fs of type: %s from: %s to: %s..." % (fs_type, server, path))
-            if not os.path.exists(path):
-                os.mkdir(path)
-            options = "-o {0}".format(mount_options) if mount_options else ""
-            ret_code = subprocess.call(
-                "mount -t %s %s %s %s" % (fs_type, options, server, path), shell=True)
-            log.debug("Process mounting '%s' returned code '%s'" % (path, ret_code))
-            return ret_code
+        if mount_table.is_mounted(path):
+            log.debug("{0} is already mounted from {1}".format(
+                path, mount_table.device(path)))
+            return 0, ''
+        log.debug("Mounting fs of type: %s from: %s to: %s..." % (fs_type, server, path))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        ret_code, err = self._mount(fs_type, server, path, mount_options)
+        if ret_code != 0 and mount_options and 'nconnect=' in mount_options:
+            mount_options = ','.join(o for o in mount_options.split(',')
+                                     if not o.startswith('nconnect='))
+            log.debug("Mounting {0} failed ({1}); retrying without nconnect".format(
+                path, err.strip()))
+            ret_code, err = self._mount(fs_type, server, path, mount_options)
+        return ret_code, err
+
+    def _mount(self, fs_type, server, path, mount_options):
+        options = "-o {0}".format(mount_options) if mount_options else ""
+        process = subprocess.Popen("mount -t %s %s %s %s" % (fs_type, options, server, path),
+                                   shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        log.debug("Process mounting '%s' returned code '%s'" % (path, process.returncode))
+        return process.returncode, err
 
     @TestFlag(None)
     def mount_nfs(self, master_ip, mount_json):
         mount_points = []
+        caches = {}
         try:
             # Try to load mount points from json dispatch
             try:
@@ -120,34 +156,49 @@ class ConsoleManager(BaseConsoleManager):
                 for mp in mount_points_dict['mount_points']:
                     # TODO use the actual filesystem name for accounting/status
                     # updates
+                    options = mp.get('mount_options', None)
+                    cache = mp.get('cache', None)
+                    if cache not in WORKER_CACHE_MODES:
+                        if cache:
+                            log.warning("Unknown cache mode '{0}' for {1}; not caching it"
+                                        .format(cache, mp['shared_mount_path']))
+                        cache = None
+                    elif cache == 'fscache' and mp['fs_type'] == 'nfs' and self._enable_fscache():
+                        options = ','.join(o for o in [options, 'fsc'] if o)
+                    caches[mp['shared_mount_path']] = cache
                     mount_points.append((mp['fs_name'], mp['shared_mount_path'],
-                                         mp['fs_type'], mp['server'],
-                                         mp.get('mount_options', None)))
+                                         mp['fs_type'], mp['server'], options))
             else:
                 raise Exception("Mount point parsing failure.")
         except Exception, e:
             log.error("Error mounting devices: {0}\n Attempting to continue, but failure likely...".format(e))
         # Mount SGE regardless of cluster type
-        mount_points.append(('nfs_sge', self.app.path_resolver.sge_root, 'nfs', master_ip, ''))
+        nfs_options = self.app.config.nfs_mount_options
+        mount_points.append(('nfs_sge', self.app.path_resolver.sge_root, 'nfs', master_ip,
+                             nfs_options))
 
         # Mount Hadoop regardless of cluster type
         # mount_points.append(('nfs_hadoop', paths.P_HADOOP_HOME, 'nfs', master_ip, ''))
 
         for i, extra_mount in enumerate(self._get_extra_nfs_mounts()):
-            mount_points.append(('extra_mount_%d' % i, extra_mount, 'nfs', master_ip, ''))
-        # For each main mount point, mount it and set status based on label
-        for (label, path, fs_type, server, mount_options) in mount_points:
-            do_mount = self.app.config.get('mount_%s' % label, True)
-            if not do_mount:
-                log.debug("Skipping FS mount for {0}".format(label))
-                continue
-            log.debug("Mounting FS w/ label '{0}' to path: {1} from server: {2} "
-                      "of type: {3} with mount_options: {4}".format(label, path,
-                                                                    server,
-                                                                    fs_type,
-                                                                    mount_options))
-            ret_code = self.mount_disk(fs_type, server, path, mount_options)
+            mount_points.append(('extra_mount_%d' % i, extra_mount, 'nfs', master_ip,
+                                 nfs_options))
+        to_mount = []
+        for mp in mount_points:
+            if self.app.config.get('mount_%s' % mp[0], True):
+                to_mount.append(mp)
+            else:
+                log.debug("Skipping FS mount for {0}".format(mp[0]))
+        results = self._mount_concurrently(to_mount)
+        # For each main mount point, set status based on label
+        self.mount_errors = {}
+        for (label, path, fs_type, server, mount_options) in to_mount:
+            ret_code, err = results[path]
             status = 1 if int(ret_code) == 0 else -1
+            if status < 0:
+                self.mount_errors[path] = err.strip() or "mount returned code {0}".format(ret_code)
+                log.error("Failed to mount {0} from {1}: {2}".format(
+                    path, server, self.mount_errors[path]))
             # Provide a mapping between the mount point labels and the local fields
             # Given tools & data file systems have been merged, this mapping does
             # not distinguish bewteen those but simply chooses the data field.
@@ -160,12 +211,165 @@ class ConsoleManager(BaseConsoleManager):
             log.debug("Set FS status {0} to {1}".format(labels_to_fields.get(
                 label, label), status))
         # Filter out any differences between new and old mount points and unmount
-        # the extra ones
-        umount_points = [ump for ump in self.mount_points if ump not in mount_points]
-        for (_, old_path, _) in umount_points:
-            self._umount(old_path)
+        # the extra ones; mount points are matched by path only so a change of
+        # mount options does not unmount a file system in use
+        paths = set(mp[1] for mp in mount_points)
+        umount_points = [ump for ump in self.mount_points if ump[1] not in paths]
+        for ump in umount_points:
+            self._umount(ump[1])
         # Update the current list of mount points
         self.mount_points = mount_points
+        self.mount_caches = dict((p, c) for p, c in caches.iteritems() if c)
+        labels = dict((mp[1], mp[0]) for mp in mount_points)
+        for path, cache in self.mount_caches.iteritems():
+            if cache in ('copy', 'peer') and path not in self.local_copies and \
+                    path in results and results[path][0] == 0:
+                entry = mount_table.get(path)
+                if not entry or 'ro' not in entry['options']:
+                    # The file system may change under a local copy
+                    log.error("{0} is not mounted read-only; not making a local copy of it"
+                              .format(path))
+                    self.local_copies[path] = 'failed'
+                    continue
+                self.local_copies[path] = 'copying'
+                t = threading.Thread(target=self._make_local_copy, args=(
+                    path, labels[path] if cache == 'peer' else None))
+                t.daemon = True
+                t.start()
+
+    def _enable_fscache(self):
+        """
+        Make sure the FS-Cache daemon (``cachefilesd``) is running, keeping
+        its cache on the instance's transient disk (``paths.P_FSCACHE_DIR``).
+        Return ``True`` if it is (i.e., if NFS mounts can use ``fsc``).
+        """
+        if self.fscache_enabled:
+            return True
+        if not misc.which('cachefilesd', ['/sbin', '/usr/sbin']):
+            log.warning("cachefilesd is not installed; not using FS-Cache for NFS mounts")
+            return False
+        try:
+            misc.make_dir(paths.P_FSCACHE_DIR)
+            for file_name, pattern, line in [
+                    (FSCACHE_CONF_FILE, r'^#?\s*dir\s.*$', 'dir {0}'.format(paths.P_FSCACHE_DIR)),
+                    (FSCACHE_DEFAULTS_FILE, r'^#?\s*RUN=.*$', 'RUN=yes')]:
+                contents = ''
+                if os.path.exists(file_name):
+                    with open(file_name) as f:
+                        contents = f.read()
+                if re.search(pattern, contents, re.M):
+                    contents = re.sub(pattern, line, contents, count=1, flags=re.M)
+                else:
+                    contents += line + '\n'
+                if not misc.write_file_atomically(file_name, contents):
+                    return False
+        except (IOError, OSError), e:
+            log.error("Error configuring cachefilesd: {0}".format(e))
+            return False
+        self.fscache_enabled = bool(misc.run(
+            "/etc/init.d/cachefilesd restart", "Error starting cachefilesd",
+            "Started cachefilesd with its cache in {0}".format(paths.P_FSCACHE_DIR)))
+        return self.fscache_enabled
+
+    def _make_local_copy(self, path, dataset=None):
+        """
+        Copy the (read-only) file system mounted at ``path`` to the local disk
+        and bind-mount the copy over ``path`` so its files are read locally
+        from then on. Until the copy completes, the file system is used over
+        NFS. The status of the copy is kept in ``self.local_copies``.
+
+        If ``dataset`` is provided, the copy is fetched as that dataset from
+        the master and other workers (see ``_fetch_from_peers``) rather than
+        copied over NFS.
+        """
+        local_path = os.path.join(paths.P_LOCAL_COPIES_DIR, path.strip('/').replace('/', '_'))
+        try:
+            misc.make_dir(local_path)
+            src = os.statvfs(path)
+            dst = os.statvfs(local_path)
+            needed = (src.f_blocks - src.f_bfree) * src.f_frsize
+            available = dst.f_bavail * dst.f_frsize
+        except OSError, e:
+            log.error("Cannot make a local copy of {0}: {1}".format(path, e))
+            self.local_copies[path] = 'failed'
+            return False
+        if needed > available * LOCAL_COPY_MAX_SPACE:
+            log.warning("Not enough local disk space to copy {0} ({1} bytes needed, {2} "
+                        "available); using it over NFS".format(path, needed, available))
+            self.local_copies[path] = 'failed'
+            return False
+        log.info("Copying {0} to {1} ({2} bytes)".format(path, local_path, needed))
+        start_time = time.time()
+        if dataset:
+            ok = self._fetch_from_peers(dataset, local_path)
+        else:
+            ok = misc.run("rsync -a --delete {0}/ {1}/".format(path, local_path),
+                          "Error copying {0} to local disk".format(path), quiet=True)
+        # The file system may have been unmounted while it was being copied
+        if ok and self.local_copies.get(path) == 'copying':
+            ok = misc.run("mount --bind {0} {1} && mount -o remount,ro,bind {1}"
+                          .format(local_path, path),
+                          "Error mounting local copy of {0}".format(path))
+        if ok:
+            log.info("Using local copy of {0} (copied in {1:.0f} seconds)".format(
+                path, time.time() - start_time))
+        self.local_copies[path] = 'completed' if ok else 'failed'
+        return bool(ok)
+
+    def _mount_concurrently(self, mount_points):
+        """
+        Mount all the ``mount_points`` (tuples as in ``self.mount_points``)
+        concurrently. A mount point nested under another one is mounted only
+        after the enclosing one.
+
+        :rtype: dict
+        :return: A dict mapping each path to a tuple of the ``mount`` return
+                 code and error output (see ``mount_disk``).
+        """
+        results = {}
+        paths = [mp[1].rstrip('/') for mp in mount_points]
+
+        def depth(path):
+            return len([p for p in paths if p != path and path.startswith(p + '/')])
+
+        def mount(label, path, fs_type, server, mount_options):
+            log.debug("Mounting FS w/ label '{0}' to path: {1} from server: {2} "
+                      "of type: {3} with mount_options: {4}".format(label, path, server,
+                                                                    fs_type, mount_options))
+            try:
+                results[path] = self.mount_disk(fs_type, server, path, mount_options)
+            except Exception, e:
+                results[path] = (-1, str(e))
+        for level in sorted(set(depth(p) for p in paths)):
+            threads = [threading.Thread(target=mount, args=mp) for mp in mount_points
+                       if depth(mp[1].rstrip('/')) == level]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return results
+
+    def _fetch_from_peers(self, dataset, local_path):
+        """
+        Fetch ``dataset`` into ``local_path`` from the master and the other
+        workers, serving the fetched chunks to the other workers in turn.
+        Return ``True`` if the whole dataset was fetched.
+        """
+        with self.peer_lock:
+            if self.peer_server is None:
+                try:
+                    self.peer_server = peer_distribution.PeerServer()
+                except socket.error, e:
+                    log.error("Cannot serve file system chunks to other workers: {0}".format(e))
+                    return False
+                self.peer_server.start()
+        fetcher = peer_distribution.PeerFetcher(
+            'http://{0}:{1}'.format(self.app.config['master_ip'],
+                                    peer_distribution.DEFAULT_PEER_PORT),
+            dataset, local_path, server=self.peer_server, address='{0}:{1}'.format(
+                self.app.cloud_interface.get_private_ip(), self.peer_server.port))
+        fetcher.run()
+        return fetcher.status == 'completed'
 
     def unmount_filesystems(self):
         log.info("Unmounting directories: {0}".format(self.mount_points))
@@ -173,6 +377,11 @@ class ConsoleManager(BaseConsoleManager):
             self._umount(mp[1])
 
     def _umount(self, path):
+        if self.local_copies.pop(path, None) == 'completed':
+            # The local copy is mounted over the file system itself
+            ret_code = subprocess.call("umount -l '%s'" % path, shell=True)
+            log.debug("Process unmounting local copy at '%s' returned code '%s'"
+                      % (path, ret_code))
         ret_code = subprocess.call("umount -lf '%s'" % path, shell=True)
         log.debug("Process unmounting '%s' returned code '%s'" % (path, ret_code))
 
@@ -517,7 +726,8 @@ class ConsoleMonitor(object):
             # so send a message to continue the handshake
             if self.app.manager.worker_status != worker_states.READY:
                 mounted = {'transient_nfs': self.app.manager.nfs_tfs}
-                jmounted = json.dumps({'mounted_fs': mounted})
+                jmounted = json.dumps({'mounted_fs': mounted,
+                                       'mount_errors': self.app.manager.mount_errors})
                 msg = "MOUNT_DONE | {0}".format(jmounted)
                 self.app.manager.console_monitor.conn.send(msg)
         elif message.startswith("START_SLURMD"):
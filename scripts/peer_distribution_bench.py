@@ -0,0 +1,113 @@
+"""
+Compare the time it takes to distribute a dataset to a number of workers
+from the master alone with the time it takes with the workers also serving
+each other (see ``cm.util.peer_distribution``).
+
+Every peer (the master and each worker) runs in its own process with its
+upload rate capped to simulate the instances' network links, e.g.::
+
+    python scripts/peer_distribution_bench.py --size 128 --rate 32 -n 1 2 4 8 16
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cm.util import peer_distribution as pd  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def make_dataset(root, size, file_size=32 * MB):
+    """Create a dataset of ``size`` bytes of random data in ``root``."""
+    os.makedirs(root)
+    for i in range(0, size, file_size):
+        with open(os.path.join(root, 'part{0:04d}'.format(i // file_size)), 'wb') as f:
+            for _ in range(0, min(file_size, size - i), MB):
+                f.write(os.urandom(MB))
+
+
+def seed(root, chunk_size, rate, ready):
+    manifest = pd.build_manifest(root, chunk_size)
+    server = pd.PeerServer(port=0, host='127.0.0.1', tracker=pd.PeerTracker(), max_rate=rate)
+    address = '127.0.0.1:{0}'.format(server.port)
+    server.add_dataset('bench', pd.Dataset(root, manifest, complete=True))
+    server.tracker.add_dataset('bench', manifest, address)
+    server.start()
+    ready.put(address)
+    while True:
+        time.sleep(60)
+
+
+def worker(tracker, root, rate, share, done):
+    server, address = None, None
+    if share:
+        server = pd.PeerServer(port=0, host='127.0.0.1', max_rate=rate)
+        address = '127.0.0.1:{0}'.format(server.port)
+        server.start()
+    fetcher = pd.PeerFetcher('http://' + tracker, 'bench', root, server=server,
+                             address=address)
+    fetcher.run()
+    done.put((fetcher.status, time.time()))
+    # Keep serving the other workers until all are done
+    while True:
+        time.sleep(60)
+
+
+def distribute(tmp, seed_root, num_workers, chunk_size, rate, share):
+    """
+    Distribute the dataset in ``seed_root`` to ``num_workers`` workers and
+    return the number of seconds until the last one had all of it.
+    """
+    ready, done = multiprocessing.Queue(), multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=seed, args=(seed_root, chunk_size, rate, ready))]
+    procs[0].start()
+    tracker = ready.get()
+    start_time = time.time()
+    for i in range(num_workers):
+        root = os.path.join(tmp, 'worker{0}'.format(i))
+        procs.append(multiprocessing.Process(target=worker,
+                                             args=(tracker, root, rate, share, done)))
+        procs[-1].start()
+    results = [done.get() for _ in range(num_workers)]
+    for p in procs:
+        p.terminate()
+    for i in range(num_workers):
+        shutil.rmtree(os.path.join(tmp, 'worker{0}'.format(i)))
+    if any(status != 'completed' for status, _ in results):
+        raise Exception("Not all workers fetched the dataset: {0}".format(results))
+    return max(t for _, t in results) - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=128, help="Dataset size, in MB")
+    parser.add_argument('--chunk-size', type=int, default=4, help="Chunk size, in MB")
+    parser.add_argument('--rate', type=int, default=32,
+                        help="Upload rate of each peer, in MB per second")
+    parser.add_argument('-n', '--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help="Numbers of workers to distribute the dataset to")
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        seed_root = os.path.join(tmp, 'seed')
+        make_dataset(seed_root, args.size * MB)
+        print "{0:>8} {1:>14} {2:>14} {3:>8}".format("workers", "master only", "peers", "speedup")
+        for n in args.workers:
+            master_only = distribute(tmp, seed_root, n, args.chunk_size * MB,
+                                     args.rate * MB, False)
+            peers = distribute(tmp, seed_root, n, args.chunk_size * MB, args.rate * MB, True)
+            print "{0:>8} {1:>13.1f}s {2:>13.1f}s {3:>7.1f}x".format(
+                n, master_only, peers, master_only / peers)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
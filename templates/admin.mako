@@ -391,7 +391,11 @@
         <% } else if (kind == "Volume" && status === "Configuring") { %>
             <% if (snapshot_status != "" && snapshot_status != null) { %>
                 Snapshot status: <%= snapshot_status %>; progress: <%= snapshot_progress %>
+            <% } else if (progress) { %>
+                <%= progress %>
             <% } %></td>
+        <% } else if ((status === "Starting" || status === "Configuring") && progress) { %>
+            <%= progress %>
         <% } %></td>
         <td class="fs-td-15pct">
             <!-- // Enable removal while a file system is 'Available' or 'Error' -->
@@ -0,0 +1,44 @@
+import time
+
+import cm.util.misc  # noqa: F401 (imported first to avoid a circular import)
+from cm.master import ConsoleMonitor
+from cm.services import ServiceType
+from cm.util.bunch import Bunch
+
+
+class FakeFilesystem(object):
+    svc_type = ServiceType.FILE_SYSTEM
+
+    def __init__(self, name, mount_point, events, delay=0.2):
+        self.name = name
+        self.mount_point = mount_point
+        self.progress = None
+        self.events = events
+        self.delay = delay
+
+    def get_full_name(self):
+        return "FS-{0}".format(self.name)
+
+    def add(self):
+        self.events.append(('start', self.name, time.time()))
+        time.sleep(self.delay)
+        self.events.append(('done', self.name, time.time()))
+        return True
+
+
+def test_file_systems_are_added_concurrently_respecting_nesting():
+    monitor = ConsoleMonitor.__new__(ConsoleMonitor)
+    monitor.app = Bunch()
+    events = []
+    galaxy = FakeFilesystem('galaxy', '/mnt/galaxy', events)
+    indices = FakeFilesystem('galaxyIndices', '/mnt/galaxyIndices', events)
+    tools = FakeFilesystem('tools', '/mnt/galaxy/tools', events)
+    start = time.time()
+    assert monitor._add_file_systems([tools, indices, galaxy])
+    # The independent file systems are provisioned at the same time and the
+    # nested one right after its parent
+    assert time.time() - start < 0.55
+    times = dict(((e, n), t) for e, n, t in events)
+    assert abs(times[('start', 'galaxy')] - times[('start', 'galaxyIndices')]) < 0.1
+    assert times[('start', 'tools')] >= times[('done', 'galaxy')]
+    assert tools.progress == "Waiting for FS-galaxy"
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from StringIO import StringIO
+
+from mock import patch
+
+from cm.util import ExtractArchive
+from cm.util.archive_cache import ArchiveCache
+from cm.util.bunch import Bunch
+
+CONTENTS = 'x' * 5000
+
+
+def _archive():
+    buf = StringIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        info = tarfile.TarInfo('data.txt')
+        info.size = len(CONTENTS)
+        tar.addfile(info, StringIO(CONTENTS))
+    return buf.getvalue()
+
+
+def _get(archive):
+    calls = []
+
+    def get(url, headers=None, stream=False, timeout=None):
+        calls.append(url)
+        return Bunch(status_code=200, headers={'content-length': str(len(archive))},
+                     raw=StringIO(archive), raise_for_status=lambda: None,
+                     close=lambda: None)
+    get.calls = calls
+    return get
+
+
+def test_archive_is_downloaded_once_and_extraction_reused():
+    archive = _archive()
+    md5 = hashlib.md5(archive).hexdigest()
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = ArchiveCache(os.path.join(tmp, 'cache'), 10 ** 6)
+        get = _get(archive)
+        with patch('requests.get', get):
+            for target in ['a', 'b', 'b']:
+                ExtractArchive('http://x/a.tar', os.path.join(tmp, target), md5,
+                               cache=cache).run()
+        # Downloaded for 'a' only; extracted from the cache for 'b' and
+        # the second extraction to 'b' is skipped altogether
+        assert len(get.calls) == 1
+        for target in ['a', 'b']:
+            with open(os.path.join(tmp, target, 'data.txt')) as f:
+                assert f.read() == CONTENTS
+            assert ArchiveCache.is_extracted(os.path.join(tmp, target),
+                                             cache.key('http://x/a.tar', md5))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_corrupt_download_is_not_cached():
+    archive = _archive()
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = ArchiveCache(os.path.join(tmp, 'cache'), 10 ** 6)
+        with patch('requests.get', _get(archive)):
+            ExtractArchive('http://x/a.tar', os.path.join(tmp, 'a'), 'bad-md5',
+                           cache=cache, num_retries=0).run()
+        assert os.listdir(cache.path) == []
+        assert not ArchiveCache.is_extracted(os.path.join(tmp, 'a'),
+                                             cache.key('http://x/a.tar', 'bad-md5'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_least_recently_used_archives_are_evicted():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = ArchiveCache(tmp, 250)
+        for i, key in enumerate(['k1', 'k2']):
+            out = cache.start_entry(key, 100)
+            out.write('x' * 100)
+            cache.finish_entry(key, out, True)
+            os.utime(cache._entry(key), (time.time() - 100 + i, time.time() - 100 + i))
+        assert cache.lookup('k1')  # k1 is now the most recently used
+        out = cache.start_entry('k3', 100)
+        out.write('x' * 100)
+        cache.finish_entry('k3', out, True)
+        assert sorted(os.listdir(tmp)) == ['k1', 'k3']
+        assert cache.start_entry('k4', 300) is None
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_key_uses_etag_without_md5():
+    cache = ArchiveCache('/tmp/unused', 10)
+    with patch('requests.head', return_value=Bunch(ok=True, headers={'etag': '"abc"'})):
+        assert cache.key('http://x/a.tar') == cache.key('http://x/a.tar')
+    with patch('requests.head', return_value=Bunch(ok=True, headers={})):
+        assert cache.key('http://x/a.tar') is None
+
+
+def test_concurrent_entries_for_the_same_archive_do_not_collide():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = ArchiveCache(tmp, 10 ** 6)
+        first, second = cache.start_entry('k1', 100), cache.start_entry('k1', 100)
+        assert first.name != second.name
+        first.write('a' * 100)
+        second.write('b' * 50)
+        cache.finish_entry('k1', second, False)
+        cache.finish_entry('k1', first, True)
+        assert os.listdir(tmp) == ['k1']
+        with open(cache.lookup('k1')) as f:
+            assert f.read() == 'a' * 100
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cache_is_disabled_unless_a_directory_is_set():
+    assert ArchiveCache.from_config(Bunch(archive_cache_dir=None, archive_cache_size=20)) is None
+    cache = ArchiveCache.from_config(Bunch(archive_cache_dir='/data/cache', archive_cache_size=1))
+    assert (cache.path, cache.max_size) == ('/data/cache', 1024 ** 3)
@@ -0,0 +1,197 @@
+from datetime import datetime
+
+from mock import Mock, patch
+
+from cm.config import Configuration
+from cm.services.autoscale import AutoscaleService, plan_instances
+from cm.services.apps.jobmanagers.sgeinfo import SGEInfo
+from cm.services.apps.jobmanagers.slurminfo import SlurmInfo
+from cm.util.bunch import Bunch
+from cm.util.misc import mem_to_mb
+
+SPECS = [
+    {'key': 'c3.large', 'cpus': 2, 'memory': 4096, 'price': 0.105},
+    {'key': 'c3.2xlarge', 'cpus': 8, 'memory': 15360, 'price': 0.42},
+    {'key': 'r3.2xlarge', 'cpus': 8, 'memory': 62464, 'price': 0.665},
+]
+
+SQUEUE_OUT = """PENDING|2015-06-01T10:00:00|4|64G|main*|(Resources)
+RUNNING|2015-06-01T09:00:00|2|2000|main*|w1
+PENDING|2015-06-01T11:00:00|8|4G|main*|(ReqNodeNotAvail, UnavailableNodes:w1)
+PENDING|2015-06-01T11:00:00|N/A|?|main*|(Nodes required for job are DOWN, DRAINED)"""
+
+QSTAT_XML = """<?xml version='1.0'?>
+<job_info>
+  <queue_info>
+    <Queue-List>
+      <name>all.q@w1</name>
+      <slots_used>1</slots_used>
+      <slots_total>2</slots_total>
+      <job_list state="running">
+        <JB_job_number>1</JB_job_number>
+        <JAT_start_time>2015-06-01T09:00:00</JAT_start_time>
+        <queue_name>all.q@w1</queue_name>
+        <slots>1</slots>
+      </job_list>
+    </Queue-List>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>2</JB_job_number>
+      <JB_submission_time>2015-06-01T10:00:00</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>2</slots>
+      <hard_request name="h_vmem" resource_contribution="0.0">4G</hard_request>
+      <hard_req_queue>long.q</hard_req_queue>
+    </job_list>
+  </job_info>
+</job_info>"""
+
+
+def test_mem_to_mb():
+    assert mem_to_mb('4000') == 4000
+    assert mem_to_mb('500M') == 500
+    assert mem_to_mb('2G') == 2048
+    assert mem_to_mb('N/A') == 0
+
+
+def test_plan_large_job_gets_one_large_instance():
+    plan = plan_instances([{'cpus': 4, 'memory': 64 * 1024 / 2}], SPECS)
+    assert plan == ['r3.2xlarge']
+
+
+def test_plan_packs_small_jobs_onto_cheapest_instances():
+    jobs = [{'cpus': 1, 'memory': 1024}] * 3
+    assert plan_instances(jobs, SPECS) == ['c3.large', 'c3.large']
+
+
+def test_plan_skips_jobs_that_fit_nowhere():
+    jobs = [{'cpus': 64, 'memory': 0}, {'cpus': 1, 'memory': 0}]
+    assert plan_instances(jobs, SPECS) == ['c3.large']
+
+
+def test_slurm_jobs_carry_requirements():
+    with patch('commands.getoutput', return_value=SQUEUE_OUT):
+        jobs = SlurmInfo().jobs
+    assert jobs[0]['job_cpus'] == 4
+    assert jobs[0]['job_mem'] == 64 * 1024
+    assert jobs[0]['job_queue'] == 'main'
+    assert jobs[1]['job_mem'] == 2000
+    # Reasons with spaces do not shift the other fields
+    assert jobs[2]['req_node_not_avail']
+    assert jobs[2]['job_cpus'] == 8
+    assert jobs[2]['job_mem'] == 4096
+    assert not jobs[3]['req_node_not_avail']
+    assert jobs[3]['job_cpus'] == 0
+    assert jobs[3]['job_mem'] == 0
+    assert jobs[3]['job_queue'] == 'main'
+
+
+def test_sge_jobs_carry_requirements():
+    jobs = SGEInfo().parse_qstat(QSTAT_XML)['jobs']
+    running, pending = jobs
+    assert running['job_queue'] == 'all.q'
+    assert running['job_mem'] == 0
+    assert pending['job_cpus'] == 2
+    assert pending['job_mem'] == 8192
+    assert pending['job_queue'] == 'long.q'
+
+
+def test_instance_type_specs_from_default_names():
+    config = Configuration(None, {}, {'cloud_name': 'amazon'})
+    specs = dict((spec['key'], spec) for spec in config.instance_type_specs)
+    assert specs['c3.2xlarge']['cpus'] == 8
+    assert specs['c3.2xlarge']['memory'] == 15 * 1024
+    assert specs['c3.2xlarge']['price'] == 0.42
+    assert 'custom_instance_type' not in specs
+
+
+def _autoscale_service(num_workers, as_min, as_max, jobs=[], num_booting=0):
+    manager = Mock()
+    manager.worker_instances = [Mock(worker_status='Ready', num_cpus=2)
+                                for _ in range(num_workers)]
+    manager.worker_instances += [Mock(worker_status='Pending')
+                                 for _ in range(num_booting)]
+    manager.get_idle_instances.return_value = []
+    manager.get_num_available_workers.return_value = num_workers
+    manager.service_registry.active.return_value = [Mock(jobs=Mock(return_value=jobs))]
+    config = Bunch(autoscaling_by_job_requirements=False, instance_type_specs=SPECS,
+                   autoscaling_max_instances_per_step=10)
+    app = Bunch(manager=manager, config=config)
+    return AutoscaleService(app, as_min=as_min, as_max=as_max, instance_type='c3.large')
+
+
+def _pending_jobs(num_jobs, cpus=1):
+    return [{'job_state': 'pending', 'job_cpus': cpus,
+             'time_job_entered_state': datetime.now()}] * num_jobs
+
+
+def test_decision_log_records_scale_up():
+    svc = _autoscale_service(num_workers=0, as_min=2, as_max=4)
+    svc.status()
+    log = svc.get_decision_log()
+    assert log['counters']['evaluations'] == 1
+    assert log['counters']['scale_up'] == 1
+    assert log['counters']['instances_added'] == 2
+    decision = log['history'][-1]
+    assert decision['rule'] == 'below_min'
+    assert decision['action'] == 'up'
+    assert decision['instance_types'] == ['c3.large', 'c3.large']
+    svc.app.manager.add_instances.assert_called_once_with(2, instance_type='c3.large')
+
+
+def test_decision_log_records_scale_down_and_is_bounded():
+    svc = _autoscale_service(num_workers=3, as_min=0, as_max=1)
+    svc.status()
+    decision = svc.get_decision_log()['history'][-1]
+    assert decision['rule'] == 'above_max'
+    assert decision['action'] == 'down'
+    assert decision['instances'] == 2
+    for _ in range(svc.decisions.max + 5):
+        svc.status()
+    assert len(svc.get_decision_log()['history']) == svc.decisions.max
+    assert len(svc.get_decision_log(10)['history']) == 10
+
+
+def test_evaluation_queries_job_manager_at_most_once():
+    svc = _autoscale_service(num_workers=2, as_min=0, as_max=4)
+    svc.status()
+    job_manager = svc.app.manager.service_registry.active.return_value[0]
+    assert job_manager.jobs.call_count <= 1
+    assert svc.app.manager.get_idle_instances.call_count == 1
+    decision = svc.get_decision_log()['history'][-1]
+    assert decision['action'] == 'none'
+    assert decision['idle_nodes'] == 0
+    # Also when the scale-up is planned from the pending jobs' requirements
+    jobs = [dict(job, job_mem=4096, req_node_not_avail=True)
+            for job in _pending_jobs(2, cpus=4)]
+    svc = _autoscale_service(num_workers=2, as_min=0, as_max=4, jobs=jobs)
+    svc.app.config.autoscaling_by_job_requirements = True
+    svc.status()
+    job_manager = svc.app.manager.service_registry.active.return_value[0]
+    assert job_manager.jobs.call_count == 1
+    decision = svc.get_decision_log()['history'][-1]
+    assert decision['action'] == 'up'
+    assert decision['instance_types'] == ['c3.2xlarge']
+
+
+def test_scale_up_step_follows_backlog():
+    # 9 queued slots on 2-CPU instances need 5 instances
+    svc = _autoscale_service(num_workers=1, as_min=0, as_max=20, jobs=_pending_jobs(9))
+    assert svc.get_num_instances_to_add() == 5
+
+
+def test_scale_up_step_is_capped():
+    svc = _autoscale_service(num_workers=1, as_min=0, as_max=20, jobs=_pending_jobs(500))
+    assert svc.get_num_instances_to_add() == 10
+    svc = _autoscale_service(num_workers=1, as_min=0, as_max=4, jobs=_pending_jobs(500))
+    assert svc.get_num_instances_to_add() == 3
+
+
+def test_scale_up_step_accounts_for_booting_instances():
+    svc = _autoscale_service(num_workers=1, as_min=0, as_max=20,
+                             jobs=_pending_jobs(4, cpus=2), num_booting=3)
+    assert svc.get_num_instances_to_add() == 1
+    svc = _autoscale_service(num_workers=1, as_min=0, as_max=20,
+                             jobs=_pending_jobs(4, cpus=2), num_booting=4)
+    assert svc.get_num_instances_to_add() == 0
@@ -0,0 +1,45 @@
+from tempfile import NamedTemporaryFile
+
+from boto.exception import S3ResponseError
+from mock import Mock, patch
+
+from cm.util import misc
+
+
+def _save_cluster_config(s3_conn):
+    # The S3 calls made by ``ConsoleMonitor.store_cluster_config``
+    if not misc.bucket_exists(s3_conn, 'cm-cluster'):
+        misc.create_bucket(s3_conn, 'cm-cluster')
+    local_file = NamedTemporaryFile()
+    for name in ['persistent_data.yaml', 'cm_boot.py', 'cm.tar.gz', 'test.clusterName']:
+        assert misc.save_file_to_bucket(s3_conn, 'cm-cluster', name, local_file.name)
+
+
+def test_bucket_is_looked_up_once():
+    s3_conn = Mock()
+    bucket = s3_conn.get_bucket.return_value
+    with patch('cm.util.misc.Key') as key:
+        _save_cluster_config(s3_conn)
+        assert bucket.get_all_keys.call_count == 1
+        assert key.return_value.set_contents_from_filename.call_count == 4
+        _save_cluster_config(s3_conn)
+        # Only the uploads themselves take requests the second time around
+        assert bucket.get_all_keys.call_count == 1
+        assert key.return_value.set_contents_from_filename.call_count == 8
+        assert misc.get_bucket(s3_conn, 'cm-cluster') is bucket
+
+
+def test_missing_bucket_is_forgotten():
+    s3_conn = Mock()
+    bucket = s3_conn.get_bucket.return_value
+    assert misc.bucket_exists(s3_conn, 'cm-cluster')
+    error = S3ResponseError(404, 'Not Found')
+    error.error_code = 'NoSuchBucket'
+    local_file = NamedTemporaryFile()
+    with patch('cm.util.misc.Key') as key:
+        key.return_value.set_contents_from_filename.side_effect = error
+        assert not misc.save_file_to_bucket(s3_conn, 'cm-cluster', 'cm.tar.gz', local_file.name)
+    assert misc.bucket_cache.get(s3_conn, 'cm-cluster') is None
+    bucket.get_all_keys.side_effect = error
+    assert not misc.bucket_exists(s3_conn, 'cm-cluster')
+    assert misc.get_bucket(s3_conn, 'cm-cluster') is None
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+from mock import patch
+
+from cm.util.bunch import Bunch
+from cm.services.data import volume
+from cm.services.data.volume import DeviceAllocator, Volume, get_device_by_volume_id
+
+
+def _volume(cloud_type='ec2'):
+    vol = Volume.__new__(Volume)
+    vol.app = Bunch(config=Bunch(cloud_type=cloud_type))
+    return vol
+
+
+def test_allocator_hands_out_distinct_devices():
+    allocator = DeviceAllocator()
+    vol = _volume()
+    devices = frozenset(['/dev/xvda', '/dev/xvdf'])
+
+    def next_devices(reserved):
+        return vol._get_likely_next_devices(devices, reserved=reserved)
+
+    first = allocator.reserve('vol-1', next_devices)
+    second = allocator.reserve('vol-2', next_devices)
+    assert first == ('/dev/sdg',)
+    assert second == ('/dev/sdh',)
+    assert allocator.reserved_by_others('vol-1') == frozenset(['/dev/sdh'])
+    allocator.release('vol-1')
+    assert allocator.reserve('vol-3', next_devices) == ('/dev/sdg',)
+
+
+def test_allocator_skips_reserved_virtio_devices():
+    vol = _volume(cloud_type='openstack')
+    devices = frozenset(['/dev/vda', '/dev/vdb'])
+    assert vol._get_likely_next_devices(devices) == ('/dev/vdc',)
+    assert vol._get_likely_next_devices(
+        devices, reserved=frozenset(['/dev/vdc'])) == ('/dev/vdd',)
+
+
+def test_device_by_volume_id():
+    by_id = tempfile.mkdtemp()
+    dev = tempfile.mkdtemp()
+    for name, target in [('nvme-Amazon_Elastic_Block_Store_vol0123456789abcdef0', 'nvme1n1'),
+                         ('nvme-Amazon_Elastic_Block_Store_vol0123456789abcdef0-part1', 'nvme1n1p1'),
+                         ('virtio-6e3c1b6a-1d35-4b2c-9', 'vdc')]:
+        os.symlink(os.path.join(dev, target), os.path.join(by_id, name))
+    with patch.object(volume, 'DISK_BY_ID_DIR', by_id):
+        assert get_device_by_volume_id('vol-0123456789abcdef0') == os.path.join(dev, 'nvme1n1')
+        assert get_device_by_volume_id(
+            '6e3c1b6a-1d35-4b2c-9f43-7a1c2f0c1d2e') == os.path.join(dev, 'vdc')
+        assert get_device_by_volume_id('vol-0000') is None
@@ -0,0 +1,40 @@
+import threading
+import time
+
+from mock import Mock
+
+from cm.util.device_watcher import DeviceWatcher
+
+
+def _watcher():
+    watcher = DeviceWatcher()
+    watcher.started = True  # Do not listen for real device events
+    return watcher
+
+
+def _notify(watcher):
+    with watcher.cond:
+        watcher.events += 1
+        watcher.cond.notify_all()
+
+
+def test_wait_for_wakes_up_on_event():
+    watcher = _watcher()
+    found = []
+    threading.Timer(0.1, lambda: (found.append('/dev/xvdg'), _notify(watcher))).start()
+    start = time.time()
+    assert watcher.wait_for(lambda: found and found[0], 5, initial_delay=5) == '/dev/xvdg'
+    assert time.time() - start < 2
+
+
+def test_wait_for_falls_back_and_gives_up():
+    watcher = _watcher()
+    fallback = Mock(side_effect=[True, False])
+    assert watcher.wait_for(lambda: None, 5, fallback=fallback,
+                            initial_delay=0.01, max_delay=0.02) is None
+    assert fallback.call_count == 2
+
+
+def test_wait_for_times_out():
+    watcher = _watcher()
+    assert watcher.wait_for(lambda: None, 0.1, initial_delay=0.05) is None
@@ -0,0 +1,39 @@
+import threading
+
+from mock import patch
+
+from cm.util.disk_usage import DiskUsageProber, df_size
+
+
+def test_usage_reports_size():
+    usage = DiskUsageProber().usage('/')
+    assert usage['total'] > 0
+    assert usage['used_percent'].endswith('%')
+    assert not usage['stale']
+
+
+def test_df_size_matches_df_h_format():
+    GB = 1024 ** 3
+    assert df_size(0) == '0'
+    assert df_size(20 * GB) == '20G'
+    assert df_size(9.55 * GB) == '9.6G'
+    assert df_size(1.5 * 1024 * GB) == '1.5T'
+    assert df_size(1023.5 * 1024 ** 2) == '1.0G'
+    assert df_size(493 * 1024 ** 2) == '493M'
+
+
+def test_hung_probe_returns_last_good_value():
+    prober = DiskUsageProber(timeout=0.1)
+    good = prober.usage('/')
+    release = threading.Event()
+    with patch('os.statvfs', side_effect=lambda path: release.wait()):
+        usage = prober.usage('/')
+        assert usage['stale']
+        assert usage['total'] == good['total']
+        assert prober.is_stale('/')
+        # No new probe is started while one is hung
+        assert prober.usage('/')['stale']
+        assert prober.usage('/other') is None
+    release.set()
+    prober.hung['/'].join(1)
+    assert not prober.usage('/')['stale']
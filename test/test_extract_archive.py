@@ -0,0 +1,121 @@
+import hashlib
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
+
+from mock import patch
+
+from cm.util import ExtractArchive, ParallelDownload
+from cm.util.bunch import Bunch
+
+CONTENTS = ''.join(chr(i % 251) for i in range(1000))
+
+
+class FlakyRaw(object):
+    """A response body that fails after returning ``fail_after`` bytes."""
+
+    def __init__(self, data, fail_after=None):
+        self.data = StringIO(data)
+        self.fail_after = fail_after
+
+    def read(self, size):
+        if self.fail_after is not None:
+            if self.fail_after <= 0:
+                raise IOError("Connection reset")
+            size = min(size, self.fail_after)
+            self.fail_after -= size
+        return self.data.read(size)
+
+
+def _server(contents, ranged=True, failures=None):
+    """
+    Return a fake ``requests.get`` serving ``contents``. ``failures`` maps
+    the first byte of a range request to the number of bytes sent before
+    the connection fails (once).
+    """
+    failures = dict(failures or {})
+    requests_seen = []
+
+    def get(url, headers=None, stream=False, timeout=None):
+        m = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('Range', ''))
+        if not (ranged and m):
+            return Bunch(status_code=200, headers={'content-length': str(len(contents))},
+                         raw=FlakyRaw(contents), raise_for_status=lambda: None,
+                         close=lambda: None)
+        first, last = int(m.group(1)), min(int(m.group(2)), len(contents) - 1)
+        requests_seen.append(first)
+        return Bunch(status_code=206,
+                     headers={'content-range': 'bytes {0}-{1}/{2}'.format(
+                         first, last, len(contents))},
+                     raw=FlakyRaw(contents[first:last + 1], failures.pop(first, None)),
+                     raise_for_status=lambda: None, close=lambda: None)
+    get.requests_seen = requests_seen
+    return get
+
+
+def test_ranged_download_reassembles_contents_in_order():
+    get = _server(CONTENTS)
+    with patch('requests.get', get):
+        download = ParallelDownload('http://x/a.tar', connections=3, range_size=64,
+                                    max_buffered=2).open()
+        data = ''.join(iter(lambda: download.read(100), ''))
+        download.close()
+    assert download.ranged
+    assert download.size == len(CONTENTS)
+    assert hashlib.md5(data).hexdigest() == hashlib.md5(CONTENTS).hexdigest()
+    assert sorted(get.requests_seen) == range(0, 1000, 64)
+
+
+def test_ranged_download_resumes_interrupted_range():
+    get = _server(CONTENTS, failures={128: 10})
+    with patch('requests.get', get), patch('time.sleep'):
+        download = ParallelDownload('http://x/a.tar', connections=2, range_size=64).open()
+        data = download.read()
+        download.close()
+    assert data == CONTENTS
+    # The interrupted range is resumed from the last byte received
+    assert 138 in get.requests_seen
+
+
+def test_download_without_range_support_streams_contents():
+    with patch('requests.get', _server(CONTENTS, ranged=False)):
+        download = ParallelDownload('http://x/a.tar', range_size=64).open()
+        data = download.read()
+        download.close()
+    assert not download.ranged
+    assert data == CONTENTS
+
+
+def test_download_fails_after_retries():
+    get = _server(CONTENTS, failures=dict((b, 0) for b in range(0, 1000, 64)))
+    with patch('requests.get', get), patch('time.sleep'):
+        download = ParallelDownload('http://x/a.tar', range_size=64, retries=0).open()
+        try:
+            download.read()
+            assert False, "Expected an IOError"
+        except IOError:
+            pass
+        download.close()
+
+
+def test_extract_archive_verifies_md5_while_extracting():
+    buf = StringIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        info = tarfile.TarInfo('data.bin')
+        info.size = len(CONTENTS)
+        tar.addfile(info, StringIO(CONTENTS))
+    archive = buf.getvalue()
+    path = tempfile.mkdtemp()
+    try:
+        with patch('requests.get', _server(archive)):
+            extract = ExtractArchive('http://x/a.tar', path,
+                                     md5_sum=hashlib.md5(archive).hexdigest())
+            digest = extract._extract()
+        assert extract._md5_check_ok(digest)
+        with open(os.path.join(path, 'data.bin')) as f:
+            assert f.read() == CONTENTS
+    finally:
+        shutil.rmtree(path)
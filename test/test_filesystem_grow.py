@@ -0,0 +1,53 @@
+from mock import Mock, patch
+
+from cm.util.bunch import Bunch
+from cm.services.data.filesystem import Filesystem
+
+
+def _filesystem(cloud_type='ec2', fs_type='xfs', grown=True):
+    fs = Filesystem.__new__(Filesystem)
+    fs.app = Bunch(cloud_type=cloud_type, cloud_interface=Mock())
+    fs.name = 'galaxy'
+    fs.mount_point = '/mnt/galaxy'
+    fs.volumes = [Mock(volume_id='vol-0', device='/dev/xvdg')]
+    fs.volumes[0].grow.return_value = grown
+    fs.grow = {'new_size': 20, 'status': 'pending'}
+    return fs
+
+
+def test_can_grow_online():
+    fs = _filesystem()
+    with patch('cm.services.data.filesystem.mount_table') as mt:
+        mt.get.return_value = {'fs_type': 'xfs'}
+        assert fs.can_grow_online()
+        mt.get.return_value = {'fs_type': 'vfat'}
+        assert not fs.can_grow_online()
+        mt.get.return_value = {'fs_type': 'ext4'}
+        fs.volumes.append(Mock(device='/dev/xvdh'))
+        assert not fs.can_grow_online()
+    fs = _filesystem(cloud_type='openstack')
+    assert not fs.can_grow_online()
+
+
+def test_grow_online_grows_mounted_file_system():
+    fs = _filesystem()
+    calls = []
+    with patch('cm.services.data.filesystem.mount_table') as mt, \
+            patch('cm.services.data.filesystem.run',
+                  side_effect=lambda cmd, *args: calls.append(cmd) or True), \
+            patch.object(Filesystem, '_update_size') as update_size:
+        mt.get.return_value = {'fs_type': 'ext4'}
+        assert fs.grow_online()
+    fs.volumes[0].grow.assert_called_once_with(20)
+    assert calls == ['/sbin/resize2fs /dev/xvdg']
+    assert update_size.called
+    assert fs.grow == {}
+
+
+def test_grow_online_falls_back_to_offline_expansion():
+    fs = _filesystem(grown=False)
+    with patch('cm.services.data.filesystem.run') as run:
+        assert not fs.grow_online()
+    assert not run.called
+    assert fs.grow['status'] == 'pending'
+    assert fs.grow['online'] is False
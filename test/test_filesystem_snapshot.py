@@ -0,0 +1,93 @@
+import time
+
+from mock import Mock, patch
+
+from cm.util.bunch import Bunch
+from cm.services.data.filesystem import Filesystem
+
+
+def _filesystem(num_volumes):
+    fs = Filesystem.__new__(Filesystem)
+    fs.app = Bunch(cloud_type='ec2', cloud_interface=Mock())
+    fs.mount_point = '/mnt/galaxy'
+    fs.volumes = []
+    for i in range(num_volumes):
+        vol = Mock(volume_id='vol-{0}'.format(i))
+        vol.start_snapshot.return_value = Bunch(id='snap-{0}'.format(i))
+        fs.volumes.append(vol)
+    return fs
+
+
+def test_snapshot_freezes_and_snapshots_all_volumes():
+    fs = _filesystem(3)
+    calls = []
+    with patch('cm.services.data.filesystem.run',
+               side_effect=lambda cmd, *args: calls.append(cmd) or True), \
+            patch.object(Filesystem, '_track_snapshots') as track:
+        snap_ids = fs.create_snapshot('desc')
+        # Tracking is done in a background thread
+        for _ in range(100):
+            if track.called:
+                break
+            time.sleep(0.01)
+    assert snap_ids == ['snap-0', 'snap-1', 'snap-2']
+    assert calls == ['/sbin/fsfreeze -f /mnt/galaxy', '/sbin/fsfreeze -u /mnt/galaxy']
+    for vol in fs.volumes:
+        vol.start_snapshot.assert_called_once_with(snap_description='desc')
+        assert vol.tag_snapshot.called
+    assert track.called
+
+
+def test_track_snapshots_clears_status_on_completion():
+    fs = _filesystem(2)
+    snapshots = [(vol, vol.start_snapshot.return_value) for vol in fs.volumes]
+    fs.app.cloud_interface.get_all_snapshots.side_effect = [
+        [Bunch(id='snap-0', status='completed', progress='100%'),
+         Bunch(id='snap-1', status='pending', progress='40%')],
+        [Bunch(id='snap-1', status='completed', progress='100%')]]
+    with patch('time.sleep'):
+        fs._track_snapshots(snapshots)
+    assert fs.app.cloud_interface.get_all_snapshots.call_count == 2
+    for vol in fs.volumes:
+        assert vol.snapshot_status is None
+
+
+def test_snapshot_progress_is_reported_on_readded_volumes():
+    fs = _filesystem(1)
+    fs.app.cloud_type = 'openstack'
+    fs.app.manager = Mock()
+    fs.name = 'galaxy'
+    old_vol = fs.volumes[0]
+    old_vol.snapshot_status, old_vol.snapshot_progress = 'pending', '0%'
+    snap = old_vol.start_snapshot.return_value
+    readded = []
+
+    def add_volume(vol_id):
+        vol = Bunch(volume_id=vol_id, snapshot_status=None, snapshot_progress=None)
+        readded.append(vol)
+        fs.volumes.append(vol)
+    fs._Filesystem__remove = Mock(side_effect=lambda **kwargs: fs.volumes.remove(old_vol))
+    fs.add_volume = add_volume
+    with patch.object(Filesystem, '_track_snapshots'):
+        assert fs.create_snapshot() == ['snap-0']
+    assert fs.volumes == readded
+    assert (readded[0].snapshot_status, readded[0].snapshot_progress) == ('pending', '0%')
+    fs.app.cloud_interface.get_all_snapshots.side_effect = [
+        [Bunch(id=snap.id, status='pending', progress='40%')],
+        [Bunch(id=snap.id, status='completed', progress='100%')]]
+    progress = []
+    with patch('time.sleep', side_effect=lambda s: progress.append(fs.volumes[0].snapshot_progress)):
+        fs._track_snapshots([(old_vol, snap)])
+    assert progress == ['0%', '40%']
+    assert fs.volumes[0].snapshot_status is None
+
+
+def test_master_reports_snapshot_progress_while_growing():
+    from cm.master import ConsoleManager
+    manager = ConsoleManager.__new__(ConsoleManager)
+    smaller_vol = Bunch(snapshot_status='pending', snapshot_progress='10%')
+    fs = Bunch(volumes=[], grow={'status': 'in_progress', 'smaller_vol_ids': [smaller_vol]})
+    manager.get_services = Mock(return_value=[fs])
+    assert manager.snapshot_status() == ('pending', '10%')
+    smaller_vol.snapshot_status = None
+    assert manager.snapshot_status() == ('configuring', None)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+from mock import Mock, patch
+
+from cm.util import misc
+from cm.services import service_states
+from cm.services.apps.htcondor import HTCondorService
+
+
+def _service():
+    app = Mock()
+    return HTCondorService(app)
+
+
+def test_modify_htcondor_coalesces_host_updates():
+    svc = _service()
+    with patch.object(svc.reconfig, 'trigger') as trigger:
+        svc.modify_htcondor("ALLOW_WRITE", "10.0.0.1")
+        svc.modify_htcondor("ALLOW_WRITE", "10.0.0.2")
+        svc.modify_htcondor("ALLOW_WRITE", "10.0.0.1")
+        svc.modify_htcondor("FLOCK_TO", "head.example.org", action="r")
+        svc.modify_htcondor("FLOCK_TO", "head.example.org", action="r")
+    assert trigger.call_count == 3
+    lines = svc._render_managed_config().splitlines()
+    assert "ALLOW_WRITE = $(ALLOW_WRITE), 10.0.0.1, 10.0.0.2" in lines
+    assert "FLOCK_TO = head.example.org" in lines
+
+
+def test_apply_managed_config_reconfigures():
+    svc = _service()
+    svc.state = service_states.RUNNING
+    svc.app.path_resolver.condor_reconfig = '/usr/sbin/condor_reconfig'
+    svc.modify_htcondor("ALLOW_WRITE", "10.0.0.1")
+    conf_dir = tempfile.mkdtemp()
+    conf_file = os.path.join(conf_dir, 'managed')
+    with patch('cm.util.paths.P_HTCONDOR_MANAGED_CONFIG_PATH', conf_file), \
+            patch('cm.util.misc.run', return_value=True) as run:
+        svc.reconfig.flush()
+    run.assert_called_once_with("/usr/sbin/condor_reconfig")
+    with open(conf_file) as f:
+        assert "$(ALLOW_WRITE), 10.0.0.1" in f.read()
+
+
+def test_managed_config_is_not_applied_before_condor_runs():
+    svc = _service()
+    svc.state = service_states.STARTING
+    svc.modify_htcondor("ALLOW_WRITE", "10.0.0.1")
+    with patch('cm.util.misc.run') as run, \
+            patch('cm.util.misc.write_file_atomically') as write:
+        svc.reconfig.flush()
+    assert not run.called
+    assert not write.called
+    assert svc.state == service_states.STARTING
+
+
+def test_debouncer_runs_once_per_burst():
+    func = Mock()
+    debouncer = misc.Debouncer(func, 60)
+    debouncer.trigger()
+    debouncer.trigger()
+    debouncer.flush()
+    assert func.call_count == 1
+    assert debouncer.timer is None
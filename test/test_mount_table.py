@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+from cm.util.mount_table import MountTable, parse_mountinfo
+
+MOUNTINFO = """22 1 202:1 / / rw,relatime shared:1 - ext4 /dev/xvda1 rw,discard
+35 22 202:16 / /mnt rw,relatime shared:20 - ext3 /dev/xvdb rw
+40 22 202:96 / /mnt/galaxy rw,noatime shared:22 - xfs /dev/xvdg rw,attr2
+41 22 0:40 /export /mnt/my\\040data rw - nfs4 10.0.0.1:/export rw,vers=4.0
+"""
+
+
+def test_parse_mountinfo():
+    mounts = parse_mountinfo(MOUNTINFO.splitlines())
+    assert mounts['/mnt/galaxy']['device'] == '/dev/xvdg'
+    assert mounts['/mnt/galaxy']['fs_type'] == 'xfs'
+    assert mounts['/mnt/galaxy']['options'] == ['rw', 'noatime', 'attr2']
+    assert mounts['/mnt/my data']['device'] == '10.0.0.1:/export'
+    assert mounts['/mnt/my data']['root'] == '/export'
+
+
+def test_mount_table_lookups():
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as f:
+        f.write(MOUNTINFO)
+    table = MountTable(mountinfo_file=path)
+    assert table.is_mounted('/mnt/galaxy')
+    assert table.is_mounted('/mnt/galaxy/')
+    assert not table.is_mounted('/mnt/galaxyData')
+    assert table.device('/mnt') == '/dev/xvdb'
+    assert 'vers=4.0' in table.options('/mnt/my data')
+    assert table.get_containing('/mnt/galaxy/tools/x')['device'] == '/dev/xvdg'
+    assert table.get_containing('/usr/bin')['mount_point'] == '/'
+    os.remove(path)
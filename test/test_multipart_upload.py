@@ -0,0 +1,166 @@
+import BaseHTTPServer
+import hashlib
+import re
+import SocketServer
+import threading
+import urlparse
+from tempfile import NamedTemporaryFile
+
+from boto.s3.connection import OrdinaryCallingFormat, S3Connection
+from mock import patch
+
+from cm.util import misc
+
+
+class S3StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """
+    A local stand-in for S3 supporting plain and (unless ``multipart`` is
+    unset) multipart object uploads; authentication is not checked. Each
+    request for part number ``fail_part`` fails while ``failures`` is above
+    zero.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), S3StandInHandler)
+        self.objects = {}
+        self.uploads = {}  # upload ID -> {part number: data}
+        self.aborted = []
+        self.multipart = True
+        self.fail_part = None
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return S3Connection('key', 'secret', host='127.0.0.1', port=self.server_address[1],
+                            is_secure=False, calling_format=OrdinaryCallingFormat())
+
+
+class S3StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, body='', etag=None):
+        self.send_response(code)
+        if etag:
+            self.send_header('ETag', '"{0}"'.format(etag))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _request(self):
+        url = urlparse.urlparse(self.path)
+        bucket, key = url.path.lstrip('/').split('/', 1)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return bucket, key, urlparse.parse_qs(url.query, keep_blank_values=True), body
+
+    def do_PUT(self):
+        bucket, key, query, body = self._request()
+        server = self.server
+        with server.lock:
+            if 'uploadId' in query:
+                part_num = int(query['partNumber'][0])
+                if part_num == server.fail_part and server.failures > 0:
+                    server.failures -= 1
+                    return self._reply(400, '<Error><Code>RequestTimeout</Code></Error>')
+                server.uploads[query['uploadId'][0]][part_num] = body
+            else:
+                server.objects[(bucket, key)] = body
+        self._reply(200, etag=hashlib.md5(body).hexdigest())
+
+    def do_GET(self):
+        _, _, query, _ = self._request()
+        with self.server.lock:
+            parts = sorted(self.server.uploads[query['uploadId'][0]].items())
+        self._reply(200, '<ListPartsResult>{0}</ListPartsResult>'.format(''.join(
+            '<Part><PartNumber>{0}</PartNumber><ETag>"{1}"</ETag><Size>{2}</Size></Part>'
+            .format(n, hashlib.md5(data).hexdigest(), len(data)) for n, data in parts)))
+
+    def do_POST(self):
+        bucket, key, query, body = self._request()
+        server = self.server
+        with server.lock:
+            if 'uploads' in query:
+                if not server.multipart:
+                    return self._reply(501, '<Error><Code>NotImplemented</Code></Error>')
+                upload_id = 'upload{0}'.format(len(server.uploads))
+                server.uploads[upload_id] = {}
+                return self._reply(200, (
+                    '<InitiateMultipartUploadResult><Bucket>{0}</Bucket><Key>{1}</Key>'
+                    '<UploadId>{2}</UploadId></InitiateMultipartUploadResult>').format(
+                        bucket, key, upload_id))
+            parts = server.uploads.pop(query['uploadId'][0])
+            numbers = [int(n) for n in re.findall(r'<PartNumber>(\d+)</PartNumber>', body)]
+            server.objects[(bucket, key)] = ''.join(parts[n] for n in numbers)
+        self._reply(200, (
+            '<CompleteMultipartUploadResult><Bucket>{0}</Bucket><Key>{1}</Key>'
+            '<ETag>"etag"</ETag></CompleteMultipartUploadResult>').format(bucket, key))
+
+    def do_DELETE(self):
+        _, _, query, _ = self._request()
+        with self.server.lock:
+            self.server.aborted.append(query['uploadId'][0])
+            self.server.uploads.pop(query['uploadId'][0], None)
+        self._reply(204)
+
+
+def _upload(server, data):
+    local_file = NamedTemporaryFile()
+    local_file.write(data)
+    local_file.flush()
+    with patch.object(misc, 'MULTIPART_THRESHOLD', 4096), \
+            patch.object(misc, 'MULTIPART_PART_SIZE', 1024), \
+            patch.object(misc.time, 'sleep'):
+        return misc.save_file_to_bucket(server.connect(), 'cm-cluster', 'cm.tar.gz',
+                                        local_file.name)
+
+
+def _serve(test):
+    server = S3StandIn()
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        test(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_large_file_is_uploaded_in_parts_with_retries():
+    def test(server):
+        data = ''.join(chr(i % 251) for i in range(10000))
+        server.fail_part, server.failures = 3, 2
+        assert _upload(server, data)
+        assert server.objects[('cm-cluster', 'cm.tar.gz')] == data
+        assert server.failures == 0
+        assert not server.uploads and not server.aborted
+        # Small files are uploaded as a whole
+        assert _upload(server, 'small')
+        assert server.objects[('cm-cluster', 'cm.tar.gz')] == 'small'
+    _serve(test)
+
+
+def test_failed_upload_is_aborted():
+    def test(server):
+        server.fail_part, server.failures = 2, 100
+        assert not _upload(server, 'x' * 10000)
+        assert ('cm-cluster', 'cm.tar.gz') not in server.objects
+        assert server.aborted == ['upload0']
+        assert not server.uploads
+    _serve(test)
+
+
+def test_large_file_is_uploaded_whole_without_multipart_support():
+    def test(server):
+        server.multipart = False
+        data = 'x' * 10000
+        assert _upload(server, data)
+        assert server.objects[('cm-cluster', 'cm.tar.gz')] == data
+        assert not server.uploads
+    _serve(test)
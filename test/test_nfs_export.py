@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+from mock import patch
+
+from cm.util.nfs_export import NFSExport
+
+
+def test_exports_are_written_and_reloaded_once():
+    exports_file = os.path.join(tempfile.mkdtemp(), 'exports.d', 'cloudman.exports')
+    with patch.object(NFSExport, 'ee_file', exports_file), \
+            patch.object(NFSExport, 'nfs_lock_file', exports_file + '.lock'), \
+            patch.object(NFSExport, 'legacy_ee_file', exports_file + '.missing'), \
+            patch.object(NFSExport, 'exports', {}), \
+            patch('cm.util.nfs_export.run', return_value=True) as run:
+        assert NFSExport.add_nfs_share('/mnt/galaxy')
+        assert NFSExport.add_nfs_share('/mnt/galaxy')
+        assert NFSExport.add_nfs_share('/opt/hadoop', permissions='ro')
+        assert NFSExport.remove_nfs_share('/mnt/missing')
+        with open(exports_file) as f:
+            lines = f.readlines()
+        assert lines[1].startswith('/mnt/galaxy\t*(rw,')
+        assert lines[2].startswith('/opt/hadoop\t*(ro,')
+        assert NFSExport.find_mount_point_entry('/opt/hadoop') > -1
+        NFSExport.reload.flush()
+        run.assert_called_once_with("/usr/sbin/exportfs -ra", "Error reloading NFS exports",
+                                    "Successfully reloaded NFS exports")
+        assert NFSExport.remove_nfs_share('/opt/hadoop')
+        assert NFSExport.find_mount_point_entry('/opt/hadoop') == -1
+        NFSExport.reload.flush()
+        assert run.call_count == 2
+
+
+def test_per_file_system_export_options():
+    exports_file = os.path.join(tempfile.mkdtemp(), 'cloudman.exports')
+    with patch.object(NFSExport, 'ee_file', exports_file), \
+            patch.object(NFSExport, 'nfs_lock_file', exports_file + '.lock'), \
+            patch.object(NFSExport, 'legacy_ee_file', exports_file + '.missing'), \
+            patch.object(NFSExport, 'exports', {}), \
+            patch('cm.util.nfs_export.run', return_value=True):
+        assert NFSExport.add_nfs_share('/mnt/transient_nfs',
+                                       options=['async', 'no_wdelay'])
+        assert NFSExport.add_nfs_share('/mnt/galaxy', options='subtree_check,fsid=1')
+        with open(exports_file) as f:
+            lines = f.readlines()
+        assert lines[1] == '/mnt/galaxy\t*(rw,sync,no_root_squash,subtree_check,fsid=1)\n'
+        assert lines[2] == '/mnt/transient_nfs\t*(rw,async,no_root_squash,no_subtree_check,no_wdelay)\n'
+        NFSExport.reload.flush()
+
+
+def test_exports_written_by_earlier_versions_are_removed():
+    tmp = tempfile.mkdtemp()
+    exports_file = os.path.join(tmp, 'exports.d', 'cloudman.exports')
+    legacy_file = os.path.join(tmp, 'exports')
+    with open(legacy_file, 'w') as f:
+        f.write("# /etc/exports: the access control list for filesystems\n"
+                "/mnt/galaxy\t*(rw,sync,no_root_squash,no_subtree_check)\n"
+                "/srv/data 10.0.0.0/8(ro,sync,no_subtree_check)\n"
+                "/opt/sge\t*(rw,sync,no_root_squash,no_subtree_check)\n"
+                "/mnt/old\t*(ro,sync,no_root_squash,no_subtree_check)\n")
+    with patch.object(NFSExport, 'ee_file', exports_file), \
+            patch.object(NFSExport, 'nfs_lock_file', exports_file + '.lock'), \
+            patch.object(NFSExport, 'legacy_ee_file', legacy_file), \
+            patch.object(NFSExport, 'legacy_exports_removed', False), \
+            patch.object(NFSExport, 'exports', {}), \
+            patch('cm.util.nfs_export.run', return_value=True):
+        assert NFSExport.add_nfs_share('/mnt/galaxy')
+        with open(legacy_file) as f:
+            assert f.read() == ("# /etc/exports: the access control list for filesystems\n"
+                                "/srv/data 10.0.0.0/8(ro,sync,no_subtree_check)\n")
+        assert NFSExport.legacy_exports_removed
+        with patch('cm.util.nfs_export.write_file_atomically',
+                   return_value=True) as write:
+            assert NFSExport.remove_nfs_share('/mnt/galaxy')
+        # The legacy file is only cleaned up once
+        write.assert_called_once_with(exports_file, NFSExport._compose_exports())
+        NFSExport.reload.flush()
+
+
+def test_nfsd_threads_are_sized_and_tuned():
+    assert NFSExport.nfsd_thread_count(0, num_cpus=1) == 8
+    assert NFSExport.nfsd_thread_count(10, num_cpus=4) == 40
+    assert NFSExport.nfsd_thread_count(1000, num_cpus=4) == 256
+    tmp = tempfile.mkdtemp()
+    defaults = os.path.join(tmp, 'nfs-kernel-server')
+    threads = os.path.join(tmp, 'threads')
+    with open(defaults, 'w') as f:
+        f.write('# Number of servers to start up\nRPCNFSDCOUNT=8\n')
+    with open(threads, 'w') as f:
+        f.write('8\n')
+    with patch.object(NFSExport, 'nfsd_defaults_file', defaults), \
+            patch.object(NFSExport, 'nfsd_threads_file', threads), \
+            patch.object(NFSExport, 'nfsd_threads', None), \
+            patch('multiprocessing.cpu_count', return_value=2):
+        assert NFSExport.tune_nfsd_threads(20)
+        with open(defaults) as f:
+            assert f.read() == '# Number of servers to start up\nRPCNFSDCOUNT=80\n'
+        with open(threads) as f:
+            assert f.read() == '80\n'
+        with patch('cm.util.nfs_export.write_file_atomically') as write:
+            assert NFSExport.tune_nfsd_threads(20)
+            assert not write.called
+        with patch('cm.util.nfs_export.write_file_atomically', return_value=False):
+            assert not NFSExport.tune_nfsd_threads(30)
+        assert NFSExport.nfsd_threads == 80
+
+
+def test_nfsd_stats():
+    tmp = tempfile.mkdtemp()
+    stats_file = os.path.join(tmp, 'nfsd')
+    pool_stats_file = os.path.join(tmp, 'pool_stats')
+    # As written by a 5.15 kernel with two thread pools; the second field of
+    # the 'th' line is always 0
+    with open(stats_file, 'w') as f:
+        f.write("rc 0 118224 2417311\n"
+                "fh 0 0 0 0 0\n"
+                "io 1915634811 4164425432\n"
+                "th 16 0 0.000 0.000 0.000 0.000 0.000 0.000 0.000 0.000 0.000 0.000\n"
+                "net 2535550 0 2535547 5361\n"
+                "rpc 2535535 0 0 0 0\n"
+                "proc3 22 4 129640 0 49071 43328 64 111907 107650 1004 4 0 0 966 0 1 0 0 "
+                "11097 1276 41 0 107436\n"
+                "proc4 2 3 1906\n"
+                "proc4ops 72 0 0 0 55 0 0 0 0 0 291 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
+                "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
+                "0 0 0 0 0 0 0\n")
+    with open(pool_stats_file, 'w') as f:
+        f.write("# pool packets-arrived sockets-enqueued threads-woken threads-timedout\n"
+                "0 1420339 3412 1416927 85\n"
+                "1 1115211 1790 1113421 41\n")
+    with patch.object(NFSExport, 'nfsd_stats_file', stats_file), \
+            patch.object(NFSExport, 'nfsd_pool_stats_file', pool_stats_file):
+        assert NFSExport.get_nfsd_stats() == {
+            'threads': 16, 'sockets_enqueued': 5202, 'threads_timedout': 126,
+            'calls': 2535535, 'bad_calls': 0, 'retransmits': 0}
+        with patch.object(NFSExport, 'nfsd_pool_stats_file', pool_stats_file + '.missing'):
+            assert NFSExport.get_nfsd_stats() is None
+    with patch.object(NFSExport, 'nfsd_stats_file', stats_file + '.missing'):
+        assert NFSExport.get_nfsd_stats() is None
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+
+from cm.util import peer_distribution as pd
+
+
+def _make_dataset(root):
+    os.makedirs(os.path.join(root, 'a', 'empty'))
+    os.makedirs(os.path.join(root, 'b'))
+    contents = {'a/one': os.urandom(2500), 'a/zero': '', 'b/two': os.urandom(700),
+                'b/three': os.urandom(4096)}
+    for rel_path, data in contents.items():
+        with open(os.path.join(root, rel_path), 'wb') as f:
+            f.write(data)
+    os.symlink('one', os.path.join(root, 'a', 'link'))
+    return contents
+
+
+def _check_copy(root, contents):
+    for rel_path, data in contents.items():
+        with open(os.path.join(root, rel_path), 'rb') as f:
+            assert f.read() == data, rel_path
+    assert os.path.isdir(os.path.join(root, 'a', 'empty'))
+    assert os.readlink(os.path.join(root, 'a', 'link')) == 'one'
+
+
+def test_ranges_round_trip():
+    assert pd.encode_ranges([5, 0, 2, 1, 7, 8]) == '0-2,5,7-8'
+    assert pd.decode_ranges('0-2,5,7-8') == set([0, 1, 2, 5, 7, 8])
+    assert pd.decode_ranges('') == set()
+
+
+def test_chunks_span_files():
+    tmp = tempfile.mkdtemp()
+    try:
+        contents = _make_dataset(tmp)
+        manifest = pd.build_manifest(tmp, chunk_size=1000)
+        assert manifest['size'] == 2500 + 700 + 4096
+        assert len(manifest['chunks']) == 8
+        stream = ''.join(contents[f[0]] for f in manifest['files'])
+        ds = pd.Dataset(tmp, manifest, complete=True)
+        assert ''.join(ds.read_chunk(i) for i in range(8)) == stream
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_workers_fetch_from_each_other():
+    tmp = tempfile.mkdtemp()
+    servers = []
+    try:
+        seed_root = os.path.join(tmp, 'seed')
+        contents = _make_dataset(seed_root)
+        manifest = pd.build_manifest(seed_root, chunk_size=1000)
+        tracker = pd.PeerTracker()
+        seed = pd.PeerServer(port=0, host='127.0.0.1', tracker=tracker)
+        servers.append(seed)
+        seed.start()
+        seed.add_dataset('indices', pd.Dataset(seed_root, manifest, complete=True))
+        seed_address = '127.0.0.1:{0}'.format(seed.port)
+        tracker.add_dataset('indices', manifest, seed_address)
+        tracker_url = 'http://' + seed_address
+
+        def fetch(name):
+            server = pd.PeerServer(port=0, host='127.0.0.1')
+            servers.append(server)
+            server.start()
+            fetcher = pd.PeerFetcher(tracker_url, 'indices', os.path.join(tmp, name),
+                                     server=server, address='127.0.0.1:{0}'.format(server.port))
+            fetcher.run()
+            return fetcher
+
+        first = fetch('first')
+        assert first.status == 'completed'
+        assert first.progress == 100
+        _check_copy(os.path.join(tmp, 'first'), contents)
+        # With the seed turning everyone away, the second worker can only
+        # fetch from the first one
+        seed.max_uploads = 0
+        second = fetch('second')
+        assert second.status == 'completed'
+        assert second.chunks_from.keys() == [first.address]
+        _check_copy(os.path.join(tmp, 'second'), contents)
+    finally:
+        for server in servers:
+            server.stop()
+        shutil.rmtree(tmp)
+
+
+def _seed(tmp, manifest_hook=None):
+    seed_root = os.path.join(tmp, 'seed')
+    _make_dataset(seed_root)
+    manifest = pd.build_manifest(seed_root, chunk_size=1000)
+    tracker = pd.PeerTracker()
+    seed = pd.PeerServer(port=0, host='127.0.0.1', tracker=tracker)
+    seed.start()
+    seed.add_dataset('indices', pd.Dataset(seed_root, dict(manifest), complete=True))
+    if manifest_hook:
+        manifest_hook(manifest)
+    tracker.add_dataset('indices', manifest, '127.0.0.1:{0}'.format(seed.port))
+    return seed, tracker
+
+
+def test_fetch_gives_up_on_a_chunk_that_keeps_failing():
+    tmp = tempfile.mkdtemp()
+    try:
+        def corrupt(manifest):
+            manifest['chunks'] = ['0' * 40] + manifest['chunks'][1:]
+        seed, _ = _seed(tmp, corrupt)
+        try:
+            fetcher = pd.PeerFetcher('http://127.0.0.1:{0}'.format(seed.port), 'indices',
+                                     os.path.join(tmp, 'copy'))
+            with patch.object(pd, 'FAILED_PEER_DELAY', 0):
+                fetcher.run()
+        finally:
+            seed.stop()
+        assert fetcher.status == 'failed'
+        assert fetcher.chunk_failures == {0: pd.MAX_CHUNK_FAILURES}
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_completed_peer_keeps_announcing_while_serving():
+    tmp = tempfile.mkdtemp()
+    try:
+        seed, tracker = _seed(tmp)
+        server = pd.PeerServer(port=0, host='127.0.0.1')
+        server.start()
+        address = '127.0.0.1:{0}'.format(server.port)
+        try:
+            with patch.object(pd, 'PEER_TIMEOUT', 0.3), \
+                    patch.object(pd, 'HEARTBEAT_INTERVAL', 0.05):
+                fetcher = pd.PeerFetcher('http://127.0.0.1:{0}'.format(seed.port), 'indices',
+                                         os.path.join(tmp, 'copy'), server=server,
+                                         address=address)
+                fetcher.run()
+                assert fetcher.status == 'completed'
+                time.sleep(0.6)
+                assert address in tracker.announce('indices', None, [])
+                server.stop()
+                time.sleep(0.6)
+                assert address not in tracker.announce('indices', None, [])
+        finally:
+            seed.stop()
+    finally:
+        shutil.rmtree(tmp)
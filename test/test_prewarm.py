@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+from mock import Mock, patch
+
+from cm.util.prewarm import PrewarmDevice
+
+
+def _device(size):
+    fd, path = tempfile.mkstemp()
+    os.write(fd, 'x' * size)
+    os.close(fd)
+    return path
+
+
+def test_prewarm_reads_whole_device():
+    device = _device(10000)
+    try:
+        callback = Mock()
+        prewarmer = PrewarmDevice(device, threads=3, chunk_size=1024, max_rate=0,
+                                  callback=callback)
+        prewarmer.run()
+    finally:
+        os.remove(device)
+    assert prewarmer.status == 'completed'
+    assert prewarmer.size == prewarmer.bytes_read == 10000
+    assert prewarmer.progress == 100
+    assert callback.called
+
+
+def test_prewarm_is_rate_limited():
+    device = _device(4096)
+    delays = []
+    try:
+        prewarmer = PrewarmDevice(device, threads=1, chunk_size=1024, max_rate=1024)
+        with patch('time.sleep', side_effect=delays.append):
+            prewarmer.run()
+    finally:
+        os.remove(device)
+    assert prewarmer.status == 'completed'
+    # The first chunk is read right away; each subsequent one a second later
+    assert len(delays) == 3
+    assert [round(d) for d in delays] == [1, 2, 3]
+
+
+def test_prewarm_of_missing_device_fails():
+    callback = Mock()
+    prewarmer = PrewarmDevice('/nonexistent/device', callback=callback)
+    prewarmer.run()
+    assert prewarmer.status == 'failed'
+    assert callback.called
+
+
+def test_stopped_prewarm_does_not_call_back():
+    device = _device(10000)
+    try:
+        callback = Mock()
+        prewarmer = PrewarmDevice(device, threads=1, chunk_size=1024, max_rate=0,
+                                  callback=callback)
+        prewarmer.stop()
+        prewarmer.run()
+    finally:
+        os.remove(device)
+    assert prewarmer.status == 'stopped'
+    assert not callback.called
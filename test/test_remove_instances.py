@@ -0,0 +1,134 @@
+import threading
+from StringIO import StringIO
+
+from boto.exception import EC2ResponseError
+from mock import Mock, patch
+
+import cm.util.misc as misc
+from cm.clouds import CloudInterface
+from cm.clouds.ec2 import EC2Interface
+from cm.master import ConsoleManager
+from cm.services.apps.jobmanagers import BaseJobManager
+from cm.services.apps.jobmanagers.slurmctld import SlurmctldService
+from cm.util import cluster_status
+from cm.util.bunch import Bunch
+
+NOT_FOUND = """<?xml version="1.0" encoding="UTF-8"?>
+<Response><Errors><Error><Code>InvalidInstanceID.NotFound</Code>
+<Message>The instance ID '{0}' does not exist</Message></Error></Errors>
+<RequestID>1</RequestID></Response>"""
+
+ETC_HOSTS = """127.0.0.1 localhost
+10.0.0.1 w1 ip-10-0-0-1
+10.0.0.2 w2 ip-10-0-0-2
+10.0.0.3 w3 ip-10-0-0-3
+10.0.0.20 w20
+"""
+
+
+def _instance(id, alias):
+    inst = Mock(id=id, alias=alias, private_ip='10.0.0.{0}'.format(alias[1:]))
+    inst.is_spot.return_value = False
+    return inst
+
+
+def test_remove_from_etc_hosts_removes_all_hosts_at_once():
+    written = []
+
+    def run(cmd):
+        if cmd.endswith(' /etc/hosts'):
+            written.append(open(cmd.split()[1]).read())
+        return True
+    with patch('cm.util.misc.open', create=True, return_value=StringIO(ETC_HOSTS)), \
+            patch.object(misc, 'run', side_effect=run):
+        misc.remove_from_etc_hosts(['10.0.0.1', '10.0.0.2', None])
+    assert written == ["127.0.0.1 localhost\n10.0.0.3 w3 ip-10-0-0-3\n10.0.0.20 w20\n"]
+
+
+def test_slurm_removes_nodes_with_one_update():
+    svc = SlurmctldService.__new__(SlurmctldService)
+    with patch.object(misc, 'run', return_value=True) as run, \
+            patch.object(SlurmctldService, '_reconfigure_cluster', return_value=True) as reconf:
+        assert svc.remove_nodes([_instance('i-1', 'w1'), _instance('i-2', 'w2')])
+    assert run.call_count == 1
+    assert 'NodeName=w1,w2 ' in run.call_args[0][0]
+    assert reconf.call_count == 1
+
+
+def test_job_managers_remove_nodes_one_at_a_time_by_default():
+    svc = BaseJobManager.__new__(BaseJobManager)
+    instances = [_instance('i-1', 'w1'), _instance('i-2', 'w2')]
+    with patch.object(BaseJobManager, 'remove_node', side_effect=[True, False]) as remove:
+        assert not svc.remove_nodes(instances)
+    assert [c[0][0] for c in remove.call_args_list] == instances
+
+
+def test_remove_instance_batch_terminates_instances_with_one_request():
+    manager = ConsoleManager.__new__(ConsoleManager)
+    job_manager = Mock()
+    cloud = Mock()
+    cloud.bulk_terminate_instances.return_value = ['i-1']
+    manager.app = Bunch(cloud_interface=cloud, config=Bunch(worker_pool_size=0))
+    manager.service_registry = Mock()
+    manager.service_registry.active.return_value = [job_manager]
+    manager.cluster_status = cluster_status.READY
+    manager.worker_pool = []
+    manager.sync_etc_hosts = Mock()
+    instances = [_instance('i-1', 'w1'), _instance('i-2', 'w2')]
+    manager.worker_instances = list(instances)
+    with patch.object(misc, 'remove_from_etc_hosts') as remove_from_etc_hosts:
+        manager.remove_instance_batch(instances)
+        for t in threading.enumerate():
+            if t is not threading.current_thread() and not t.daemon:
+                t.join(5)
+    job_manager.remove_nodes.assert_called_once_with(instances)
+    remove_from_etc_hosts.assert_called_once_with(['10.0.0.1', '10.0.0.2'])
+    assert manager.sync_etc_hosts.call_count == 1
+    cloud.bulk_terminate_instances.assert_called_once_with(['i-1', 'i-2'], [])
+    instances[0].terminated.assert_called_once_with(True)
+    instances[1].terminated.assert_called_once_with(False)
+    assert all(inst.worker_status == 'Stopping' for inst in instances)
+
+
+def _ec2(conn):
+    ec2 = EC2Interface.__new__(EC2Interface)
+    ec2.app = Bunch(TESTFLAG=False, LOCALFLAG=False)
+    ec2.get_ec2_connection = Mock(return_value=conn)
+    return ec2
+
+
+def test_bulk_terminate_skips_instances_that_no_longer_exist():
+    conn = Mock()
+
+    def terminate_instances(instance_ids):
+        if 'i-gone' in instance_ids:
+            raise EC2ResponseError(400, 'Bad Request', NOT_FOUND.format('i-gone'))
+    conn.terminate_instances.side_effect = terminate_instances
+    conn.get_all_instances.return_value = [
+        Bunch(instances=[Bunch(id='i-1', state='shutting-down'),
+                         Bunch(id='i-2', state='running')])]
+    with patch('time.sleep'):
+        terminated = _ec2(conn).bulk_terminate_instances(['i-1', 'i-gone', 'i-2'])
+    assert sorted(terminated) == ['i-1', 'i-gone']
+    assert conn.terminate_instances.call_args_list[-1][0][0] == ['i-1', 'i-2']
+
+
+def test_bulk_terminate_falls_back_to_single_requests():
+    conn = Mock()
+    conn.terminate_instances.side_effect = EC2ResponseError(503, 'Unavailable', '')
+    ec2 = _ec2(conn)
+    ec2._terminate_instance = Mock(side_effect=[True, False])
+    assert ec2.bulk_terminate_instances(['i-1', 'i-2']) == ['i-1']
+
+
+def test_bulk_terminate_in_test_mode():
+    ec2 = EC2Interface.__new__(EC2Interface)
+    ec2.app = Bunch(TESTFLAG=True, LOCALFLAG=False)
+    assert ec2.bulk_terminate_instances(['i-1', 'i-2']) == ['i-1', 'i-2']
+
+
+def test_bulk_terminate_defaults_to_terminating_one_at_a_time():
+    cloud = CloudInterface.__new__(CloudInterface)
+    cloud.terminate_instance = Mock(side_effect=lambda i, s=None: i != 'i-2')
+    assert cloud.bulk_terminate_instances(['i-1', 'i-2', 'i-3'], ['sir-1']) == ['i-1', 'i-3']
+    cloud.terminate_instance.assert_any_call(None, 'sir-1')
@@ -0,0 +1,64 @@
+from mock import Mock, patch
+
+from cm.util.bunch import Bunch
+from cm.services.data import transient_storage
+from cm.services.data.transient_storage import TransientStorage
+
+
+def _storage(devices):
+    ts = TransientStorage.__new__(TransientStorage)
+    ts.fs = Bunch(mount_point='/mnt/transient_nfs')
+    ts.app = Bunch(cloud_interface=Mock())
+    ts.app.cloud_interface.get_ephemeral_devices.return_value = devices
+    return ts
+
+
+def _mount(ts, label_device=False, in_use=()):
+    calls = []
+
+    def run(cmd, *args, **kwargs):
+        calls.append(cmd)
+        if cmd.startswith('/sbin/blkid'):
+            return label_device
+        return True
+    with patch('cm.util.misc.run', side_effect=run), \
+            patch.object(transient_storage, 'mount_table') as mt, \
+            patch.object(transient_storage, '_os_device', side_effect=lambda n: '/dev/xvd' + n[2:]), \
+            patch.object(transient_storage, '_device_in_use', side_effect=lambda d: d in in_use), \
+            patch('os.chown'):
+        mt.is_mounted.return_value = False
+        result = ts._mount_ephemeral_devices()
+    return result, calls[1:]
+
+
+def test_unused_ephemeral_disks_are_combined_into_raid0():
+    ts = _storage(['sdb', 'sdc', 'sdd'])
+    ok, calls = _mount(ts, in_use=['/dev/xvdb'])
+    assert ok
+    assert calls == [
+        '/sbin/mdadm --create /dev/md/cm_transient --run --level=0 --chunk=256 '
+        '--raid-devices=2 /dev/xvdc /dev/xvdd',
+        '/sbin/mkfs.xfs -f -L cm_transient -d su=256k,sw=2 /dev/md/cm_transient',
+        '/bin/mount -o noatime /dev/md/cm_transient /mnt/transient_nfs']
+
+
+def test_single_unused_ephemeral_disk_is_used_as_is():
+    ts = _storage(['sdb', 'sdc'])
+    ok, calls = _mount(ts, in_use=['/dev/xvdb'])
+    assert ok
+    assert calls == ['/sbin/mkfs.xfs -f -L cm_transient /dev/xvdc',
+                     '/bin/mount -o noatime /dev/xvdc /mnt/transient_nfs']
+
+
+def test_no_unused_ephemeral_disks_keeps_default_storage():
+    ts = _storage(['sdb'])
+    ok, calls = _mount(ts, in_use=['/dev/xvdb'])
+    assert not ok
+    assert calls == []
+
+
+def test_existing_transient_device_is_mounted_as_is():
+    ts = _storage(['sdb', 'sdc', 'sdd'])
+    ok, calls = _mount(ts, label_device='/dev/md127\n')
+    assert ok
+    assert calls == ['/bin/mount -o noatime /dev/md127 /mnt/transient_nfs']
@@ -0,0 +1,59 @@
+import time
+
+from boto.exception import EC2ResponseError
+from mock import Mock, patch
+
+from cm.util.bunch import Bunch
+from cm.services.data import volume
+from cm.services.data.volume import Volume
+from cm.util.device_watcher import DeviceWatcher
+
+
+def _boto_volume(vol_id, status='available'):
+    return Bunch(id=vol_id, status=status)
+
+
+def test_volume_inventory_refreshes_all_volumes_at_once():
+    inventory = volume.VolumeInventory(max_age=60)
+    cloud = Mock()
+    cloud.get_all_volumes.side_effect = lambda volume_ids: [
+        _boto_volume(v) for v in volume_ids]
+    assert inventory.get(cloud, 'vol-1').id == 'vol-1'
+    assert inventory.get(cloud, 'vol-2').id == 'vol-2'
+    assert inventory.get(cloud, 'vol-1').id == 'vol-1'
+    assert inventory.get(cloud, 'vol-2').id == 'vol-2'
+    assert cloud.get_all_volumes.call_count == 2
+    inventory.invalidate()
+    inventory.get(cloud, 'vol-1')
+    cloud.get_all_volumes.assert_called_with(volume_ids=['vol-1', 'vol-2'])
+    assert cloud.get_all_volumes.call_count == 3
+
+
+def test_volume_inventory_drops_missing_volumes():
+    inventory = volume.VolumeInventory(max_age=60)
+    cloud = Mock()
+
+    def get_all_volumes(volume_ids):
+        if 'vol-gone' in volume_ids:
+            raise EC2ResponseError(400, 'Bad Request', body=(
+                '<Response><Errors><Error><Code>InvalidVolume.NotFound</Code>'
+                '<Message>gone</Message></Error></Errors></Response>'))
+        return [_boto_volume(v) for v in volume_ids]
+    cloud.get_all_volumes.side_effect = get_all_volumes
+    inventory.get(cloud, 'vol-1')
+    assert inventory.get(cloud, 'vol-gone') is None
+    assert inventory.get(cloud, 'vol-1').id == 'vol-1'
+
+
+def test_device_wait_aborts_on_multiple_new_devices():
+    vol = Volume.__new__(Volume)
+    vol.volume = Bunch(id='vol-1')
+    pre_devices = frozenset(['/dev/xvda'])
+    vol._get_device_list = Mock(return_value=pre_devices | frozenset(['/dev/xvdg', '/dev/xvdh']))
+    watcher = DeviceWatcher()
+    watcher.started = True  # Do not listen for real device events
+    start = time.time()
+    with patch.object(volume, 'device_watcher', watcher), \
+            patch.object(volume, 'get_device_by_volume_id', return_value=None):
+        assert vol._wait_for_device('/dev/xvdf', pre_devices) is None
+    assert time.time() - start < 5
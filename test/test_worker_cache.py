@@ -0,0 +1,52 @@
+import json
+
+from mock import Mock, patch
+
+import cm.util.misc  # noqa: F401 (imported first to avoid a circular import)
+from cm.instance import Instance
+from cm.services.data.filesystem import Filesystem
+from cm.util.bunch import Bunch
+
+
+def _filesystem(read_only):
+    fs = Filesystem.__new__(Filesystem)
+    fs.name = 'refdata'
+    fs.mount_point = '/mnt/refdata'
+    fs.read_only = read_only
+    fs.nfs_export_options = None
+    fs.nfs_mount_options = None
+    fs.worker_cache = None
+    return fs
+
+
+def test_local_copies_are_only_made_of_read_only_file_systems():
+    fs = _filesystem(read_only=False)
+    assert fs.set_worker_cache('fscache')
+    assert fs.worker_cache == 'fscache'
+    for cache in ['copy', 'peer']:
+        assert not fs.set_worker_cache(cache)
+        assert fs.worker_cache is None
+    fs = _filesystem(read_only=True)
+    assert fs.set_worker_cache('copy')
+    assert fs.worker_cache == 'copy'
+
+
+def test_read_only_file_systems_are_exported_and_mounted_read_only():
+    fs = _filesystem(read_only=True)
+    fs.state = None
+    with patch('cm.services.data.filesystem.NFSExport.add_nfs_share',
+               return_value=True) as add_nfs_share:
+        fs.nfs_share_and_set_state()
+    add_nfs_share.assert_called_once_with('/mnt/refdata', permissions='ro', options=None)
+    fs.nfs_fs = fs.gluster_fs = None
+    fs.get_details = lambda: {'mount_point': fs.mount_point, 'name': fs.name}
+    conn = Mock()
+    inst = Instance.__new__(Instance)
+    inst.id = 'i-1'
+    inst.app = Bunch(config=Bunch(nfs_mount_options='noatime'),
+                     cloud_interface=Bunch(get_private_ip=lambda: '10.0.0.1'),
+                     manager=Bunch(get_services=lambda svc_type: [fs],
+                                   console_monitor=Bunch(conn=conn)))
+    inst.send_mount_points()
+    mount_points = json.loads(conn.send.call_args[0][0].split(' | ', 1)[1])['mount_points']
+    assert mount_points[0]['mount_options'] == 'ro,noatime'
@@ -0,0 +1,128 @@
+import json
+import threading
+
+from mock import patch
+
+from cm.util.bunch import Bunch
+from cm.worker import ConsoleManager
+
+
+class Config(dict):
+    nfs_mount_options = 'rsize=1048576,nconnect=4'
+
+
+def _manager():
+    manager = ConsoleManager.__new__(ConsoleManager)
+    manager.app = Bunch(config=Config(), path_resolver=Bunch(sge_root='/opt/sge'),
+                        TESTFLAG=False, LOCALFLAG=False)
+    manager.mount_points = []
+    manager.mount_errors = {}
+    manager.mount_caches = {}
+    manager.local_copies = {}
+    manager.fscache_enabled = False
+    manager._get_extra_nfs_mounts = lambda: []
+    return manager
+
+
+def test_file_systems_are_mounted_concurrently_with_errors_per_path():
+    manager = _manager()
+    calls = []
+    lock = threading.Lock()
+
+    def mount_disk(fs_type, server, path, options):
+        with lock:
+            calls.append((path, options))
+        if path == '/mnt/galaxyIndices':
+            return 32, 'mount.nfs: access denied\n'
+        return 0, ''
+    mount_json = json.dumps({'mount_points': [
+        {'fs_name': 'galaxy', 'shared_mount_path': '/mnt/galaxy', 'fs_type': 'nfs',
+         'server': '10.0.0.1', 'mount_options': 'noatime'},
+        {'fs_name': 'galaxyIndices', 'shared_mount_path': '/mnt/galaxyIndices',
+         'fs_type': 'nfs', 'server': '10.0.0.1', 'mount_options': 'actimeo=600'},
+        {'fs_name': 'scratch', 'shared_mount_path': '/mnt/galaxy/scratch',
+         'fs_type': 'nfs', 'server': '10.0.0.1', 'mount_options': None}]})
+    with patch.object(manager, 'mount_disk', side_effect=mount_disk):
+        manager.mount_nfs('10.0.0.1', mount_json)
+    assert sorted(calls) == [('/mnt/galaxy', 'noatime'),
+                             ('/mnt/galaxy/scratch', None),
+                             ('/mnt/galaxyIndices', 'actimeo=600'),
+                             ('/opt/sge', 'rsize=1048576,nconnect=4')]
+    # The nested mount point is mounted after the enclosing one
+    paths = [c[0] for c in calls]
+    assert paths.index('/mnt/galaxy/scratch') > paths.index('/mnt/galaxy')
+    assert manager.nfs_data == 1
+    assert manager.nfs_indices == -1
+    assert manager.mount_errors == {'/mnt/galaxyIndices': 'mount.nfs: access denied'}
+
+
+def test_mount_falls_back_without_nconnect():
+    manager = _manager()
+    results = [(32, 'mount.nfs: an incorrect mount option was specified\n'), (0, '')]
+    with patch('cm.worker.mount_table') as mt, \
+            patch('os.path.exists', return_value=True), \
+            patch.object(manager, '_mount', side_effect=results) as mount:
+        mt.is_mounted.return_value = False
+        assert manager.mount_disk('nfs', '10.0.0.1', '/mnt/galaxy',
+                                  'rsize=1048576,nconnect=4,noatime') == (0, '')
+    assert mount.call_args_list[1][0] == ('nfs', '10.0.0.1:/mnt/galaxy', '/mnt/galaxy',
+                                          'rsize=1048576,noatime')
+
+
+def test_cached_file_systems_use_fscache_or_a_local_copy():
+    manager = _manager()
+    calls = []
+    mount_json = json.dumps({'mount_points': [
+        {'fs_name': 'galaxy', 'shared_mount_path': '/mnt/galaxy', 'fs_type': 'nfs',
+         'server': '10.0.0.1', 'mount_options': 'noatime', 'cache': 'fscache'},
+        {'fs_name': 'galaxyIndices', 'shared_mount_path': '/mnt/galaxyIndices',
+         'fs_type': 'nfs', 'server': '10.0.0.1', 'mount_options': 'ro', 'cache': 'copy'},
+        {'fs_name': 'refdata', 'shared_mount_path': '/mnt/refdata',
+         'fs_type': 'nfs', 'server': '10.0.0.1', 'mount_options': 'ro', 'cache': 'peer'},
+        {'fs_name': 'scratch', 'shared_mount_path': '/mnt/scratch',
+         'fs_type': 'nfs', 'server': '10.0.0.1', 'mount_options': None, 'cache': 'copy'}]})
+    mounted = {}
+
+    def mount_disk(fs_type, server, path, options):
+        calls.append((path, options))
+        mounted[path] = {'options': (options or 'rw').split(',')}
+        return 0, ''
+    with patch.object(manager, 'mount_disk', side_effect=mount_disk), \
+            patch('cm.worker.mount_table', Bunch(get=mounted.get)), \
+            patch.object(manager, '_enable_fscache', return_value=True), \
+            patch.object(manager, '_make_local_copy') as make_local_copy:
+        manager.mount_nfs('10.0.0.1', mount_json)
+        # Mount points are re-sent periodically; the copy is made only once
+        manager.mount_nfs('10.0.0.1', mount_json)
+    assert ('/mnt/galaxy', 'noatime,fsc') in calls
+    assert ('/mnt/galaxyIndices', 'ro') in calls
+    assert manager.mount_caches == {'/mnt/galaxy': 'fscache', '/mnt/galaxyIndices': 'copy',
+                                    '/mnt/refdata': 'peer', '/mnt/scratch': 'copy'}
+    # Copies of 'peer' file systems are fetched as the FS-named dataset
+    assert sorted(c[0] for c in make_local_copy.call_args_list) == [
+        ('/mnt/galaxyIndices', None), ('/mnt/refdata', 'refdata')]
+    # File systems mounted read-write are not copied
+    assert manager.local_copies['/mnt/scratch'] == 'failed'
+
+
+def test_local_copy_is_unmounted_before_the_file_system():
+    manager = _manager()
+    manager.local_copies = {'/mnt/galaxyIndices': 'completed'}
+    with patch('subprocess.call', return_value=0) as call:
+        manager._umount('/mnt/galaxyIndices')
+    assert [c[0][0] for c in call.call_args_list] == ["umount -l '/mnt/galaxyIndices'",
+                                                      "umount -lf '/mnt/galaxyIndices'"]
+    assert manager.local_copies == {}
+
+
+def test_only_mount_points_no_longer_sent_are_unmounted():
+    manager = _manager()
+    manager.mount_points = [('galaxy', '/mnt/galaxy', 'nfs', '10.0.0.1', 'noatime'),
+                            ('old', '/mnt/old', 'nfs', '10.0.0.1', None)]
+    mount_json = json.dumps({'mount_points': [
+        {'fs_name': 'galaxy', 'shared_mount_path': '/mnt/galaxy', 'fs_type': 'nfs',
+         'server': '10.0.0.1', 'mount_options': 'noatime,actimeo=600'}]})
+    with patch.object(manager, 'mount_disk', return_value=(0, '')), \
+            patch.object(manager, '_umount') as umount:
+        manager.mount_nfs('10.0.0.1', mount_json)
+    umount.assert_called_once_with('/mnt/old')
@@ -0,0 +1,156 @@
+import threading
+
+from mock import patch
+
+import cm.util.misc as misc
+import cm.instance
+from cm.instance import Instance
+from cm.master import ConsoleManager
+from cm.util import cluster_status
+from cm.util.bunch import Bunch
+
+
+class FakeBotoInstance(object):
+
+    def __init__(self, id, state='running', **tags):
+        self.id = id
+        self.state = state
+        self.tags = tags
+        self.ip_address = None
+        self.instance_type = 'c3.large'
+        self.root_device_type = 'ebs'
+
+    def update(self):
+        pass
+
+
+class FakeCloud(object):
+
+    def __init__(self, *instances):
+        self.instances = dict((inst.id, inst) for inst in instances)
+        self.started = []
+        self.terminated = []
+
+    def get_all_instances(self, instance_id=None, filters=None):
+        if filters:
+            return [Bunch(instances=self.instances.values())]
+        return [Bunch(instances=[self.instances[instance_id]])]
+
+    def get_tag(self, resource, key):
+        return resource.tags.get(key)
+
+    def add_tag(self, resource, key, value):
+        resource.tags[key] = value
+
+    def stop_instance(self, instance_id):
+        self.instances[instance_id].state = 'stopping'
+        return True
+
+    def start_instances(self, instance_ids):
+        self.started.extend(instance_ids)
+        return True
+
+    def terminate_instance(self, instance_id, spot_request_id=None):
+        self.terminated.append(instance_id)
+        return True
+
+
+def _manager(cloud, pool_size=2):
+    manager = ConsoleManager.__new__(ConsoleManager)
+    manager.app = Bunch(cloud_interface=cloud, number_generator=misc.get_a_number(),
+                        config=Bunch(worker_pool_size=pool_size), manager=manager,
+                        TESTFLAG=False, LOCALFLAG=False)
+    manager.worker_instances = []
+    manager.worker_pool = []
+    manager.master_exec_host = True
+    manager.cluster_status = cluster_status.READY
+    manager._cm_archive_version = 'md5-current'
+    return manager
+
+
+def test_restored_pool_keeps_aliases_and_drops_outdated_workers():
+    cloud = FakeCloud(FakeBotoInstance('i-1', 'stopped', alias='w5', cm_archive='md5-current'),
+                      FakeBotoInstance('i-2', 'stopping', alias='w2', cm_archive='md5-current'),
+                      FakeBotoInstance('i-3', 'stopped', alias='w9', cm_archive='md5-old'),
+                      FakeBotoInstance('i-4', 'running'))
+    manager = _manager(cloud)
+    manager.app.config = {'cluster_name': 'test'}
+    instances = manager.get_worker_instances()
+    assert [inst.id for inst in instances] == ['i-4']
+    assert sorted(inst.alias for inst in manager.worker_pool) == ['w2', 'w5']
+    assert cloud.terminated == ['i-3']
+    # New workers are not given the alias of a pooled one
+    new_aliases = [Instance(manager.app).alias for _ in range(5)]
+    assert all(int(alias[1:]) > 5 for alias in new_aliases)
+
+
+def test_only_stopped_pooled_workers_are_started():
+    stopping = FakeBotoInstance('i-1', 'stopping')
+    stopped = FakeBotoInstance('i-2', 'stopped')
+    cloud = FakeCloud(stopping, stopped)
+    manager = _manager(cloud)
+    for boto_inst in [stopping, stopped]:
+        inst = Instance(manager.app, inst=boto_inst, m_state=boto_inst.state)
+        inst.type = 'c3.large'
+        manager.worker_pool.append(inst)
+    assert manager.start_pooled_instances(2, 'c3.large') == 1
+    assert cloud.started == ['i-2']
+    assert [inst.id for inst in manager.worker_instances] == ['i-2']
+    assert [inst.id for inst in manager.worker_pool] == ['i-1']
+    # Once stopped, the other one can be started as well
+    stopping.state = 'stopped'
+    assert manager.start_pooled_instances(2, 'c3.large') == 1
+    assert cloud.started == ['i-2', 'i-1']
+    assert not manager.worker_pool
+
+
+def _stop(boto_inst, states):
+    cloud = FakeCloud(boto_inst)
+    manager = _manager(cloud)
+    inst = Instance(manager.app, inst=boto_inst, m_state='running')
+    manager.worker_instances.append(inst)
+    states = iter(states)
+
+    def sleep(seconds):
+        boto_inst.state = next(states)
+    with patch.object(cm.instance.time, 'sleep', side_effect=sleep):
+        inst.stop()
+        for t in threading.enumerate():
+            if t is not threading.current_thread() and not t.daemon:
+                t.join(5)
+    return manager, cloud, inst
+
+
+def test_worker_is_pooled_once_stopped():
+    boto_inst = FakeBotoInstance('i-1')
+    manager, cloud, inst = _stop(boto_inst, ['stopping', 'stopped'])
+    assert manager.worker_pool == [inst]
+    assert inst.worker_status == 'Stopped'
+    assert not manager.worker_instances
+    assert boto_inst.tags['cm_archive'] == 'md5-current'
+    assert not cloud.terminated
+
+
+def test_worker_that_does_not_stop_is_terminated():
+    manager, cloud, inst = _stop(FakeBotoInstance('i-1'), ['terminated'])
+    assert not manager.worker_pool
+    assert cloud.terminated == ['i-1']
+    assert not manager.worker_instances
+
+
+def test_pool_size_is_respected():
+    manager = _manager(FakeCloud(), pool_size=1)
+    workers = []
+    for i in range(3):
+        inst = Instance(manager.app, inst=FakeBotoInstance('i-{0}'.format(i)))
+        inst.joined = True
+        inst.worker_status = 'Stopping'
+        workers.append(inst)
+    manager.worker_instances = workers
+    workers[2].joined = False
+    assert not manager._can_pool_instance(workers[2])
+    assert manager._can_pool_instance(workers[0])
+    assert not manager._can_pool_instance(workers[1])
+    manager.cluster_status = cluster_status.SHUTTING_DOWN
+    manager.app.config.worker_pool_size = 5
+    assert not manager._can_pool_instance(workers[1])